@@ -1,96 +1,93 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import random
 import time
-import cv2
 import numpy as np
 import threading
 import traceback
-from collections import deque
-from flask import Flask, Response, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
+from flask_cors import CORS
 import flask_socketio
 # import eventlet # Keep commented out unless specifically needed and tested
 from flask_socketio import SocketIO
-from openai import OpenAI
+# cv2, mediapipe and openai are imported on first use (backends.py, detection.py, llm_client.py)
 
 # --- Configuration Loading ---
 try:
     from config import (
-        RTSP_URL, SOCKET_PORT, CAMERA_NAME, MODEL_PATH, CLASSES_PATH,
-        INPUT_WIDTH, INPUT_HEIGHT, CONFIDENCE_THRESHOLD, SCORE_THRESHOLD, NMS_THRESHOLD
+        RTSP_URL, SOCKET_PORT, CAMERA_NAME, STREAM_MODE, DVR_ENABLED, RECORD_LANDMARKS, print_config,
+        INFERENCE_BACKEND, BACKEND_BENCHMARK, TARGET_FPS as TARGET_FPS_SETTING, MAX_TARGET_FPS,
+        DEFAULT_JPEG_QUALITY, AUTO_QUALITY,
+        RECONNECT_BASE_SECONDS, RECONNECT_MAX_SECONDS, STALL_TIMEOUT_SECONDS, WARM_STANDBY,
+        WATCHDOG_GRACE_SECONDS, SHUTDOWN_TIMEOUT_SECONDS, TRACE_SAMPLE_EVERY, TRACE_PING_SECONDS,
+        BATCH_DIR, BATCH_MAX_UPLOAD_MB
     )
 except ImportError:
     print("Error: config.py not found or missing required variables.")
     exit(1)
 
-
-# --- AI Detector Import (DISABLED FOR NOW) ---
-AI_ENABLED = True # <<<=== AI DISABLED TO FIND BASELINE FPS
-DNN_BACKEND = None # Initialize to None
-DNN_TARGET = None # Initialize to None
-
-if AI_ENABLED:
-    try:
-         from detection import ExerciseDetector # Replace with your actual import
-         print("INFO: AI Processing Enabled.")
-    except ImportError:
-         print("ERROR: AI is enabled, but the detector module couldn't be imported.")
-         AI_ENABLED = False # Fallback to disabled if import fails
-         ExerciseDetector = None
-         print("INFO: AI Processing disabled due to import error.")
-
-    # Define DNN constants ONLY if AI is enabled and cv2.dnn exists
-    try:
-        DNN_BACKEND = cv2.dnn.DNN_BACKEND_OPENCV
-        DNN_TARGET = cv2.dnn.DNN_TARGET_CPU
-        print(f"INFO: DNN Backend set to {DNN_BACKEND}, Target set to {DNN_TARGET}")
-    except AttributeError:
-        print("\n" + "="*60)
-        print("ERROR: 'cv2.dnn' module not found, but AI_ENABLED is True.")
-        print("       This usually means the installed OpenCV version is missing the DNN module.")
-        print("       Try installing the full package:")
-        print("         pip uninstall opencv-python opencv-python-headless opencv-contrib-python")
-        print("         pip install opencv-contrib-python")
-        print("       Falling back to AI_ENABLED = False")
-        print("="*60 + "\n")
-        AI_ENABLED = False
-        ExerciseDetector = None
-        DNN_BACKEND = None
-        DNN_TARGET = None
-
-else:
-    ExerciseDetector = None
-    print("INFO: AI Processing is explicitly disabled.")
+# Outside the config check: a failing import here should show its own traceback
+import backends
+import passthrough
+from frame_reader import FrameReader, WarmStandby
+import dvr
+import metrics
+import profiler
+import pipeline_log
+import session_store
+import heart_rate
+import landmark_recorder
+import batch_pose
+import llm_client
+import workout_plans
+from camera_channel import CameraChannel
+from supervisor import Supervisor, UNSUPERVISED
+
+
+# --- AI Detector ---
+# The detector is created by whichever inference backend init_pipeline() selects
+AI_ENABLED = INFERENCE_BACKEND != "none"
 
 
 # --- Constants and Tuning Parameters ---
 KEEP = {"person"} # Only needed if AI ObjectDetector was used
 
-FRAME_QUEUE_SIZE = 1
-
-REOPEN_DELAY_SECONDS = 5
+REOPEN_DELAY_SECONDS = 5 # /video_feed retries
 MAX_CONSECUTIVE_FAILURES = 5
 MAX_FRAME_DELAY_WARN = 2.0
+READER_STATS_INTERVAL = 10.0 # Seconds between grab/decode/latency log lines
 
-# --- Performance Tuning (CPU Focused Baseline - Relying on Lower Source Res/FPS) ---
-TARGET_FPS = 15 # Target emission FPS - SET CAMERA TO MATCH OR BE SLIGHTLY HIGHER
+# --- Performance Tuning ---
+# TARGET_FPS=auto: starts at the fallback, then init_pipeline() sets it from the backend benchmark
+FALLBACK_TARGET_FPS = 15
+MIN_TARGET_FPS = 5
+TARGET_FPS = FALLBACK_TARGET_FPS if TARGET_FPS_SETTING == "auto" else int(TARGET_FPS_SETTING)
 EMIT_INTERVAL = 1.0 / TARGET_FPS
 
-# Emission Settings (Simplified for Baseline)
+# Emission Settings
 RESIZE_BEFORE_EMIT = False
 EMIT_RESIZE_SCALE = 1.0 # Ensure scale is 1.0 if resize is False
 
-# Start with low quality, can increase LATER if performance allows after lowering camera settings
-DEFAULT_JPEG_QUALITY = 65
-print(f"INFO: Running with AI Disabled={not AI_ENABLED}, No Resize, Default JPEG Quality={DEFAULT_JPEG_QUALITY}")
-print(f"INFO: Using standard CPU decoding. PLEASE LOWER CAMERA RESOLUTION/FPS for better performance.")
+# Auto quality bounds (AUTO_QUALITY=1)
+MIN_AUTO_QUALITY = 30
+MAX_AUTO_QUALITY = 90
+
+EMPTY_DETECTION = {'landmarks': [], 'bbox': None, 'type': 'person'}
+
+# --- Backend Selection (filled in by init_pipeline) ---
+CAPABILITIES = None
+SELECTED_BACKENDS = None
+encode_jpeg = backends.encode_opencv # Replaced by the benchmarked encoder
 
 
 # --- Globals ---
-shared_lock = threading.Lock()
 os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp" # Try forcing TCP for RTSP
 
 # Flask and SocketIO Initialization
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = BATCH_MAX_UPLOAD_MB * 1024 * 1024 # Also caps chunked bodies with no Content-Length
+CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading",
                     logger=False, engineio_logger=False) # Use threading for async
 
@@ -99,23 +96,61 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode="threading",
 def chat():
     data = request.get_json(force=True)
     messages = data.get('messages')
-    if not isinstance(messages, list):
+    if not llm_client.valid_messages(messages):
         return jsonify({ 'error': 'Invalid request format. Messages array required.' }), 400
     try:
-        client = OpenAI()
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=150
-        )
+        reply, usage = llm_client.complete(messages)
         return jsonify({
-            'response': completion.choices[0].message,
-            'usage': completion.usage
+            'response': { 'role': 'assistant', 'content': reply },
+            'usage': usage
         })
     except Exception as e:
         return jsonify({ 'error': 'Error processing your request', 'details': str(e) }), 500
 
+def sse_event(data, event=None):
+    """One Server-Sent Events message with a JSON payload."""
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Same body as /api/chat; replies with text/event-stream: {"delta"} events, then a "done" event."""
+    data = request.get_json(force=True)
+    messages = data.get('messages')
+    if not llm_client.valid_messages(messages):
+        return jsonify({ 'error': 'Invalid request format. Messages array required.' }), 400
+    pieces = llm_client.stream(messages)
+    try:
+        first = next(pieces, "") # Connection and auth errors still get a proper status before the stream starts
+    except Exception as e:
+        return jsonify({ 'error': 'Error processing your request', 'details': str(e) }), 500
+
+    def events():
+        reply = [first]
+        if first:
+            yield sse_event({ 'delta': first })
+        try:
+            for piece in pieces:
+                reply.append(piece)
+                yield sse_event({ 'delta': piece })
+        except Exception as e:
+            yield sse_event({ 'error': 'Error processing your request', 'details': str(e) }, event='error')
+            return
+        yield sse_event({ 'content': ''.join(reply) }, event='done')
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={ 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no' })
+
+@app.route('/api/workout/generate-plan', methods=['POST'])
+def generate_plan():
+    """{difficulty, focusAreas, duration, goal?, heartRateZone?, refine?} -> {plan: [segments], settings, ...}."""
+    try:
+        body, outcome = workout_plans.get_plan(request.get_json(force=True, silent=True))
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+    except Exception as e:
+        return jsonify({ 'error': 'Error generating the plan', 'details': str(e) }), 500
+    return Response(body, mimetype='application/json', headers={ 'X-Plan-Cache': outcome })
+
 @app.route('/api/workout/analyze-pose', methods=['POST'])
 def analyze_pose():
     data = request.get_json(force=True)
@@ -124,6 +159,7 @@ def analyze_pose():
     heartRate = data.get('heartRate')
     if not isinstance(landmarks, list):
         return jsonify({ 'error': 'Invalid request format. Landmarks array required.' }), 400
+    record_heart_rate(data.get('userId'), heartRate)
     analysis = {
         'exerciseType': exerciseType or 'unknown',
         'formQuality': np.random.choice(['good','fair','needs improvement']),
@@ -138,282 +174,601 @@ def analyze_pose():
 
 @app.route('/api/workout/track', methods=['POST'])
 def track_workout():
+    """Queues the session for the write-behind store and returns without waiting for the disk."""
     data = request.get_json(force=True)
-    count = data.get('count', {})
-    heartRate = data.get('heartRate')
+    if not isinstance(data, dict):
+        return jsonify({ 'error': 'Invalid request format. JSON object required.' }), 400
+    try:
+        row = session_store.track_row(data)
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+    try:
+        session_store.get_store().append(row)
+    except session_store.StoreBusy as e:
+        return jsonify({ 'error': str(e) }), 503
+    heartRate = row['heart_rate']
+    record_heart_rate(row['user_id'], heartRate, row['recorded_at'])
+    recorder = camera_state[CAMERA_NAME].recorder
+    if recorder is not None:
+        recorder.set_counts(row['push_ups'], row['sit_ups']) # Rep labels for the recorded frames
     session = {
-        'pushUps': count.get('pushups'),
-        'sitUps': count.get('situps'),
-        'heartRates': heartRate and [{'bpm': heartRate, 'timestamp': time.time()}] or []
+        'sessionId': row['session_id'],
+        'pushUps': row['push_ups'],
+        'sitUps': row['sit_ups'],
+        'heartRates': heartRate and [{'bpm': heartRate, 'timestamp': row['recorded_at']}] or []
     }
-    return jsonify({ 'success': True, 'session': session, 'timestamp': time.time() })
+    return jsonify({ 'success': True, 'session': session, 'timestamp': row['recorded_at'] })
+
+def history_filters():
+    return {
+        'user_id': request.args.get('userId'),
+        'session_id': request.args.get('sessionId'),
+        'since': request.args.get('since', type=float),
+        'until': request.args.get('until', type=float),
+    }
+
+@app.route('/api/workout/history', methods=['GET'])
+def workout_history():
+    """Stored sessions, newest first: ?userId=&sessionId=&since=&until=&limit=&cursor= (committed rows only).
+
+    Pass the returned nextCursor as ?cursor= for the following page; it is null on the last page.
+    """
+    try:
+        sessions, next_cursor = session_store.get_store().history(
+            limit=request.args.get('limit', 100, type=int), cursor=request.args.get('cursor'), **history_filters())
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+    except session_store.sqlite3.Error as e:
+        return jsonify({ 'error': 'Could not read workout history', 'details': str(e) }), 500
+    return jsonify({ 'sessions': sessions, 'nextCursor': next_cursor })
+
+@app.route('/api/workout/history/export', methods=['GET'])
+def export_workout_history():
+    """Streams every matching session, oldest first, as ?format=ndjson (default) or csv."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in session_store.EXPORT_FORMATS:
+        return jsonify({ 'error': f"format must be one of {list(session_store.EXPORT_FORMATS)}" }), 400
+    content_type, lines = session_store.EXPORT_FORMATS[fmt]
+    sessions = session_store.get_store().export(**history_filters())
+    return Response(stream_with_context(lines(sessions)), content_type=content_type,
+                    headers={'Content-Disposition': f'attachment; filename="workout-history.{fmt}"'})
+
+# --- Heart Rate ---
+def record_heart_rate(user_id, bpm, timestamp=None):
+    """Feeds a scalar heartRate from a workout post into the user's series (ignored if missing/invalid)."""
+    if isinstance(bpm, (int, float)) and bpm > 0:
+        heart_rate.ingest(str(user_id or session_store.DEFAULT_USER), {'bpm': bpm, 'timestamp': timestamp})
+
+def ingest_heart_rate(data):
+    """Shared by the 'heart_rate' Socket.IO event and /api/heart-rate/samples. Returns (body, status)."""
+    if not isinstance(data, (dict, list)):
+        return { 'error': 'Invalid request format. JSON object or array required.' }, 400
+    user_id = str((isinstance(data, dict) and data.get('userId')) or session_store.DEFAULT_USER)
+    try:
+        return heart_rate.ingest(user_id, data), 200
+    except ValueError as e:
+        return { 'error': str(e) }, 400
+
+@app.route('/api/heart-rate/samples', methods=['POST'])
+def heart_rate_samples():
+    """Batch ingest: {userId, samples: [{bpm, timestamp}, ...]} (timestamps in seconds or ms)."""
+    body, status = ingest_heart_rate(request.get_json(force=True, silent=True))
+    return jsonify(body), status
+
+def heart_rate_series_or_404():
+    series = heart_rate.get_series(request.args.get('userId', session_store.DEFAULT_USER))
+    if series is None:
+        return None, (jsonify({ 'error': 'No heart-rate data for this user.' }), 404)
+    return series, None
+
+@app.route('/api/heart-rate/rollups', methods=['GET'])
+def heart_rate_rollups():
+    """Precomputed buckets: ?userId=&resolution=&since=&until= (finest resolution covering `since` by default)."""
+    series, error = heart_rate_series_or_404()
+    if error:
+        return error
+    try:
+        resolution, buckets = series.buckets(request.args.get('resolution', type=int),
+                                             request.args.get('since', type=float),
+                                             request.args.get('until', type=float))
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+    return jsonify({ 'userId': series.user_id, 'resolution': resolution, 'buckets': buckets })
+
+@app.route('/api/heart-rate/zones', methods=['GET'])
+def heart_rate_zones():
+    """Min/max/avg and seconds per zone over ?since=&until= (defaults to everything still rolled up)."""
+    series, error = heart_rate_series_or_404()
+    if error:
+        return error
+    summary = series.summary(request.args.get('since', type=float), request.args.get('until', type=float))
+    return jsonify({ 'userId': series.user_id, 'zones': list(heart_rate.ZONE_NAMES), **summary })
+
+@app.route('/api/heart-rate/raw', methods=['GET'])
+def heart_rate_raw():
+    """Raw samples (newest ?limit=, default 600) for charts that need full resolution."""
+    series, error = heart_rate_series_or_404()
+    if error:
+        return error
+    samples = series.raw(request.args.get('since', type=float), request.args.get('until', type=float),
+                         request.args.get('limit', 600, type=int))
+    return jsonify({ 'userId': series.user_id, 'samples': [{'timestamp': t, 'bpm': bpm} for t, bpm in samples] })
 
 # --- Camera State ---
+# One CameraChannel per camera. Stages publish immutable, versioned packets by
+# reference swap (see camera_channel.py), so no global lock is needed.
+# ai_processor is set later if AI_ENABLED; dvr at startup if DVR_ENABLED.
 camera_state = {
-    CAMERA_NAME: {
-        "frame_queue": deque(maxlen=FRAME_QUEUE_SIZE),
-        "last_frame_time_capture": time.time(),
-        "last_frame_time_emit": time.time(),
-        "capture_active": True,
-        "stream_failures": 0,
-        "last_failure_time": 0,
-        "ai_processor": None, # Will be initialized later if AI_ENABLED
-        "last_fps_check_time": time.time(),
-        "emitted_frame_counter": 0,
-        "current_emit_fps": 0,
-        "current_jpeg_quality": DEFAULT_JPEG_QUALITY,
-        "current_emit_scale": EMIT_RESIZE_SCALE,
-        "last_detection_data": None,
-    }
+    CAMERA_NAME: CameraChannel(CAMERA_NAME, DEFAULT_JPEG_QUALITY, EMIT_RESIZE_SCALE),
 }
 
+# Runs the capture/emitter threads and restarts any that stop sending heartbeats
+# (shared with async_server.py and fanout.py, which register their own stages)
+supervisor = Supervisor()
 
-# --- AI Processor Class (Placeholder Definition) ---
-class AIProcessor:
-    # This class would contain the AI model loading and processing logic
-    # if AI_ENABLED were True and ExerciseDetector were imported correctly.
-    def __init__(self, model_path, classes_path, input_size, conf_thresh, score_thresh, nms_thresh, backend, target):
-         # Example initialization (replace with your actual AI model setup)
-         print(f"AIProcessor Init (Placeholder - AI_ENABLED={AI_ENABLED})")
-         self.model = None # Load your model here if AI_ENABLED
-         self.classes = [] # Load classes if AI_ENABLED
-         # ... other setup ...
-         if AI_ENABLED:
-             print(" -> Actual AI model loading would happen here.")
-         else:
-             print(" -> AI is disabled, no model loaded.")
-
-    def process_frame(self, frame):
-        # Example processing (replace with your actual AI inference)
-        if not AI_ENABLED or self.model is None:
-            return frame, {} # Return original frame and empty detections if AI is off
-
-        # --- Actual AI processing would go here ---
-        # 1. Preprocess frame (blobFromImage)
-        # 2. Set input to model
-        # 3. Forward pass
-        # 4. Postprocess results (NMS, filtering)
-        # 5. Draw boxes/info on the frame
-        # 6. Format detection data
-        # -----------------------------------------
-        print("AIProcessor.process_frame (Placeholder - would run inference here)")
-        processed_frame = frame # Placeholder
-        detections = {} # Placeholder
-        return processed_frame, detections
-
-
-# --- Initialize AI Processor (if enabled) ---
-if AI_ENABLED and ExerciseDetector is not None:
-    try:
-        # Example: Initialize your AI processor instance
-        # ai_instance = ExerciseDetector(...) # Or AIProcessor(...)
-        # camera_state[CAMERA_NAME]["ai_processor"] = ai_instance
-        print(f"[{CAMERA_NAME}] AI Processor would be initialized here.")
-        # For now, using the placeholder AIProcessor class:
-        camera_state[CAMERA_NAME]["ai_processor"] = AIProcessor(
-            MODEL_PATH, CLASSES_PATH, (INPUT_WIDTH, INPUT_HEIGHT),
-            CONFIDENCE_THRESHOLD, SCORE_THRESHOLD, NMS_THRESHOLD,
-            DNN_BACKEND, DNN_TARGET
-        )
 
-    except Exception as e:
-        print(f"[{CAMERA_NAME}] ERROR initializing AI Processor: {e}")
-        print(traceback.format_exc())
-        camera_state[CAMERA_NAME]["ai_processor"] = None # Disable AI if init fails
-        AI_ENABLED = False # Ensure AI flag reflects the failure
-        print(f"[{CAMERA_NAME}] AI Processing disabled due to initialization error.")
+# --- Pipeline Initialization ---
+def init_pipeline():
+    """Probes the system and benchmarks the backends (both cached on disk, see backends.py).
+
+    Call once before starting the capture threads (later calls return the first selection).
+    """
+    global CAPABILITIES, SELECTED_BACKENDS, AI_ENABLED, TARGET_FPS, EMIT_INTERVAL, encode_jpeg
+    if SELECTED_BACKENDS is not None:
+        return SELECTED_BACKENDS
+
+    CAPABILITIES = backends.load_capabilities()
+    selection = backends.load_selection(RTSP_URL, CAPABILITIES, ai_enabled=AI_ENABLED,
+                                        benchmark=BACKEND_BENCHMARK)
+    if AI_ENABLED and selection["inference"] is None:
+        print("INFO: AI Processing disabled: no inference backend could be initialized.")
+        AI_ENABLED = False
+    # Single camera for now; each camera needs its own detector instance (they keep tracking state).
+    # With a cached selection this is None and ensure_ai_processor() creates it in the capture thread.
+    camera_state[CAMERA_NAME].ai_processor = selection["processor"]
+    encode_jpeg = backends.ENCODERS[selection["encoder"]]["encode"]
+
+    if TARGET_FPS_SETTING == "auto":
+        sustainable = backends.sustainable_fps(selection)
+        if sustainable:
+            TARGET_FPS = max(MIN_TARGET_FPS, min(MAX_TARGET_FPS, int(sustainable)))
+            EMIT_INTERVAL = 1.0 / TARGET_FPS
+    SELECTED_BACKENDS = selection
+    print(f"INFO: Pipeline ready: AI={AI_ENABLED}, TARGET_FPS={TARGET_FPS}, JPEG Quality={DEFAULT_JPEG_QUALITY}")
+    return selection
+
+
+def ensure_ai_processor(state):
+    """Returns the camera's detector, creating it on first use (imports mediapipe off the startup path)."""
+    global AI_ENABLED
+    if state.ai_processor is None and AI_ENABLED and SELECTED_BACKENDS and SELECTED_BACKENDS["inference"]:
+        name = SELECTED_BACKENDS["inference"]
+        try:
+            state.ai_processor = backends.INFERENCE[name]["create"]()
+            print(f"[{state.name}] AI Processor initialized ({name}).")
+        except Exception as e:
+            print(f"[{state.name}] ERROR initializing AI Processor ({name}): {e}")
+            print(traceback.format_exc())
+            AI_ENABLED = False
+            print(f"[{state.name}] AI Processing disabled due to initialization error.")
+    return state.ai_processor
+
 
 # --- Stream Opening Function ---
+# Decoder that last opened each camera; tried first on the next (re)connect
+last_good_decoder = {}
+
+
 def open_stream(camera_name):
-    """Attempts to open the RTSP stream using standard OpenCV."""
+    """Opens the stream with the decoder that last worked (else the benchmarked one), falling back through the rest."""
     url = RTSP_URL
-    print(f"[{camera_name}] Attempting to open stream: {url}")
-    cap = None
+    log = pipeline_log.get_logger(camera_name)
+    log.info("Attempting to open stream: %s", url, key="open_attempt")
+    order = list(SELECTED_BACKENDS["decoder_order"]) if SELECTED_BACKENDS else ["ffmpeg"]
+    last_good = last_good_decoder.get(camera_name)
+    if last_good in order:
+        order.remove(last_good)
+        order.insert(0, last_good)
+
+    for name in order:
+        try:
+            log.info("Trying decoder '%s'...", name, key="open_decoder")
+            cap = backends.DECODERS[name]["open"](url)
+            if cap is not None:
+                last_good_decoder[camera_name] = name
+                return cap
+        except Exception as e:
+            log.warning("Error with decoder '%s': %s", name, e, key="open_decoder_error")
+            # traceback.print_exc() # Uncomment for more detailed errors if needed
+
+    log.warning("Could not open stream with any available decoder.", key="open_failed")
+    return None
+
+
+def normalize_detection(raw_detection, width, height):
+    """Returns a new detection dict with bbox and landmarks scaled to 0..1 for the frontend.
+
+    Never mutates raw_detection: published packets are immutable, and the detector
+    hands back its cached detection on skipped frames.
+    """
+    if not raw_detection:
+        return dict(EMPTY_DETECTION)
+    detection = dict(raw_detection)
+    bbox = detection.get('bbox')
+    if bbox:
+        detection['bbox'] = {
+            'x_min': bbox['x_min'] / width,
+            'y_min': bbox['y_min'] / height,
+            'x_max': bbox['x_max'] / width,
+            'y_max': bbox['y_max'] / height
+        }
+    if detection.get('landmarks'):
+        detection['landmarks'] = [
+            {**lm, 'x': lm['x'] / width, 'y': lm['y'] / height} for lm in detection['landmarks']
+        ]
+    return detection
+
+
+def reconnect_delay(attempt):
+    """Exponential backoff with jitter: a random delay in [d/2, d], d = base * 2^attempt capped at the max."""
+    delay = min(RECONNECT_MAX_SECONDS, RECONNECT_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
 
-    # --- METHOD 1: Standard OpenCV VideoCapture (CPU Decoding) ---
-    try:
-        print(f"  Trying standard cv2.VideoCapture (CPU decoding)...")
-        # Environment variable for TCP is set globally now
-        cap_cpu = cv2.VideoCapture(url, cv2.CAP_FFMPEG) # Explicitly suggest FFMPEG backend
-        if cap_cpu is not None and cap_cpu.isOpened():
-            # Set buffer size (may or may not have an effect depending on backend/OS)
-            cap_cpu.set(cv2.CAP_PROP_BUFFERSIZE, 3)
-            print(f"  Successfully opened with standard VideoCapture.")
-            ret, frame = cap_cpu.read() # Test read
-            if ret and frame is not None and frame.size > 0:
-                print(f"  Test frame read successful ({frame.shape[1]}x{frame.shape[0]}). Using standard CPU decoding.")
-                return cap_cpu # <<<=== Return the CPU capture object if successful
-            else:
-                print(f"  Opened but failed to read test frame.")
-                cap_cpu.release()
-                cap_cpu = None # Ensure it's None
-        else:
-            print(f"  Failed to open with standard VideoCapture.")
-    except Exception as e:
-        print(f"  Error with standard VideoCapture: {e}")
-        # traceback.print_exc() # Uncomment for more detailed errors if needed
 
-    # --- Fallback Message ---
-    if cap is None:
-        print(f"[{camera_name}] Could not open stream with standard CPU method.")
-    return cap # Return None if failed
+# --- Frame Capture Background Thread ---
+def capture_loop(camera_name, heartbeat=UNSUPERVISED):
+    """Continuously captures frames from the stream and publishes them on the camera channel.
 
+    A FrameReader drains the stream with grab() in its own thread, so each read
+    returns the newest frame and only that frame is decoded, however long
+    inference takes.
 
-# --- Frame Capture Background Thread ---
-def capture_loop(camera_name):
-    """Continuously captures frames from the stream and puts them in the queue."""
+    A stalled stream is reopened with exponential backoff, or with WARM_STANDBY=1
+    replaced at once by a second connection that is kept open in the background.
+    Beats `heartbeat` every iteration so the supervisor can replace a hung loop.
+    """
     state = camera_state[camera_name]
-    print(f"[{camera_name}] Capture loop starting (CPU Decoding)...")
-    ai_processor = state.get("ai_processor") # Get processor instance (might be None)
-
-    cap = None
+    stats = state.capture_stats # Only this thread writes capture stats
+    tracer = state.tracer
+    log = pipeline_log.get_logger(camera_name) # Queued and rate limited: never blocks this thread on output
+    decoder = SELECTED_BACKENDS["decoder"] if SELECTED_BACKENDS else "ffmpeg"
+    log.info("Capture loop starting (decoder: %s)...", decoder)
+    with heartbeat.busy(WATCHDOG_GRACE_SECONDS): # Model load can take a while
+        ai_processor = ensure_ai_processor(state) # Get processor instance (might be None)
+
+    read_seconds = metrics.stage_histogram(camera_name, "read")
+    decode_seconds = metrics.stage_histogram(camera_name, "decode")
+    inference_seconds = metrics.stage_histogram(camera_name, "inference")
+    reader_drops = metrics.counter("pipeline_frames_dropped_total", "Frames dropped before reaching viewers.",
+                                   camera=camera_name, stage="read")
+    reader_skipped = 0 # Grabbed-but-not-decoded frames of the current reader already counted
+
+    reader = None
+    standby = WarmStandby(lambda: open_stream(camera_name), camera_name, STALL_TIMEOUT_SECONDS) if WARM_STANDBY else None
     consecutive_failures = 0
-    last_reopen_attempt_time = 0
+    next_stats_log = time.time() + READER_STATS_INTERVAL
+    reconnect_attempt = 0
+    crash_attempt = 0 # Crashes since the last iteration that got all the way through
+    next_reopen_time = 0 # Backoff deadline for the next (re)open attempt
+    outage_start = None # Time the stream went down, for the downtime log
     last_successful_frame_raw = None # Store the last good raw frame
 
-    while state.get("capture_active", False):
+    while state.capture_active and heartbeat.current:
+        heartbeat.beat()
         current_time = time.time()
         frame = None
         processed_frame = None
-        detections = {}
+        detections = EMPTY_DETECTION
+        capture_mono = None # Grab time of a fresh frame (None for a cached one), for tracing
 
         try:
             # Stream (Re)Connection Logic
-            if cap is None:
-                if current_time - last_reopen_attempt_time >= REOPEN_DELAY_SECONDS:
-                    print(f"[{camera_name}] Attempting to (re)open stream...")
-                    last_reopen_attempt_time = current_time
-                    cap = open_stream(camera_name) # Tries Method 1 now
-                    if cap:
-                        print(f"[{camera_name}] Stream connection successful.")
+            if reader is None:
+                if current_time >= next_reopen_time:
+                    log.info("Attempting to (re)open stream...", key="reopen")
+                    reader = standby.take() if standby else None
+                    if reader is not None:
+                        stats.standby_takeovers += 1
+                        log.info("Warm standby took over.", key="standby_takeover")
+                    else:
+                        with heartbeat.busy(WATCHDOG_GRACE_SECONDS): # Blocking test read per decoder
+                            cap = open_stream(camera_name) # Last working decoder first
+                        if cap:
+                            reader = FrameReader(cap, camera_name) # Takes ownership of cap
+                    if reader is not None:
+                        log.info("Stream connection successful.", key="connected")
+                        reader_skipped = reader.frames_grabbed - reader.frames_decoded # A standby drained on its own
+                        if outage_start is not None:
+                            stats.last_outage_ms = (time.time() - outage_start) * 1000.0
+                            stats.reconnects += 1
+                            log.info("Stream back after %.0fms.", stats.last_outage_ms, key="stream_back")
+                        outage_start = None
+                        reconnect_attempt = 0
                         consecutive_failures = 0
-                        state["stream_failures"] = 0 # Reset stream failure count on success
+                        stats.stream_failures = 0 # Reset stream failure count on success
+                        if standby:
+                            standby.ensure()
                     else:
-                        print(f"[{camera_name}] Stream connection failed, will retry...")
-                        state["stream_failures"] += 1
-                        state["last_failure_time"] = current_time
-                        time.sleep(REOPEN_DELAY_SECONDS / 2) # Wait before next attempt
+                        delay = reconnect_delay(reconnect_attempt)
+                        reconnect_attempt += 1
+                        next_reopen_time = time.time() + delay
+                        log.warning("Stream connection failed, retrying in %.2fs...", delay, key="connect_failed")
+                        stats.stream_failures += 1
+                        stats.last_failure_time = current_time
                         continue # Skip frame processing attempt
                 else:
-                    # Waiting for reopen delay
-                    time.sleep(0.5)
+                    # Waiting out the backoff delay
+                    time.sleep(min(0.5, next_reopen_time - current_time))
                     continue # Skip frame processing attempt
 
             # Frame Reading Logic
-            if cap is not None:
-                ret, frame = cap.read()
+            if reader is not None:
+                read_start = time.perf_counter()
+                ret, frame = reader.read(STALL_TIMEOUT_SECONDS) # Blocks until the next fresh frame
 
                 if ret and frame is not None and frame.size > 0:
+                    capture_mono, read_mono = reader.frame_mono, time.monotonic()
+                    read_seconds.observe(time.perf_counter() - read_start)
+                    decode_seconds.observe(reader.decode_seconds)
+                    skipped = reader.frames_grabbed - reader.frames_decoded
+                    reader_drops.inc(skipped - reader_skipped)
+                    reader_skipped = skipped
+                    current_time = reader.frame_time # When it came off the stream, not when we asked
                     if consecutive_failures > 0:
-                         print(f"[{camera_name}] Stream read recovered after {consecutive_failures} failures.")
+                         log.info("Stream read recovered after %d failures.", consecutive_failures, key="read_recovered")
                     consecutive_failures = 0
                     last_successful_frame_raw = frame # Keep the raw frame
 
                     # --- AI Processing (if enabled and processor exists) ---
                     if AI_ENABLED and ai_processor:
                         try:
-                            proc_start_time = time.time()
-                            # Pass a copy to AI to avoid modification issues if processing is slow
-                            processed_frame, detections = ai_processor.process_frame(frame.copy())
-                            proc_end_time = time.time()
-                            # print(f"[{camera_name}] AI Processing Time: {proc_end_time - proc_start_time:.3f}s") # Optional perf log
+                            proc_start_time = time.perf_counter()
+                            # The detector only reads the frame (it downscales its own copy)
+                            processed_frame, raw_detection = ai_processor.process_frame(frame)
+                            h, w = frame.shape[:2]
+                            detections = normalize_detection(raw_detection, w, h)
+                            inference_seconds.observe(time.perf_counter() - proc_start_time)
                         except Exception as ai_err:
-                             print(f"[{camera_name}] ERROR during AI processing: {ai_err}")
+                             log.error("ERROR during AI processing: %s", ai_err, key="inference_error")
                              # traceback.print_exc() # Uncomment for full AI error details
                              processed_frame = frame # Fallback to original frame on AI error
-                             detections = {"error": str(ai_err)}
+                             detections = {**EMPTY_DETECTION, "error": str(ai_err)}
                     else:
                         # If AI is disabled, use the original frame
                         processed_frame = frame
-                        detections = {} # Ensure detections is an empty dict
+                        detections = EMPTY_DETECTION
 
                     # --- Update Timestamps and State ---
-                    capture_delay = current_time - state.get("last_frame_time_capture", current_time)
+                    capture_delay = current_time - stats.last_frame_time
                     if capture_delay > MAX_FRAME_DELAY_WARN:
-                         print(f"[{camera_name}] WARNING: High capture delay between reads: {capture_delay:.2f}s")
-
-                    with shared_lock:
-                        state["last_frame_time_capture"] = current_time
-                        state["last_detection_data"] = detections # Store latest detections
+                         log.warning("WARNING: High capture delay between reads: %.2fs", capture_delay, key="capture_delay")
+
+                    stats.last_frame_time = current_time
+                    stats.frames_captured += 1
+                    stats.frames_grabbed = reader.frames_grabbed
+                    stats.frames_decoded = reader.frames_decoded
+                    stats.buffer_latency_ms = reader.buffer_latency_ms
+                    stats.frame_age_ms = reader.frame_age_ms
+                    state.publish_detections(detections, current_time) # Store latest detections
+                    recorder = state.recorder
+                    if recorder is not None:
+                        recorder.record(state.detection_packet.version, current_time, detections)
 
                 else: # Frame read failed
                     consecutive_failures += 1
-                    print(f"[{camera_name}] Frame read failed (Attempt {consecutive_failures}/{MAX_CONSECUTIVE_FAILURES}).")
-
-                    # Option 1: Use last known good frame for a short time
-                    if last_successful_frame_raw is not None and consecutive_failures < MAX_CONSECUTIVE_FAILURES // 2 :
-                        print(f"[{camera_name}] Using cached frame.")
+                    log.warning("Frame read failed (Attempt %d/%d).", consecutive_failures, MAX_CONSECUTIVE_FAILURES,
+                                key="read_failed")
+
+                    # Option 1: Force reconnect after max failures, or at once if no packet arrived
+                    # within the stall timeout (a blocked FFmpeg read won't recover by retrying)
+                    if consecutive_failures >= MAX_CONSECUTIVE_FAILURES or reader.stalled(STALL_TIMEOUT_SECONDS):
+                        log.warning("Stream stalled or failing. Resetting stream.", key="stream_reset")
+                        reader.stop(timeout=0) # Releases the capture once its grab() returns
+                        reader = None
+                        last_successful_frame_raw = None
+                        outage_start = stats.last_frame_time
+                        next_reopen_time = 0 # First reopen attempt is immediate
+                        state.publish_detections({**EMPTY_DETECTION, "error": "Stream disconnected"}, current_time)
+                        continue # Skip publishing a frame
+                    # Option 2: Use last known good frame for a short time
+                    elif last_successful_frame_raw is not None and consecutive_failures < MAX_CONSECUTIVE_FAILURES // 2 :
+                        log.info("Using cached frame.", key="cached_frame")
                         processed_frame = last_successful_frame_raw # Use the cached raw frame
                         # Optionally clear detections or keep last known? Clear is safer.
-                        with shared_lock:
-                             state["last_detection_data"] = {}
-                    # Option 2: Force reconnect after max failures
-                    elif consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
-                        print(f"[{camera_name}] Max consecutive read failures reached. Resetting stream.")
-                        if cap:
-                            try: cap.release()
-                            except: pass
-                        cap = None
-                        last_successful_frame_raw = None
-                        last_reopen_attempt_time = 0 # Allow immediate reopen attempt
-                        with shared_lock:
-                             state["last_detection_data"] = {"error": "Stream disconnected"}
-                        continue # Skip putting frame in queue
+                        state.publish_detections(EMPTY_DETECTION, current_time)
                     else:
                         # Read failed, but not max failures, and no cached frame to use
                         time.sleep(0.1) # Small delay before next read attempt
-                        continue # Skip putting frame in queue
-
-            # Add the processed_frame (or cached frame) to Queue
-            if processed_frame is not None:
-                # Make a final copy before putting in the thread-safe queue
-                frame_copy_for_queue = processed_frame.copy()
-                with shared_lock:
-                    # If queue is full, the oldest frame is dropped automatically by deque
-                    state["frame_queue"].append(frame_copy_for_queue)
-
-            # Loop Pacing - Adjust sleep based on success/failure
-            if consecutive_failures == 0:
-                 # Sleep very briefly if reads are working, relying on camera FPS and emit interval
-                 time.sleep(0.005) # 5ms sleep - prevents busy-waiting if camera is fast
-            else:
-                 # Sleep longer if there are read issues
+                        continue # Skip publishing a frame
+
+            # Publish the processed_frame (or cached frame); the emitter picks up the newest version
+            # (passthrough viewers get video from ffmpeg, so no JPEG frames are needed)
+            if processed_frame is not None and STREAM_MODE != "passthrough":
+                # Frames from reader.read() are fresh arrays; publish_frame freezes it instead of copying
+                frame_packet = state.publish_frame(processed_frame, current_time, capture_mono)
+                if capture_mono is not None and tracer.sampled(frame_packet.version):
+                    tracer.begin(frame_packet.version, captured=capture_mono, read=read_mono,
+                                 inferred=time.monotonic(), decode=reader.decode_seconds)
+
+            # Loop Pacing - reader.read() already waits for the next frame; only back off on read issues
+            if consecutive_failures > 0:
                  time.sleep(0.05) # 50ms sleep
 
+            if current_time >= next_stats_log and reader is not None:
+                next_stats_log = current_time + READER_STATS_INTERVAL
+                log_reader_stats(log, stats)
+            crash_attempt = 0
+
         except Exception as e:
-            print(f"[{camera_name}] CRITICAL ERROR in capture loop: {e}")
-            print(traceback.format_exc())
-            if cap:
-                try: cap.release()
-                except: pass
-            cap = None
+            log.exception("CRITICAL ERROR in capture loop: %s", e, key="capture_crash")
+            if reader:
+                reader.stop(timeout=0)
+            reader = None
             last_successful_frame_raw = None
             # Reset state to trigger reconnect attempt after a delay
-            last_reopen_attempt_time = 0
+            outage_start = outage_start or stats.last_frame_time
             consecutive_failures = MAX_CONSECUTIVE_FAILURES # Ensure it triggers reconnect logic
-            time.sleep(REOPEN_DELAY_SECONDS) # Longer sleep after critical error
+            # Reopen on the reconnect backoff: the wait above beats, so the watchdog doesn't see a stall,
+            # and a loop that keeps crashing backs off instead of reopening the stream as fast as it can
+            delay = reconnect_delay(crash_attempt)
+            crash_attempt += 1
+            next_reopen_time = time.time() + delay
 
     # Cleanup on Exit
-    if cap:
-        try: cap.release()
-        except: pass
-        print(f"[{camera_name}] Released capture resource.")
-    print(f"[{camera_name}] Capture loop stopped.")
+    if standby:
+        standby.stop()
+    if reader:
+        reader.stop()
+        log.info("Released capture resource.")
+    log.info("Capture loop stopped.")
+
+
+def log_reader_stats(log, stats):
+    """Logs how much of the stream was decoded and how long frames waited in buffers."""
+    grabbed = stats.frames_grabbed
+    skipped = (1 - stats.frames_decoded / grabbed) * 100 if grabbed else 0
+    buffer_latency = "n/a" if stats.buffer_latency_ms is None else f"{stats.buffer_latency_ms:.0f}ms"
+    log.info("Reader: grabbed %d, decoded %d (%.0f%% skipped), buffer latency %s, frame age at read %.1fms",
+             grabbed, stats.frames_decoded, skipped, buffer_latency, stats.frame_age_ms, key="reader_stats")
+
+
+def restart_capture_stage(camera_name):
+    """Supervisor hook: the stalled loop may be stuck inside the detector, so the next one builds a fresh one."""
+    camera_state[camera_name].ai_processor = None
+
+
+def supervise_camera(camera_name, emitters=True):
+    """Registers the camera's capture stage (and, with emitters=True, its Socket.IO emitter) with the supervisor."""
+    # Passthrough video is remuxed by ffmpeg per client request; only decode if inference needs frames
+    if STREAM_MODE == "passthrough" and not AI_ENABLED:
+        print(f" -> [{camera_name}] Passthrough mode with AI disabled: no decode threads started.")
+        return
+    supervisor.add(f"capture:{camera_name}", capture_loop, (camera_name,),
+                   on_restart=lambda: restart_capture_stage(camera_name))
+    print(f" -> [{camera_name}] Capture stage registered.")
+    if emitters:
+        emitter = detection_emitter if STREAM_MODE == "passthrough" else frame_emitter
+        supervisor.add(f"emitter:{camera_name}", emitter, (camera_name,))
+        print(f" -> [{camera_name}] {'Detection' if STREAM_MODE == 'passthrough' else 'Frame'} emitter stage registered.")
+
+
+# --- Detection Emission (Passthrough Mode) ---
+def detection_emitter(camera_name, heartbeat=UNSUPERVISED):
+    """Emits timestamped detections only; video goes through the passthrough relay."""
+    state = camera_state[camera_name]
+    log = pipeline_log.get_logger(camera_name)
+    log.info("Detection emitter starting (passthrough mode)...")
+    emit_seconds = metrics.stage_histogram(camera_name, "emit")
+    last_sent_version = 0
+
+    while state.capture_active and heartbeat.current:
+        heartbeat.beat()
+        try:
+            packet = state.detection_packet
+            if packet.version == last_sent_version:
+                time.sleep(EMIT_INTERVAL / 3)
+                continue
+
+            detections = packet.detections or EMPTY_DETECTION
+            emit_start = time.perf_counter()
+            socketio.emit('detections', {**detections, "timestamp": packet.capture_time}, room=camera_name)
+            emit_seconds.observe(time.perf_counter() - emit_start)
+            last_sent_version = packet.version
+
+        except Exception as e:
+            log.exception("CRITICAL ERROR in detection_emitter loop: %s", e, key="emitter_crash")
+            time.sleep(1)
+
+    log.info("Detection emitter stopped.")
+
+
+# --- Frame Encoding (shared with async_server's broadcaster) ---
+def encode_frame(state, frame):
+    """Resizes (if enabled) and JPEG-encodes a frame at the camera's current quality.
+
+    Returns the JPEG bytes, or None if encoding failed.
+    """
+    # NOTE: Resize currently disabled by RESIZE_BEFORE_EMIT = False
+    if RESIZE_BEFORE_EMIT and state.emit_scale != 1.0:
+         import cv2
+         scale = state.emit_scale
+         if scale > 0.1: # Basic sanity check for scale factor
+             width = int(frame.shape[1] * scale)
+             height = int(frame.shape[0] * scale)
+             frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA) # Use INTER_AREA for shrinking
+
+    return encode_jpeg(frame, int(state.jpeg_quality)) # Benchmarked encoder (see init_pipeline)
+
+
+def store_encoded(state, frame_bytes, detections, capture_time):
+    """Caches an emitted JPEG for /snapshot and keeps it for instant replay (no re-encode later)."""
+    state.publish_encoded(frame_bytes, capture_time) # Single packet swap, read without locking
+    if state.dvr is not None:
+        state.dvr.append(frame_bytes, detections, capture_time)
+
+
+def adjust_quality_for_fps(state):
+    """AUTO_QUALITY: trades JPEG quality for rate when the emitter misses TARGET_FPS, and back."""
+    stats = state.emit_stats
+    quality = state.jpeg_quality
+    if stats.current_fps < TARGET_FPS * 0.8:
+        quality -= 5
+    elif stats.current_fps >= TARGET_FPS * 0.95:
+        quality += 2
+    state.jpeg_quality = max(MIN_AUTO_QUALITY, min(MAX_AUTO_QUALITY, quality))
+    pipeline_log.get_logger(state.name).info("Emit FPS: ~%s (target %s), JPEG quality %s", stats.current_fps,
+                                             TARGET_FPS, state.jpeg_quality, key="auto_quality")
+
+
+# --- Frame Tracing (shared with async_server's broadcaster) ---
+def trace_fields(frame_packet, traced):
+    """Fields added to the 'detections' event that follows a frame; viewers ack frames marked trace."""
+    fields = {"frame_id": frame_packet.version, "capture_mono": frame_packet.capture_mono}
+    if traced:
+        fields["trace"] = True
+    return fields
+
+
+def record_pong(camera_name, sid, data):
+    """'pong' {server_mono, client_time}: one clock sample for the viewer."""
+    try:
+        server_mono, client_time = float(data["server_mono"]), float(data["client_time"])
+    except (KeyError, TypeError, ValueError):
+        return
+    camera_state[camera_name].tracer.clock_sample(sid, server_mono, client_time)
+
+
+def record_frame_ack(camera_name, sid, data):
+    """'frame_ack' {frame_id, received, displayed}: completes the viewer's trace of a sampled frame."""
+    try:
+        frame_id, received = int(data["frame_id"]), float(data["received"])
+        displayed = float(data["displayed"]) if data.get("displayed") is not None else None
+    except (KeyError, TypeError, ValueError):
+        return
+    camera_state[camera_name].tracer.ack(sid, frame_id, received, displayed)
 
 
 # --- Frame Emission Background Thread ---
-def frame_emitter(camera_name):
-    """Takes frames from queue, encodes, and emits via SocketIO."""
+def frame_emitter(camera_name, heartbeat=UNSUPERVISED):
+    """Takes the newest published frame, encodes, and emits via SocketIO."""
     state = camera_state[camera_name]
-    print(f"[{camera_name}] Frame emitter starting (AI Enabled: {AI_ENABLED}, Resize: {RESIZE_BEFORE_EMIT})...")
-
-    while state.get("capture_active", False):
-        frame_to_emit = None
-        detections_to_emit = {}
+    stats = state.emit_stats # Only this thread writes emit stats
+    log = pipeline_log.get_logger(camera_name)
+    log.info("Frame emitter starting (AI Enabled: %s, Resize: %s)...", AI_ENABLED, RESIZE_BEFORE_EMIT)
+    tracer = state.tracer
+    next_ping = 0.0
+    encode_seconds = metrics.stage_histogram(camera_name, "encode")
+    emit_seconds = metrics.stage_histogram(camera_name, "emit")
+    emit_drops = metrics.counter("pipeline_frames_dropped_total", "Frames dropped before reaching viewers.",
+                                 camera=camera_name, stage="emit")
+    last_emitted_version = 0
+
+    while state.capture_active and heartbeat.current:
+        heartbeat.beat()
         current_time = time.time()
 
         # --- Rate Limiting ---
-        time_since_last_emit = current_time - state.get("last_frame_time_emit", 0)
+        time_since_last_emit = current_time - stats.last_emit_time
         if time_since_last_emit < EMIT_INTERVAL:
             sleep_time = EMIT_INTERVAL - time_since_last_emit
             # Sleep only if needed, use precise sleep for accuracy
@@ -422,68 +777,61 @@ def frame_emitter(camera_name):
             continue # Check condition again
 
         try:
-            # --- Get Latest Frame and Detections ---
-            with shared_lock:
-                # Get the most recent frame by consuming the queue
-                while len(state["frame_queue"]) > 0:
-                    frame_to_emit = state["frame_queue"].popleft() # Get oldest if multiple, effectively latest if queue size=1
-
-                # Get the corresponding detections (captured by capture_loop)
-                detections_to_emit = state.get("last_detection_data", {})
-
-            if frame_to_emit is None:
-                # No frame available, wait briefly and try again
+            # --- Get Latest Frame and Detections (lock-free packet reads) ---
+            frame_packet = state.frame_packet
+            if frame_packet is None or frame_packet.version == last_emitted_version:
+                # No new frame available, wait briefly and try again
                 time.sleep(EMIT_INTERVAL / 3) # Wait a fraction of the emit interval
                 continue
-
-            # --- Resize Frame (if enabled) ---
-            # NOTE: Currently disabled by RESIZE_BEFORE_EMIT = False
-            if RESIZE_BEFORE_EMIT and state.get("current_emit_scale", 1.0) != 1.0:
-                 scale = state["current_emit_scale"]
-                 if scale > 0.1: # Basic sanity check for scale factor
-                     width = int(frame_to_emit.shape[1] * scale)
-                     height = int(frame_to_emit.shape[0] * scale)
-                     frame_to_emit = cv2.resize(frame_to_emit, (width, height), interpolation=cv2.INTER_AREA) # Use INTER_AREA for shrinking
-
-            # --- Encode frame to JPEG ---
-            jpeg_quality = state.get("current_jpeg_quality", DEFAULT_JPEG_QUALITY)
-            encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)] # Ensure quality is integer
-            ret, buf = cv2.imencode('.jpg', frame_to_emit, encode_params)
-
-            if not ret:
-                print(f"[{camera_name}] Frame encoding failed.")
+            if last_emitted_version:
+                emit_drops.inc(frame_packet.version - last_emitted_version - 1) # Superseded before we got to them
+            last_emitted_version = frame_packet.version
+            frame_to_emit = frame_packet.frame
+            traced = tracer.sampled(frame_packet.version)
+
+            # Get the corresponding detections (captured by capture_loop)
+            detection_packet = state.detection_packet
+            detections_to_emit = detection_packet.detections or EMPTY_DETECTION
+            detection_time = detection_packet.capture_time
+
+            # --- Resize and Encode frame to JPEG ---
+            encode_start = time.perf_counter()
+            encode_mono = time.monotonic()
+            frame_bytes = encode_frame(state, frame_to_emit)
+            encode_seconds.observe(time.perf_counter() - encode_start)
+            if frame_bytes is None:
+                log.warning("Frame encoding failed.", key="encode_failed")
                 continue
+            if traced:
+                tracer.mark(frame_packet.version, encode_start=encode_mono, encoded=time.monotonic())
 
             # --- Emit Data via SocketIO ---
+            emit_start = time.perf_counter()
             # Emit frame first
-            socketio.emit("frame", buf.tobytes(), room=camera_name)
-
-            # Emit detections (even if empty)
-            socketio.emit('detections', detections_to_emit, room=camera_name)
-
-            # --- Update State and Counters ---
-            with shared_lock:
-                state["last_frame_time_emit"] = time.time() # Use emission time
-                state["emitted_frame_counter"] += 1
-
-                # Calculate FPS periodically
-                now = time.time()
-                if now - state["last_fps_check_time"] >= 2.0: # Check every 2 seconds
-                    duration = now - state["last_fps_check_time"]
-                    current_fps = round(state["emitted_frame_counter"] / duration)
-                    # Only update if FPS calculation is valid
-                    if duration > 0:
-                        state["current_emit_fps"] = current_fps
-                    state["last_fps_check_time"] = now
-                    state["emitted_frame_counter"] = 0
-                    # print(f"[{camera_name}] Emit FPS: ~{state['current_emit_fps']}") # Optional print
+            socketio.emit("frame", frame_bytes, room=camera_name)
+
+            # Emit detections (even if empty), stamped with their capture time and the frame they follow
+            socketio.emit('detections', {**detections_to_emit, "timestamp": detection_time,
+                                         **trace_fields(frame_packet, traced)}, room=camera_name)
+            emit_seconds.observe(time.perf_counter() - emit_start)
+            if traced:
+                tracer.mark(frame_packet.version, emitted=time.monotonic())
+            if TRACE_SAMPLE_EVERY and time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + TRACE_PING_SECONDS
+                socketio.emit('ping', {"server_mono": time.monotonic()}, room=camera_name)
+
+            # Cache for /snapshot and instant replay
+            store_encoded(state, frame_bytes, detections_to_emit, frame_packet.capture_time)
+
+            # --- Update Counters (FPS recalculated every 2 seconds) ---
+            if stats.record_emit(time.time()) and AUTO_QUALITY: # Use emission time
+                adjust_quality_for_fps(state)
 
         except Exception as e:
-            print(f"[{camera_name}] CRITICAL ERROR in frame_emitter loop: {e}")
-            print(traceback.format_exc())
+            log.exception("CRITICAL ERROR in frame_emitter loop: %s", e, key="emitter_crash")
             time.sleep(1) # Wait after a critical error
 
-    print(f"[{camera_name}] Frame emitter stopped.")
+    log.info("Frame emitter stopped.")
 
 
 # --- SocketIO Event Handlers ---
@@ -495,9 +843,7 @@ def handle_connect():
     flask_socketio.join_room(CAMERA_NAME, sid=sid)
     print(f"  Client {sid} joined room '{CAMERA_NAME}'")
     # Optionally send current state or welcome message
-    with shared_lock:
-        state = camera_state[CAMERA_NAME]
-        current_quality = state.get("current_jpeg_quality", DEFAULT_JPEG_QUALITY)
+    current_quality = camera_state[CAMERA_NAME].jpeg_quality
     socketio.emit('connection_ack', {'camera': CAMERA_NAME, 'quality': current_quality}, room=sid)
 
 
@@ -505,18 +851,40 @@ def handle_connect():
 def handle_disconnect():
     sid = request.sid
     print(f"🔴 Client disconnected: {sid}")
+    camera_state[CAMERA_NAME].tracer.forget(sid)
     # Room cleanup is usually handled automatically by flask-socketio, but explicit leave is fine too
     # flask_socketio.leave_room(CAMERA_NAME, sid=sid)
     # print(f"  Client {sid} left room '{CAMERA_NAME}'")
 
 
-@socketio.on('quality_adjustment')
-def handle_quality_adjustment(data):
-    """Handles client requests to change stream quality."""
+@socketio.on('test_event')
+def handle_test_event(data):
+    """Handles test event from client button (for debugging)."""
     sid = request.sid
-    level = data.get('level', 'medium') # Expect 'low', 'medium', 'high'
-    print(f"↔️ Received quality_adjustment request from {sid}: level={level}")
+    print(f">>>>> Received test_event from {sid}: {data}")
+    reply_data = {'reply': f'Acknowledged test from server! [async_mode={socketio.async_mode}]', 'your_sid': sid}
+    socketio.emit('test_reply', reply_data, room=sid)
+
+
+@socketio.on('pong')
+def handle_pong(data):
+    record_pong(CAMERA_NAME, request.sid, data or {})
+
+
+@socketio.on('frame_ack')
+def handle_frame_ack(data):
+    record_frame_ack(CAMERA_NAME, request.sid, data or {})
+
 
+@socketio.on('heart_rate')
+def handle_heart_rate(data):
+    """Streams heart-rate samples ({userId, bpm, timestamp} or {userId, samples}); the ack carries the counts."""
+    body, _ = ingest_heart_rate(data)
+    return body
+
+
+def apply_quality_level(camera_name, level):
+    """Maps a 'low'/'medium'/'high' request to a JPEG quality and applies it. Returns the quality."""
     new_quality = DEFAULT_JPEG_QUALITY # Default fallback
     if level == 'low':
         new_quality = 30
@@ -525,11 +893,18 @@ def handle_quality_adjustment(data):
     elif level == 'high':
         new_quality = 75 # Keep reasonable, very high quality increases size a lot
 
-    with shared_lock:
-        state = camera_state[CAMERA_NAME]
-        state['current_jpeg_quality'] = new_quality
+    camera_state[camera_name].jpeg_quality = new_quality # Atomic rebind; emitter reads it per frame
+    print(f"  [{camera_name}] Updated stream settings: Quality={new_quality}")
+    return new_quality
+
 
-    print(f"  [{CAMERA_NAME}] Updated stream settings: Quality={new_quality}")
+@socketio.on('quality_adjustment')
+def handle_quality_adjustment(data):
+    """Handles client requests to change stream quality."""
+    sid = request.sid
+    level = data.get('level', 'medium') # Expect 'low', 'medium', 'high'
+    print(f"↔️ Received quality_adjustment request from {sid}: level={level}")
+    new_quality = apply_quality_level(CAMERA_NAME, level)
     # Acknowledge the change back to the client
     socketio.emit('quality_updated', {'level': level, 'quality_value': new_quality}, room=sid)
 
@@ -553,18 +928,12 @@ def video_feed():
             try:
                 if mjpeg_cap is None:
                     print(f"[{mjpeg_cam_name}] Opening stream for MJPEG...")
-                    # Use same global RTSP_URL and standard VideoCapture
-                    mjpeg_cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
-                    if not mjpeg_cap or not mjpeg_cap.isOpened():
+                    # Same decoder order as the main capture loop
+                    mjpeg_cap = open_stream(mjpeg_cam_name)
+                    if not mjpeg_cap:
                         print(f"[{mjpeg_cam_name}] Failed to open stream. Retrying...")
-                        if mjpeg_cap:
-                            try: mjpeg_cap.release()
-                            except: pass
-                        mjpeg_cap = None
                         time.sleep(REOPEN_DELAY_SECONDS) # Wait before retrying
                         continue
-                    else:
-                         mjpeg_cap.set(cv2.CAP_PROP_BUFFERSIZE, 2) # Small buffer for MJPEG too
 
                 ret, frame = mjpeg_cap.read()
                 if not ret or frame is None or frame.size == 0:
@@ -585,8 +954,8 @@ def video_feed():
                     continue # Re-check time after sleep
 
                 # Encode the captured frame
-                ret_enc, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, mjpeg_quality])
-                if not ret_enc:
+                jpeg_bytes = encode_jpeg(frame, mjpeg_quality)
+                if jpeg_bytes is None:
                     print(f"[{mjpeg_cam_name}] MJPEG encoding failed.")
                     # Don't yield a broken frame, just continue
                     continue
@@ -594,7 +963,7 @@ def video_feed():
                 # Yield the frame in MJPEG format
                 yield (
                     b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + buf.tobytes() + b'\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + jpeg_bytes + b'\r\n'
                 )
                 last_frame_yield_time = time.time() # Update time after successful yield
 
@@ -621,32 +990,372 @@ def video_feed():
     return Response(generate_mjpeg(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
+# --- H.264 Passthrough Endpoint ---
+@app.route('/passthrough/<camera_name>.<fmt>')
+def passthrough_feed(camera_name, fmt):
+    """Streams the camera's H.264 remuxed (not re-encoded) as fMP4 (.mp4) or Annex-B (.h264)."""
+    if camera_name not in camera_state:
+        return jsonify({'error': f'Unknown camera: {camera_name}'}), 404
+    if fmt not in passthrough.SUPPORTED_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}', 'formats': list(passthrough.SUPPORTED_FORMATS)}), 400
+    if backends.sources.is_source_url(RTSP_URL):
+        return jsonify({'error': 'Passthrough needs an H.264 camera stream, not a file/images/synthetic source.'}), 409
+    response = Response(passthrough.stream_passthrough(camera_name, RTSP_URL, fmt),
+                        mimetype=passthrough.MIMETYPES[fmt])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- Snapshot Endpoint ---
+@app.route('/snapshot/<camera_name>')
+def snapshot(camera_name):
+    """Returns the most recently emitted JPEG from cache, with ETag conditional GET support."""
+    state = camera_state.get(camera_name)
+    if state is None:
+        return jsonify({'error': f'Unknown camera: {camera_name}'}), 404
+    cached = state.encoded_packet
+    if cached is None:
+        return jsonify({'error': 'No frame available yet.'}), 503
+    seq, jpeg_bytes, timestamp = cached
+    etag = f"{camera_name}-{seq}"
+    if etag in request.if_none_match or request.args.get('after') == str(seq):
+        response = Response(status=304)
+    else:
+        response = Response(jpeg_bytes, mimetype='image/jpeg')
+    response.set_etag(etag)
+    response.headers['X-Frame-Seq'] = str(seq)
+    response.headers['X-Timestamp'] = f"{timestamp:.3f}"
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# --- Instant Replay Endpoint ---
+def close_dvr(camera_name):
+    """Detaches and closes the camera's DVR ring (shutdown): unmaps it and closes the segment file."""
+    state = camera_state[camera_name]
+    ring, state.dvr = state.dvr, None
+    if ring is not None:
+        ring.close()
+
+@app.route('/replay/<camera_name>')
+def replay_feed(camera_name):
+    """Replays the last N seconds of emitted frames as MJPEG, at 1x or slow motion.
+
+    Query params: seconds (default 10), speed (default 1.0, e.g. 0.25 for slow motion).
+    """
+    state = camera_state.get(camera_name)
+    if state is None:
+        return jsonify({'error': f'Unknown camera: {camera_name}'}), 404
+    ring = state.dvr
+    if ring is None:
+        return jsonify({'error': 'Instant replay is disabled (DVR_ENABLED=0).'}), 404
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        speed = float(request.args.get('speed', 1.0))
+    except ValueError:
+        return jsonify({'error': 'seconds and speed must be numbers.'}), 400
+    return Response(dvr.stream_replay_mjpeg(ring, seconds, speed),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+# --- Pipeline Info Endpoint ---
+@app.route('/api/pipeline/backends')
+def pipeline_backends():
+    """Reports the selected decoder/inference/encoder backends and their startup benchmark timings."""
+    if SELECTED_BACKENDS is None:
+        return jsonify({'error': 'Pipeline not initialized yet.'}), 503
+    return jsonify({
+        'capabilities': CAPABILITIES,
+        'decoder': SELECTED_BACKENDS['decoder'],
+        'decoder_order': SELECTED_BACKENDS['decoder_order'],
+        'inference': SELECTED_BACKENDS['inference'],
+        'encoder': SELECTED_BACKENDS['encoder'],
+        'benchmark_ms': SELECTED_BACKENDS['results'],
+        'target_fps': TARGET_FPS,
+    })
+
+
+@app.route('/api/pipeline/health')
+def pipeline_health():
+    """Reports each supervised stage's heartbeat age, restart count and last recovery time."""
+    stages = supervisor.status()
+    healthy = all(stage['alive'] for stage in stages.values())
+    return jsonify({'healthy': healthy, 'stages': stages}), 200 if healthy else 503
+
+
+@app.route('/api/pipeline/latency')
+def pipeline_latency():
+    """Capture-to-display latency per stage and per viewer, from the sampled frame traces."""
+    return jsonify({name: state.tracer.summary() for name, state in camera_state.items()})
+
+
+@app.route('/api/pipeline/traces')
+def pipeline_traces():
+    """Exports the kept frame traces as JSON (query params: camera, limit)."""
+    camera_name = request.args.get('camera', CAMERA_NAME)
+    state = camera_state.get(camera_name)
+    if state is None:
+        return jsonify({'error': f'Unknown camera: {camera_name}'}), 404
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer.'}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be a positive integer.'}), 400
+    response = jsonify({'camera': camera_name, 'sample_every': state.tracer.sample_every,
+                        'exported_at': time.time(), 'traces': state.tracer.export(limit)})
+    response.headers['Content-Disposition'] = f'attachment; filename="traces-{camera_name}.json"'
+    return response
+
+
+# --- Profiling Endpoint ---
+@app.route('/api/debug/profile')
+def debug_profile():
+    """Samples every thread of this process for a few seconds and returns collapsed stacks (for flamegraphs).
+
+    Query params: seconds (default 5), interval_ms, memory=1 (adds a tracemalloc report),
+    format=collapsed|json (json is the default with memory=1). The admin token goes in the X-Admin-Token header.
+    """
+    if not profiler.admin_allowed(request.remote_addr, request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Profiling needs ADMIN_TOKEN (or a loopback client when it is unset).'}), 403
+    try:
+        seconds, interval, memory = profiler.parse_request(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    print(f"[profiler] Profiling for {seconds}s (interval {interval * 1000:.0f}ms, memory={memory})...")
+    try:
+        result = profiler.profile(seconds, interval, memory, process_name=f"app-{os.getpid()}")
+    except profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    if request.args.get('format', 'json' if memory else 'collapsed') == 'json':
+        return jsonify(profiler.merge([result]))
+    return Response(profiler.collapsed_text(result['stacks']), mimetype='text/plain')
+
+
+# --- Metrics Endpoint ---
+def client_send_queues(server, room):
+    """Returns {sid: queued Engine.IO packets} for the viewers in `room` (sync or async python-socketio server)."""
+    queues = {}
+    for sid, eio_sid in server.manager.get_participants("/", room):
+        send_queue = getattr(server.eio.sockets.get(eio_sid), "queue", None)
+        if send_queue is not None:
+            queues[sid] = send_queue.qsize()
+    return queues
+
+
+def collect_pipeline_metrics(server):
+    """Scrape-time gauges: FPS, stream health, supervisor restarts and per-viewer send queues."""
+    # Engine.IO packets per emitted frame: 'frame', its binary attachment and 'detections'
+    packets_per_frame = 1 if STREAM_MODE == "passthrough" else 3
+    cameras = list(camera_state.items())
+    stages = supervisor.status()
+    client_queues = {name: client_send_queues(server, name) for name, _ in cameras}
+    passthrough_queues = passthrough.queue_depths()
+
+    def per_camera(value):
+        return [({"camera": name}, value(state)) for name, state in cameras]
+
+    def seconds(ms):
+        return None if ms is None else ms / 1000.0
+
+    return [
+        ("pipeline_target_fps", "gauge", "Emit rate the pipeline aims for.", [({}, TARGET_FPS)]),
+        ("pipeline_emit_fps", "gauge", "Measured emit rate (2s window).",
+         per_camera(lambda state: state.emit_stats.current_fps)),
+        ("pipeline_frames_captured_total", "counter", "Frames read and published by the capture loop.",
+         per_camera(lambda state: state.capture_stats.frames_captured)),
+        ("pipeline_stream_reconnects_total", "counter", "Stream reconnections after a stall or failure.",
+         per_camera(lambda state: state.capture_stats.reconnects)),
+        ("pipeline_standby_takeovers_total", "counter", "Reconnections served by the warm standby.",
+         per_camera(lambda state: state.capture_stats.standby_takeovers)),
+        ("pipeline_stream_open_failures", "gauge", "Failed open attempts since the last successful one.",
+         per_camera(lambda state: state.capture_stats.stream_failures)),
+        ("pipeline_last_outage_seconds", "gauge", "Duration of the last stream outage.",
+         per_camera(lambda state: seconds(state.capture_stats.last_outage_ms))),
+        ("pipeline_buffer_latency_seconds", "gauge", "Delay added by decoder/network buffers (live streams).",
+         per_camera(lambda state: seconds(state.capture_stats.buffer_latency_ms))),
+        ("pipeline_frame_age_seconds", "gauge", "Age of the last frame when the capture loop got it.",
+         per_camera(lambda state: seconds(state.capture_stats.frame_age_ms))),
+        ("pipeline_stage_restarts_total", "counter", "Watchdog restarts of a supervised stage.",
+         [({"stage": name}, stage["restarts"]) for name, stage in stages.items()]),
+        ("pipeline_stage_heartbeat_age_seconds", "gauge", "Time since a supervised stage last beat.",
+         [({"stage": name}, seconds(stage["heartbeat_age_ms"])) for name, stage in stages.items()]),
+        ("pipeline_client_send_queue_packets", "gauge", "Engine.IO packets queued for a viewer.",
+         [({"camera": name, "sid": sid}, depth) for name, queues in client_queues.items()
+          for sid, depth in queues.items()]),
+        ("pipeline_client_send_lag_seconds", "gauge", "Estimated viewer send lag: queued frames x emit interval.",
+         [({"camera": name, "sid": sid}, depth / packets_per_frame * EMIT_INTERVAL)
+          for name, queues in client_queues.items() for sid, depth in queues.items()]),
+        ("pipeline_passthrough_queue_depth", "gauge", "Largest passthrough client queue (fragments/NAL units).",
+         [({"camera": camera, "format": fmt}, max(depths, default=0))
+          for (camera, fmt), depths in passthrough_queues.items()]),
+    ]
+
+
+def collect_log_metrics():
+    """Pipeline log records per camera and key: written, rate-limited, or dropped on a full queue."""
+    totals, dropped = pipeline_log.counters()
+    return [
+        ("pipeline_log_messages_total", "counter", "Frame-path log records by outcome.",
+         [({"camera": camera or "", "key": key, "outcome": outcome}, count)
+          for (camera, key), counts in totals.items()
+          for outcome, count in zip(("logged", "suppressed"), counts)]),
+        ("pipeline_log_dropped_total", "counter", "Log records dropped because the log queue was full.",
+         [({}, dropped)]),
+    ]
+
+
+def register_metrics(server):
+    """Adds the pipeline gauges, with `server`'s viewer queues, to /metrics. Call once per process."""
+    metrics.register_collector(lambda: collect_pipeline_metrics(server))
+    metrics.register_collector(collect_log_metrics)
+
+
+# --- Landmark Recording ---
+recording_lock = threading.Lock() # Concurrent start/stop requests must not create (or orphan) a second recorder
+
+
+def start_recording(camera_name):
+    """Starts a new recording session for the camera unless one is running. Returns the recorder."""
+    state = camera_state[camera_name]
+    with recording_lock:
+        if state.recorder is None:
+            state.recorder = landmark_recorder.LandmarkRecorder(camera_name)
+        return state.recorder
+
+
+def stop_recording(camera_name, timeout=SHUTDOWN_TIMEOUT_SECONDS):
+    """Stops the camera's recording and flushes it. Returns the files written (empty if none was running)."""
+    state = camera_state[camera_name]
+    with recording_lock:
+        recorder, state.recorder = state.recorder, None
+    if recorder is None:
+        return []
+    recorder.close(timeout)
+    return recorder.files
+
+
+@app.route('/api/recordings', methods=['GET'])
+def list_recordings():
+    """Landmark recordings on disk, and which cameras are recording now."""
+    return jsonify({
+        'recordings': landmark_recorder.list_recordings(),
+        'active': {name: state.recorder.session for name, state in camera_state.items() if state.recorder},
+    })
+
+
+@app.route('/api/recordings/start', methods=['POST'])
+def start_recording_endpoint():
+    camera_name = request.args.get('camera', CAMERA_NAME)
+    if camera_name not in camera_state:
+        return jsonify({'error': f"Unknown camera '{camera_name}'."}), 404
+    recorder = start_recording(camera_name)
+    return jsonify({'camera': camera_name, 'session': recorder.session})
+
+
+@app.route('/api/recordings/stop', methods=['POST'])
+def stop_recording_endpoint():
+    camera_name = request.args.get('camera', CAMERA_NAME)
+    if camera_name not in camera_state:
+        return jsonify({'error': f"Unknown camera '{camera_name}'."}), 404
+    files = stop_recording(camera_name)
+    return jsonify({'camera': camera_name, 'files': [os.path.basename(path) for path in files]})
+
+
+# --- Batch Pose Analysis ---
+@app.route('/api/batch/pose', methods=['POST'])
+def submit_batch_pose():
+    """Queues a video for offline analysis: multipart 'video' upload, or {"path"} on this host (admin only).
+
+    'exercise' (form field or JSON) is pushup or situp. Answers 202 with the job id; poll /api/batch/pose/<id>.
+    """
+    upload = request.files.get('video')
+    data = request.form if upload else (request.get_json(silent=True) or {})
+    exercise = data.get('exercise', 'pushup')
+    if exercise not in batch_pose.EXERCISES:
+        return jsonify({'error': f"exercise must be one of {list(batch_pose.EXERCISES)}"}), 400
+    if upload:
+        upload_dir = os.path.join(BATCH_DIR, batch_pose.UPLOAD_DIR)
+        os.makedirs(upload_dir, exist_ok=True)
+        extension = os.path.splitext(upload.filename or '')[1][:10] or '.mp4'
+        path = os.path.join(upload_dir, f"{time.time_ns()}{extension}")
+        upload.save(path)
+        try:
+            job = batch_pose.submit(path, exercise, owned_file=True, name=os.path.basename(upload.filename or ''))
+        except ValueError as e:
+            os.remove(path)
+            return jsonify({'error': str(e)}), 400
+    elif data.get('path'):
+        if not profiler.admin_allowed(request.remote_addr, request.headers.get('X-Admin-Token')):
+            return jsonify({'error': 'Server paths need an admin token (or a loopback client).'}), 403
+        if not os.path.isfile(data['path']):
+            return jsonify({'error': 'No such file.'}), 404
+        try:
+            job = batch_pose.submit(data['path'], exercise)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    else:
+        return jsonify({'error': "Send a 'video' file or a 'path'."}), 400
+    return jsonify({'jobId': job.id, 'status': job.status, 'statusUrl': f"/api/batch/pose/{job.id}"}), 202
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Bodies past MAX_CONTENT_LENGTH, declared or counted while a chunked upload streams in."""
+    return jsonify({'error': f"Upload exceeds BATCH_MAX_UPLOAD_MB ({BATCH_MAX_UPLOAD_MB} MB)."}), 413
+
+
+@app.route('/api/batch/pose/<job_id>', methods=['GET'])
+def batch_pose_status(job_id):
+    """Job status and progress; includes the report (reps, form scores, speed) once it is done."""
+    job = batch_pose.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    return jsonify(job.summary())
+
+
+@app.route('/api/batch/pose/<job_id>/landmarks', methods=['GET'])
+def batch_pose_landmarks(job_id):
+    """The merged per-frame landmarks as a landmark recording (open with landmark_recorder.open_recording)."""
+    job = batch_pose.get_job(job_id)
+    if job is None or job.status != 'done':
+        return jsonify({'error': 'No finished job with this id.'}), 404
+    return send_file(batch_pose.landmarks_path(job.id), mimetype='application/octet-stream', as_attachment=True)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint: per-stage latency histograms, drops, FPS, reconnects and viewer lag."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # --- Main Application Execution ---
-if __name__ == "__main__":
+def main():
+    print_config()
     print("\n--- Starting Flask-SocketIO Server ---")
-    print(f"Config: AI_ENABLED={AI_ENABLED}, RESIZE_BEFORE_EMIT={RESIZE_BEFORE_EMIT}, DEFAULT_JPEG_QUALITY={DEFAULT_JPEG_QUALITY}")
-    print(f"Config: TARGET_FPS={TARGET_FPS} (Emit Interval: {EMIT_INTERVAL:.3f}s)")
-    if not AI_ENABLED:
-        print("INFO: Using standard CPU decoding for video stream.")
-        print("RECOMMENDATION: Lower the camera's output Resolution and Frame Rate via its web interface for best performance.")
-    print(f"SocketIO Async Mode: {socketio.async_mode}")
-
     if CAMERA_NAME not in camera_state:
         print(f"Error: CAMERA_NAME '{CAMERA_NAME}' from config.py not found in initial camera_state setup.")
         exit(1)
 
+    init_pipeline()
+    print(f"Config: AI_ENABLED={AI_ENABLED}, RESIZE_BEFORE_EMIT={RESIZE_BEFORE_EMIT}, DEFAULT_JPEG_QUALITY={DEFAULT_JPEG_QUALITY}")
+    print(f"Config: TARGET_FPS={TARGET_FPS} (Emit Interval: {EMIT_INTERVAL:.3f}s), AUTO_QUALITY={AUTO_QUALITY}")
+    print(f"Config: STREAM_MODE={STREAM_MODE}")
+    print(f"SocketIO Async Mode: {socketio.async_mode}")
+
     print(f"\n--- Initializing Background Tasks for Camera: {CAMERA_NAME} ---")
+    if DVR_ENABLED and STREAM_MODE != "passthrough":
+        try:
+            camera_state[CAMERA_NAME].dvr = dvr.FrameRing(CAMERA_NAME)
+        except Exception as e:
+            print(f"[{CAMERA_NAME}] WARNING: Could not create DVR ring, instant replay disabled: {e}")
+    if RECORD_LANDMARKS:
+        start_recording(CAMERA_NAME)
+    register_metrics(socketio.server)
+    session_store.get_store() # Open (and migrate) the database before the first request
     try:
-        # Start capture thread first
-        capture_thread = threading.Thread(target=capture_loop, args=(CAMERA_NAME,), daemon=True)
-        capture_thread.start()
-        print(" -> Capture thread started.")
-
-        # Start emitter thread
-        emitter_thread = threading.Thread(target=frame_emitter, args=(CAMERA_NAME,), daemon=True)
-        emitter_thread.start()
-        print(" -> Emitter thread started.")
-
+        supervise_camera(CAMERA_NAME)
+        supervisor.start()
     except Exception as e:
         print(f"FATAL: Failed to start background threads: {e}")
         traceback.print_exc()
@@ -669,6 +1378,12 @@ if __name__ == "__main__":
     print(f"Web Interface available at: http://{display_ip}:{SOCKET_PORT}/")
     print(f"SocketIO Endpoint:          ws://{display_ip}:{SOCKET_PORT}/socket.io/")
     print(f"MJPEG Fallback Stream:      http://{display_ip}:{SOCKET_PORT}/video_feed")
+    print(f"H.264 Passthrough (fMP4):   http://{display_ip}:{SOCKET_PORT}/passthrough/{CAMERA_NAME}.mp4")
+    print(f"Latest Snapshot (JPEG):     http://{display_ip}:{SOCKET_PORT}/snapshot/{CAMERA_NAME}")
+    print(f"Instant Replay (MJPEG):     http://{display_ip}:{SOCKET_PORT}/replay/{CAMERA_NAME}?seconds=10&speed=0.5")
+    print(f"Selected Backends (JSON):   http://{display_ip}:{SOCKET_PORT}/api/pipeline/backends")
+    print(f"Metrics (Prometheus):       http://{display_ip}:{SOCKET_PORT}/metrics")
+    print(f"Frame Latency (JSON):       http://{display_ip}:{SOCKET_PORT}/api/pipeline/latency")
     print(f"(Also listening on:         http://0.0.0.0:{SOCKET_PORT})")
     print("\nPress Ctrl+C to stop the server.")
 
@@ -686,24 +1401,24 @@ if __name__ == "__main__":
         print("--- Initiating Shutdown Sequence ---")
         # Signal threads to stop
         print("Stopping background tasks...")
+        passthrough.stop_all()
+        # Retires every stage's heartbeat (loops exit at their next check) and joins the threads;
+        # the supervisor is stopped first so it doesn't restart threads that exit on purpose
+        print(f"Waiting for threads to finish (up to {SHUTDOWN_TIMEOUT_SECONDS} seconds)...")
+        supervisor.stop(SHUTDOWN_TIMEOUT_SECONDS)
         for cam_name in list(camera_state.keys()):
-             print(f"  Signalling stop for: {cam_name}")
-             if isinstance(camera_state.get(cam_name), dict):
-                 with shared_lock:
-                     # Set the flag to signal loops to exit
-                     camera_state[cam_name]["capture_active"] = False
-
-        # Wait briefly for threads to exit gracefully
-        print("Waiting for threads to finish (up to 2 seconds)...")
-        # Give threads a chance to finish their current loop iteration and check the flag
-        time.sleep(2.0) # Adjust sleep time as needed
-
-        # Check if threads are still alive (optional, mainly for diagnostics)
-        # if capture_thread.is_alive():
-        #      print(f"Warning: Capture thread for {CAMERA_NAME} did not exit cleanly.")
-        # if emitter_thread.is_alive():
-        #      print(f"Warning: Emitter thread for {CAMERA_NAME} did not exit cleanly.")
+             camera_state[cam_name].capture_active = False
 
+        session_store.stop(SHUTDOWN_TIMEOUT_SECONDS) # Commit rows still in the write-behind queue
+        llm_client.close()
+        for cam_name in list(camera_state.keys()):
+            stop_recording(cam_name)
+            close_dvr(cam_name)
         print("Shutdown complete.")
+        pipeline_log.stop() # Flush queued log records; os._exit skips atexit handlers
         # Explicitly exit the process
-        os._exit(0) # Force exit if threads are stuck (use cautiously)
\ No newline at end of file
+        os._exit(0) # Force exit if threads are stuck (use cautiously)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+# backend/async_server.py
+"""
+Asyncio Socket.IO server for high viewer counts.
+
+Runs python-socketio's AsyncServer on ASGI (uvicorn) instead of Flask-SocketIO's
+thread-per-connection mode. Capture and inference keep running in the pipeline's
+worker threads; one broadcaster coroutine per camera picks up new frame packets,
+JPEG-encodes each frame once in an executor thread and emits it to the camera
+room. Viewers whose send queue is already backed up are skipped for that frame,
+so memory stays bounded however slow a client is. The Flask routes (/api/*,
+/snapshot, /replay, /passthrough, /video_feed) are mounted through ThreadedWsgi,
+which runs each request on its own thread from a pool of ASYNC_WSGI_THREADS, so
+a long streaming response never holds up the other routes.
+
+Run with:  python async_server.py
+      or:  uvicorn async_server:asgi_app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import importlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+import socketio
+
+import metrics
+import pipeline_log
+from config import (
+    CAMERA_NAME, SOCKET_PORT, STREAM_MODE, DVR_ENABLED, RECORD_LANDMARKS,
+    PIPELINE_MODULE, ASYNC_MAX_CLIENT_BACKLOG, ASYNC_WSGI_THREADS, SHUTDOWN_TIMEOUT_SECONDS, TRACE_SAMPLE_EVERY, TRACE_PING_SECONDS,
+    print_config
+)
+
+# Pipeline module (app) providing init_pipeline, camera_state, supervise_camera/supervisor,
+# encode_frame, store_encoded, apply_quality_level, register_metrics, the trace helpers and the Flask app
+pipeline = importlib.import_module(PIPELINE_MODULE)
+
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*",
+                           logger=False, engineio_logger=False)
+encode_executor = ThreadPoolExecutor(max_workers=max(1, len(pipeline.camera_state)),
+                                     thread_name_prefix="encode")
+broadcaster_tasks = {}
+
+
+# --- Backpressure ---
+def lagging_sids(room):
+    """Returns sids in `room` whose Engine.IO send queue is at or over ASYNC_MAX_CLIENT_BACKLOG."""
+    lagging = []
+    for sid, eio_sid in sio.manager.get_participants("/", room):
+        eio_socket = sio.eio.sockets.get(eio_sid)
+        send_queue = getattr(eio_socket, "queue", None)
+        if send_queue is not None and send_queue.qsize() >= ASYNC_MAX_CLIENT_BACKLOG:
+            lagging.append(sid)
+    return lagging
+
+
+# --- Broadcaster ---
+async def broadcaster(camera_name):
+    """Encodes the newest frame packet once per emit interval and fans it out to the room."""
+    state = pipeline.camera_state[camera_name]
+    stats = state.emit_stats
+    loop = asyncio.get_running_loop()
+    encode_seconds = metrics.stage_histogram(camera_name, "encode")
+    emit_seconds = metrics.stage_histogram(camera_name, "emit")
+    emit_drops = metrics.counter("pipeline_frames_dropped_total", "Frames dropped before reaching viewers.",
+                                 camera=camera_name, stage="emit")
+    viewer_skips = metrics.counter("pipeline_frames_dropped_total", "Frames dropped before reaching viewers.",
+                                   camera=camera_name, stage="viewer_backlog")
+    tracer = state.tracer
+    next_ping = 0.0
+    last_frame_version = 0
+    last_detection_version = 0
+    log = pipeline_log.get_logger(camera_name)
+    log.info("Async broadcaster starting (STREAM_MODE=%s)...", STREAM_MODE)
+
+    while state.capture_active:
+        try:
+            wait = pipeline.EMIT_INTERVAL - (time.time() - stats.last_emit_time)
+            if wait > 0.001:
+                await asyncio.sleep(wait)
+                continue
+
+            detection_packet = state.detection_packet
+            detection = detection_packet.detections or pipeline.EMPTY_DETECTION
+
+            if STREAM_MODE == "passthrough":
+                # Video goes through the passthrough relay; only detections travel here
+                if detection_packet.version != last_detection_version:
+                    last_detection_version = detection_packet.version
+                    await sio.emit('detections', {**detection, 'timestamp': detection_packet.capture_time},
+                                   room=camera_name)
+                    stats.last_emit_time = time.time()
+                else:
+                    await asyncio.sleep(pipeline.EMIT_INTERVAL / 3)
+                continue
+
+            frame_packet = state.frame_packet
+            if frame_packet is None or frame_packet.version == last_frame_version:
+                await asyncio.sleep(pipeline.EMIT_INTERVAL / 3)
+                continue
+            if last_frame_version:
+                emit_drops.inc(frame_packet.version - last_frame_version - 1)
+            last_frame_version = frame_packet.version
+            traced = tracer.sampled(frame_packet.version)
+
+            # cv2 releases the GIL while encoding, so this doesn't stall the event loop
+            encode_start = time.perf_counter()
+            encode_mono = time.monotonic()
+            frame_bytes = await loop.run_in_executor(encode_executor, pipeline.encode_frame,
+                                                     state, frame_packet.frame)
+            encode_seconds.observe(time.perf_counter() - encode_start)
+            if frame_bytes is None:
+                log.warning("Frame encoding failed.", key="encode_failed")
+                continue
+            if traced:
+                tracer.mark(frame_packet.version, encode_start=encode_mono, encoded=time.monotonic())
+
+            skip = lagging_sids(camera_name)
+            viewer_skips.inc(len(skip))
+            emit_start = time.perf_counter()
+            await sio.emit("frame", frame_bytes, room=camera_name, skip_sid=skip or None)
+            await sio.emit('detections', {**detection, 'timestamp': detection_packet.capture_time,
+                                          **pipeline.trace_fields(frame_packet, traced)},
+                           room=camera_name, skip_sid=skip or None)
+            emit_seconds.observe(time.perf_counter() - emit_start)
+            if traced:
+                tracer.mark(frame_packet.version, emitted=time.monotonic())
+            if TRACE_SAMPLE_EVERY and time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + TRACE_PING_SECONDS
+                await sio.emit('ping', {'server_mono': time.monotonic()}, room=camera_name)
+
+            pipeline.store_encoded(state, frame_bytes, detection, frame_packet.capture_time)
+            stats.record_emit(time.time())
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            log.exception("CRITICAL ERROR in async broadcaster: %s", e, key="broadcaster_crash")
+            await asyncio.sleep(1)
+
+    log.info("Async broadcaster stopped.")
+
+
+# --- Socket.IO Event Handlers ---
+@sio.event
+async def connect(sid, environ):
+    print(f"🟢 Client connected: {sid}")
+    await sio.enter_room(sid, CAMERA_NAME)
+    await sio.emit('connection_ack', {'camera': CAMERA_NAME,
+                                      'quality': pipeline.camera_state[CAMERA_NAME].jpeg_quality}, to=sid)
+
+
+@sio.event
+async def disconnect(sid, reason=None):
+    print(f"🔴 Client disconnected: {sid}")
+    pipeline.camera_state[CAMERA_NAME].tracer.forget(sid)
+
+
+@sio.event
+async def pong(sid, data):
+    pipeline.record_pong(CAMERA_NAME, sid, data or {})
+
+
+@sio.event
+async def frame_ack(sid, data):
+    pipeline.record_frame_ack(CAMERA_NAME, sid, data or {})
+
+
+@sio.event
+async def heart_rate(sid, data):
+    body, _ = pipeline.ingest_heart_rate(data)
+    return body
+
+
+@sio.event
+async def quality_adjustment(sid, data):
+    level = (data or {}).get('level', 'medium')
+    print(f"↔️ Received quality_adjustment request from {sid}: level={level}")
+    new_quality = pipeline.apply_quality_level(CAMERA_NAME, level)
+    await sio.emit('quality_updated', {'level': level, 'quality_value': new_quality}, to=sid)
+
+
+# --- Flask Routes ---
+def _wsgi_environ(scope, body, body_length):
+    """The PEP 3333 environ for an ASGI HTTP scope, reading the request body from `body`."""
+    script_name = scope.get("root_path", "").encode("utf-8").decode("latin-1")
+    path_info = scope["path"].encode("utf-8").decode("latin-1")
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(body_length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", ()):
+        name, value = name.decode("latin-1").lower(), value.decode("latin-1")
+        if name in ("content-length", "transfer-encoding"):
+            continue  # The body was read whole; CONTENT_LENGTH above is its real size
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value  # Repeated headers, comma-joined
+    return environ
+
+
+class _ThreadedWsgiRequest:
+    """One request on a pool thread: runs the WSGI app and relays its response to the ASGI send()."""
+
+    def __init__(self, wsgi_application, send, loop, disconnected):
+        self.wsgi_application = wsgi_application
+        self.send = send
+        self.loop = loop
+        self.disconnected = disconnected
+        self.response_start = None
+        self.response_started = False
+
+    def send_sync(self, message):
+        asyncio.run_coroutine_threadsafe(self.send(message), self.loop).result()
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info is not None and self.response_started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.response_start = {
+            "type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        }
+        return self.write
+
+    def write(self, output):
+        if not self.response_started:
+            self.response_started = True
+            self.send_sync(self.response_start)
+        if output:
+            self.send_sync({"type": "http.response.body", "body": output, "more_body": True})
+
+    def run(self, environ):
+        iterable = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in iterable:
+                if self.disconnected.is_set():
+                    return  # close() below ends the generator (unsubscribes relays, stops replays)
+                self.write(output)
+            self.write(b"")
+            self.send_sync({"type": "http.response.body"})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+class ThreadedWsgi:
+    """Mounts a WSGI app on ASGI with each request on its own thread from a pool.
+
+    A single shared WSGI thread (asgiref's WsgiToAsgi) would let one open stream
+    (/video_feed, /replay, /passthrough, /api/chat/stream, exports, profiles)
+    stall every other route until it ended. Request bodies (chunked ones too)
+    stop being read past max_body bytes, the app's MAX_CONTENT_LENGTH.
+    """
+
+    def __init__(self, wsgi_application, max_threads=ASYNC_WSGI_THREADS, max_body=None):
+        self.wsgi_application = wsgi_application
+        self.max_body = max_body
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("WSGI wrapper received a non-HTTP scope")
+        with SpooledTemporaryFile(max_size=65536) as body:
+            length = 0
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                chunk = message.get("body", b"")
+                length += len(chunk)
+                body.write(chunk)
+                if not message.get("more_body") or (self.max_body is not None and length > self.max_body):
+                    break  # Past max_body the app sees a CONTENT_LENGTH over its limit and answers 413
+            body.seek(0)
+
+            disconnected = threading.Event()
+
+            async def watch_disconnect():
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                disconnected.set()
+
+            loop = asyncio.get_running_loop()
+            watcher = asyncio.create_task(watch_disconnect())
+            request = _ThreadedWsgiRequest(self.wsgi_application, send, loop, disconnected)
+            try:
+                await loop.run_in_executor(self.executor, request.run, _wsgi_environ(scope, body, length))
+            finally:
+                watcher.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+flask_app = ThreadedWsgi(pipeline.app, max_body=pipeline.app.config.get('MAX_CONTENT_LENGTH'))
+
+
+# --- Lifecycle ---
+async def on_startup():
+    print(f"\n--- Starting async pipeline ({PIPELINE_MODULE}, STREAM_MODE={STREAM_MODE}) ---")
+    # Backend probing/benchmarking blocks for a few seconds; keep the event loop responsive
+    await asyncio.get_running_loop().run_in_executor(None, pipeline.init_pipeline)
+    pipeline.register_metrics(sio) # /metrics is served by the mounted Flask app
+    await asyncio.get_running_loop().run_in_executor(None, pipeline.session_store.get_store)
+    for camera_name, state in pipeline.camera_state.items():
+        state.capture_active = True
+        if DVR_ENABLED and STREAM_MODE != "passthrough" and state.dvr is None:
+            try:
+                state.dvr = pipeline.dvr.FrameRing(camera_name)
+            except Exception as e:
+                print(f"[{camera_name}] WARNING: Could not create DVR ring, instant replay disabled: {e}")
+        if RECORD_LANDMARKS:
+            pipeline.start_recording(camera_name)
+
+        # Capture (and inference) stay in a supervised worker thread; the broadcaster replaces the emitter
+        pipeline.supervise_camera(camera_name, emitters=False)
+        broadcaster_tasks[camera_name] = asyncio.create_task(broadcaster(camera_name))
+    pipeline.supervisor.start()
+    print("--- Async Server Ready ---")
+
+
+async def on_shutdown():
+    print("--- Initiating Shutdown Sequence ---")
+    for task in broadcaster_tasks.values():
+        task.cancel()
+    pipeline.passthrough.stop_all()
+    await asyncio.get_running_loop().run_in_executor(None, pipeline.supervisor.stop, SHUTDOWN_TIMEOUT_SECONDS)
+    for state in pipeline.camera_state.values():
+        state.capture_active = False
+    encode_executor.shutdown(wait=False)
+    flask_app.shutdown()
+    await asyncio.get_running_loop().run_in_executor(None, pipeline.session_store.stop, SHUTDOWN_TIMEOUT_SECONDS)
+    for camera_name in pipeline.camera_state:
+        await asyncio.get_running_loop().run_in_executor(None, pipeline.stop_recording, camera_name)
+        pipeline.close_dvr(camera_name)
+    pipeline.llm_client.close()
+    print("Shutdown complete.")
+    pipeline_log.stop() # Flush queued log records
+
+
+asgi_app = socketio.ASGIApp(sio, other_asgi_app=flask_app,
+                            on_startup=on_startup, on_shutdown=on_shutdown)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    print_config()
+    print(f"SocketIO (asyncio) endpoint: ws://0.0.0.0:{SOCKET_PORT}/socket.io/")
+    uvicorn.run(asgi_app, host="0.0.0.0", port=SOCKET_PORT, log_level="warning")
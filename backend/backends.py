@@ -0,0 +1,553 @@
+# backend/backends.py
+"""
+Decoder / inference / encoder backend registry.
+
+Every backend registers itself with an availability check against the probed
+system capabilities. At startup select_backends() micro-benchmarks the
+available backends on real frames from the camera (synthetic frames if the
+stream can't be read yet) and keeps the fastest one that works in each stage.
+A backend can be pinned with DECODER_BACKEND / INFERENCE_BACKEND /
+ENCODER_BACKEND; "auto" benchmarks.
+Camera-free URLs (file:, images:, synthetic:; see sources.py) always use the
+"source" decoder.
+
+Probe and benchmark results are cached in CACHE_DIR, keyed by a fingerprint of
+the OpenCV binaries and library versions, so restarts skip both. cv2 (and
+mediapipe, through detection.py) is only imported once a backend is used.
+"""
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import traceback
+from importlib import metadata, util
+
+import numpy as np
+
+import sources
+from config import (
+    BENCHMARK_FRAMES, CONFIDENCE_THRESHOLD, SCORE_THRESHOLD, POSE_MODEL_COMPLEXITY,
+    DECODER_BACKEND, INFERENCE_BACKEND, ENCODER_BACKEND,
+    CACHE_DIR, PROBE_CACHE, BENCHMARK_CACHE_HOURS, STREAM_OPEN_TIMEOUT_MS
+)
+
+# Among backends within this fraction of the fastest, the one registered first wins
+# (e.g. NVDEC over CPU decoding when a live stream paces both reads equally)
+BENCHMARK_TOLERANCE = 0.10
+SYNTHETIC_FRAME_SIZE = (480, 640)  # (height, width)
+BENCHMARK_JPEG_QUALITY = 70
+
+# name -> {"available": fn(caps) -> bool, <stage callable>}; insertion order is priority
+DECODERS = {}
+INFERENCE = {}
+ENCODERS = {}
+
+
+def register_decoder(name, available=lambda caps: True):
+    """Registers fn(url) -> opened capture (after a good test read) or None."""
+    def wrap(fn):
+        DECODERS[name] = {"available": available, "open": fn}
+        return fn
+    return wrap
+
+
+def register_inference(name, available=lambda caps: True):
+    """Registers fn() -> processor with process_frame(frame) -> (frame, detection)."""
+    def wrap(fn):
+        INFERENCE[name] = {"available": available, "create": fn}
+        return fn
+    return wrap
+
+
+def register_encoder(name, available=lambda caps: True):
+    """Registers fn(frame, quality) -> JPEG bytes or None."""
+    def wrap(fn):
+        ENCODERS[name] = {"available": available, "encode": fn}
+        return fn
+    return wrap
+
+
+# --- System Capabilities ---
+def probe_capabilities():
+    """Checks for CUDA, GStreamer and NVDEC. Returns a dict of booleans plus the OpenCV version."""
+    import cv2
+    caps = {"opencv": getattr(cv2, "__version__", "unknown"), "cuda": False,
+            "gstreamer": False, "nvdec": False}
+    print("\n🔍 CHECKING SYSTEM CAPABILITIES...")
+    print("=================================")
+    print(f"OpenCV Version: {caps['opencv']}")
+
+    try:
+        if hasattr(cv2, 'cuda') and hasattr(cv2.cuda, 'getCudaEnabledDeviceCount'):
+            device_count = cv2.cuda.getCudaEnabledDeviceCount()
+            caps["cuda"] = device_count > 0
+            if caps["cuda"]:
+                print(f"✅ CUDA is available with {device_count} device(s)")
+            else:
+                print("❌ CUDA is not available in this OpenCV build")
+        else:
+            print("❌ CUDA module is not available in this OpenCV build")
+    except Exception as e:
+        print(f"❌ Error checking CUDA availability: {e}")
+
+    try:
+        gpu_info = subprocess.check_output("nvidia-smi", shell=True, stderr=subprocess.DEVNULL).decode()
+        print("📊 NVIDIA GPU INFO:")
+        for line in gpu_info.split('\n')[:10]:
+            if 'NVIDIA-SMI' in line or 'GPU Name' in line or 'MiB' in line:
+                print(f"   {line}")
+    except Exception:
+        print("❌ Could not retrieve NVIDIA GPU info (nvidia-smi not available)")
+
+    try:
+        has_gstreamer_build = 'GStreamer' in cv2.getBuildInformation()
+    except Exception:
+        has_gstreamer_build = False
+    if has_gstreamer_build:
+        try:
+            test_cap = cv2.VideoCapture("videotestsrc num-buffers=1 ! videoconvert ! appsink", cv2.CAP_GSTREAMER)
+            caps["gstreamer"] = test_cap.isOpened()
+            test_cap.release()
+            if caps["gstreamer"]:
+                nvdec_cap = cv2.VideoCapture(
+                    "videotestsrc num-buffers=1 ! videoconvert ! nvh264dec ! videoconvert ! appsink",
+                    cv2.CAP_GSTREAMER)
+                caps["nvdec"] = nvdec_cap.isOpened()
+                nvdec_cap.release()
+        except Exception as e:
+            print(f"❌ Error testing GStreamer: {e}")
+    print(f"{'✅' if caps['gstreamer'] else '❌'} GStreamer {'is' if caps['gstreamer'] else 'is not'} working with OpenCV")
+    print(f"{'✅' if caps['nvdec'] else '❌'} NVIDIA hardware decoding (nvh264dec) "
+          f"{'is' if caps['nvdec'] else 'is not'} available")
+    print("=================================\n")
+    return caps
+
+
+# --- Probe / Benchmark Cache ---
+CACHE_FILE = os.path.join(CACHE_DIR, "backends.json")
+CACHE_FORMAT = 1
+# Installed distributions whose versions invalidate the cache (cv2 builds without metadata are
+# covered by the binary fingerprint below)
+FINGERPRINT_DISTRIBUTIONS = ("opencv-python", "opencv-python-headless", "opencv-contrib-python",
+                             "opencv-contrib-python-headless", "mediapipe", "numpy",
+                             "simplejpeg", "PyTurboJPEG")
+
+
+def environment_fingerprint():
+    """Hashes library versions and the OpenCV binaries without importing cv2.
+
+    A rebuilt OpenCV (e.g. with CUDA/GStreamer) changes its binary's size/mtime,
+    and installing drivers or GStreamer changes the tools found on PATH.
+    """
+    parts = {"format": CACHE_FORMAT, "python": sys.version, "platform": platform.platform(),
+             "nvidia-smi": shutil.which("nvidia-smi"), "gst-inspect": shutil.which("gst-inspect-1.0"),
+             "GST_PLUGIN_PATH": os.environ.get("GST_PLUGIN_PATH")}
+    for dist in FINGERPRINT_DISTRIBUTIONS:
+        try:
+            parts[dist] = metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            pass
+    spec = util.find_spec("cv2")
+    locations = list(spec.submodule_search_locations or []) if spec else []
+    if spec and not locations and spec.origin:
+        locations = [os.path.dirname(spec.origin)]
+    for location in locations:
+        try:
+            entries = sorted(os.scandir(location), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_file() and (entry.name.endswith((".so", ".pyd", ".dylib")) or ".so." in entry.name):
+                stat = entry.stat()
+                parts[entry.path] = [stat.st_size, int(stat.st_mtime)]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _read_cache(fingerprint):
+    """Returns the cache dict for this fingerprint, or a fresh one if missing/stale/corrupt."""
+    try:
+        with open(CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("fingerprint") == fingerprint:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"fingerprint": fingerprint, "capabilities": None, "selections": {}}
+
+
+def _write_cache(cache):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_path, CACHE_FILE)  # Atomic, so concurrent starters never read half a file
+    except OSError as e:
+        print(f"WARNING: Could not write backend cache {CACHE_FILE}: {e}")
+
+
+def load_capabilities():
+    """probe_capabilities(), served from the on-disk cache while the fingerprint matches."""
+    fingerprint = environment_fingerprint()
+    cache = _read_cache(fingerprint)
+    if PROBE_CACHE and cache["capabilities"] is not None:
+        caps = cache["capabilities"]
+        print(f"Capabilities (cached, {fingerprint}): OpenCV {caps['opencv']}, CUDA={caps['cuda']}, "
+              f"GStreamer={caps['gstreamer']}, NVDEC={caps['nvdec']}")
+        return caps
+    caps = probe_capabilities()
+    cache["capabilities"] = caps
+    _write_cache(cache)
+    return caps
+
+
+# --- Decoders ---
+def _open_and_test(camera_label, cap):
+    """Returns cap if it is open and yields a frame, else releases it and returns None."""
+    if cap is None or not cap.isOpened():
+        print(f"   Failed to open with {camera_label}.")
+        return None
+    ret, frame = cap.read()
+    if ret and frame is not None and frame.size > 0:
+        print(f"   Test frame read successful ({frame.shape[1]}x{frame.shape[0]}) using {camera_label}.")
+        return cap
+    print(f"   Opened with {camera_label} but failed to read test frame, releasing...")
+    cap.release()
+    return None
+
+
+@register_decoder("gst_nvdec", available=lambda caps: caps["nvdec"])
+def open_gst_nvdec(url):
+    import cv2
+    pipeline = (
+        f"rtspsrc location={url} latency=0 ! "
+        f"rtph264depay ! h264parse ! "
+        f"nvh264dec ! videoconvert ! "
+        f"appsink max-buffers=1 drop=true sync=false"
+    )
+    return _open_and_test("GStreamer NVDEC", cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER))
+
+
+@register_decoder("gst_cpu", available=lambda caps: caps["gstreamer"])
+def open_gst_cpu(url):
+    import cv2
+    pipeline = (
+        f"rtspsrc location={url} latency=0 ! "
+        f"rtph264depay ! h264parse ! "
+        f"avdec_h264 ! videoconvert ! "
+        f"appsink max-buffers=1 drop=true sync=false"
+    )
+    return _open_and_test("GStreamer CPU decoding", cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER))
+
+
+@register_decoder("ffmpeg")
+def open_ffmpeg(url):
+    import cv2
+    # Without timeouts an unreachable camera blocks open/read for FFmpeg's default (~30s)
+    cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, STREAM_OPEN_TIMEOUT_MS,
+                                                 cv2.CAP_PROP_READ_TIMEOUT_MSEC, STREAM_OPEN_TIMEOUT_MS])
+    if cap is not None and cap.isOpened():
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return _open_and_test("FFmpeg (CPU decoding)", cap)
+
+
+# Never auto-detected: select_backends() uses it (only) for file:/images:/synthetic: URLs
+@register_decoder("source", available=lambda caps: False)
+def open_source(url):
+    try:
+        return _open_and_test(f"frame source {url}", sources.open_source(url))
+    except (ValueError, IOError) as e:
+        print(f"   Failed to open frame source: {e}")
+        return None
+
+
+# --- Inference ---
+@register_inference("mediapipe")
+def create_mediapipe():
+    from detection import ExerciseDetector
+    return ExerciseDetector(
+        model_complexity=POSE_MODEL_COMPLEXITY,
+        min_detection_confidence=CONFIDENCE_THRESHOLD,
+        min_tracking_confidence=SCORE_THRESHOLD
+    )
+
+
+# --- Encoders ---
+@register_encoder("opencv")
+def encode_opencv(frame, quality):
+    import cv2
+    ret, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return buf.tobytes() if ret else None
+
+
+def _simplejpeg_available(caps):
+    try:
+        import simplejpeg  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+@register_encoder("simplejpeg", available=_simplejpeg_available)
+def encode_simplejpeg(frame, quality):
+    import simplejpeg
+    return simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=int(quality), colorspace='BGR')
+
+
+_turbojpeg = None
+
+
+def _turbojpeg_available(caps):
+    global _turbojpeg
+    try:
+        from turbojpeg import TurboJPEG
+        _turbojpeg = TurboJPEG()  # Raises if libturbojpeg itself isn't installed
+        return True
+    except Exception:
+        return False
+
+
+@register_encoder("turbojpeg", available=_turbojpeg_available)
+def encode_turbojpeg(frame, quality):
+    return _turbojpeg.encode(frame, quality=int(quality))
+
+
+# --- Benchmarking ---
+def _median_ms(times):
+    return statistics.median(times) * 1000.0 if times else None
+
+
+def _candidates(registry, pinned, caps, stage):
+    """Returns available backend names, restricted to `pinned` unless it is 'auto'."""
+    if pinned != "auto":
+        if pinned not in registry:
+            print(f"WARNING: Unknown {stage} backend '{pinned}', choosing automatically. "
+                  f"Known: {', '.join(registry)}")
+        elif registry[pinned]["available"](caps):
+            return [pinned]
+        else:
+            print(f"WARNING: {stage} backend '{pinned}' is not available here, choosing automatically.")
+    available = []
+    for name, spec in registry.items():
+        try:
+            if spec["available"](caps):
+                available.append(name)
+        except Exception:
+            pass
+    return available
+
+
+def _pick(results, order):
+    """Fastest working backend, preferring registry order among near-ties. None if none worked."""
+    working = {name: ms for name, ms in results.items() if ms is not None}
+    if not working:
+        return None
+    best = min(working.values())
+    for name in order:
+        if name in working and working[name] <= best * (1 + BENCHMARK_TOLERANCE):
+            return name
+
+
+def benchmark_decoders(url, names, frames=BENCHMARK_FRAMES):
+    """Reads `frames` frames through each decoder. Returns ({name: ms per read}, sample frames)."""
+    results, samples = {}, []
+    for name in names:
+        print(f"[benchmark] Decoder '{name}'...")
+        try:
+            cap = DECODERS[name]["open"](url)
+        except Exception as e:
+            print(f"[benchmark]   open failed: {e}")
+            cap = None
+        if cap is None:
+            results[name] = None
+            continue
+        times = []
+        try:
+            for _ in range(frames):
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                elapsed = time.perf_counter() - start
+                if not ret or frame is None or frame.size == 0:
+                    break
+                times.append(elapsed)
+                if len(samples) < frames:
+                    samples.append(frame)
+        finally:
+            cap.release()
+        results[name] = _median_ms(times)
+    return results, samples
+
+
+def benchmark_inference(names, samples):
+    """Creates each inference backend and times it on the sample frames.
+
+    Returns ({name: ms per frame}, {name: processor}) for the backends that worked.
+    """
+    results, processors = {}, {}
+    for name in names:
+        print(f"[benchmark] Inference '{name}'...")
+        try:
+            processor = INFERENCE[name]["create"]()
+            processor.process_frame(samples[0].copy())  # Warm-up (model load, allocations)
+            times = []
+            for frame in samples:
+                start = time.perf_counter()
+                processor.process_frame(frame.copy())
+                times.append(time.perf_counter() - start)
+            results[name] = _median_ms(times)
+            processors[name] = processor
+        except Exception as e:
+            print(f"[benchmark]   '{name}' failed: {e}")
+            results[name] = None
+    return results, processors
+
+
+def benchmark_encoders(names, samples, quality=BENCHMARK_JPEG_QUALITY):
+    """Times each encoder on the sample frames; an encoder whose output doesn't decode counts as failed."""
+    import cv2
+    results = {}
+    for name in names:
+        encode = ENCODERS[name]["encode"]
+        try:
+            data = encode(samples[0], quality)
+            check = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+            if check is None or check.shape != samples[0].shape:
+                raise ValueError("output did not decode back to the input size")
+            times = []
+            for frame in samples:
+                start = time.perf_counter()
+                encode(frame, quality)
+                times.append(time.perf_counter() - start)
+            results[name] = _median_ms(times)
+        except Exception as e:
+            print(f"[benchmark] Encoder '{name}' failed: {e}")
+            results[name] = None
+    return results
+
+
+def synthetic_frames(count=BENCHMARK_FRAMES, size=SYNTHETIC_FRAME_SIZE):
+    """Noisy gradient frames, so encoders can't cheat on flat images."""
+    import cv2
+    h, w = size
+    gradient = np.tile(np.linspace(0, 255, w, dtype=np.uint8), (h, 1))
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(count):
+        noise = rng.integers(0, 32, (h, w, 3), dtype=np.uint8)
+        frames.append(cv2.add(np.dstack([gradient] * 3), noise))
+    return frames
+
+
+def select_backends(url, caps, ai_enabled=True, benchmark=True):
+    """Benchmarks the available backends and returns the selection.
+
+    Returns a dict with "decoder", "decoder_order" (for reconnect fallbacks),
+    "inference" (name or None), "processor", "encoder" and the raw
+    per-stage "results" in milliseconds.
+    """
+    if sources.is_source_url(url):
+        decoders = ["source"]
+    else:
+        decoders = _candidates(DECODERS, DECODER_BACKEND, caps, "decoder")
+    encoders = _candidates(ENCODERS, ENCODER_BACKEND, caps, "encoder")
+    if INFERENCE_BACKEND == "none" or not ai_enabled:
+        inference = []
+    else:
+        inference = _candidates(INFERENCE, INFERENCE_BACKEND, caps, "inference")
+
+    selection = {"decoder": decoders[0] if decoders else None, "decoder_order": decoders,
+                 "inference": None, "processor": None, "encoder": encoders[0] if encoders else "opencv",
+                 "results": {}}
+
+    samples = []
+    if benchmark:
+        decode_ms, samples = benchmark_decoders(url, decoders)
+        selection["results"]["decoder"] = decode_ms
+        selection["decoder"] = _pick(decode_ms, decoders) or selection["decoder"]
+        # Working decoders first so reconnects try them before ones that just failed
+        selection["decoder_order"] = sorted(decoders, key=lambda d: (d != selection["decoder"],
+                                                                      decode_ms.get(d) is None))
+    if not samples:
+        samples = synthetic_frames()
+
+    if inference and benchmark:
+        infer_ms, processors = benchmark_inference(inference, samples[:max(3, len(samples) // 2)])
+        selection["results"]["inference"] = infer_ms
+        selection["inference"] = _pick(infer_ms, inference)
+        selection["processor"] = processors.get(selection["inference"])
+    else:
+        for name in inference:
+            try:
+                selection["processor"] = INFERENCE[name]["create"]()
+                selection["inference"] = name
+                break
+            except Exception as e:
+                print(f"ERROR initializing inference backend '{name}': {e}")
+                traceback.print_exc()
+
+    if benchmark:
+        encode_ms = benchmark_encoders(encoders, samples)
+        selection["results"]["encoder"] = encode_ms
+        selection["encoder"] = _pick(encode_ms, encoders) or "opencv"
+
+    print("[benchmark] Selected backends: "
+          f"decoder={selection['decoder']}, inference={selection['inference']}, encoder={selection['encoder']}")
+    for stage, results in selection["results"].items():
+        timings = ", ".join(f"{n}={'failed' if ms is None else f'{ms:.1f}ms'}" for n, ms in results.items())
+        print(f"[benchmark]   {stage}: {timings}")
+    return selection
+
+
+def sustainable_fps(selection):
+    """Frames/s the selected backends keep up with, or None if nothing was measured.
+
+    Capture + inference share one thread and encoding runs in another, so the
+    slower of the two sets the pace.
+    """
+    results = selection["results"]
+    decode = (results.get("decoder") or {}).get(selection["decoder"]) or 0.0
+    infer = (results.get("inference") or {}).get(selection["inference"]) or 0.0
+    encode = (results.get("encoder") or {}).get(selection["encoder"]) or 0.0
+    slowest = max(decode + infer, encode)
+    return 1000.0 / slowest if slowest > 0 else None
+
+
+def _selection_key(url, ai_enabled):
+    """Cache key for one benchmark configuration (hashed so the stream URL's credentials aren't stored)."""
+    settings = [url, DECODER_BACKEND, INFERENCE_BACKEND, ENCODER_BACKEND, ai_enabled, BENCHMARK_FRAMES]
+    return hashlib.sha256(json.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def load_selection(url, caps, ai_enabled=True, benchmark=True):
+    """select_backends(), reusing a cached benchmark younger than BENCHMARK_CACHE_HOURS.
+
+    A cached selection carries no processor: the inference backend is created on
+    first use instead (see app.ensure_ai_processor).
+    """
+    fingerprint = environment_fingerprint()
+    key = _selection_key(url, ai_enabled)
+    if PROBE_CACHE and benchmark:
+        cached = _read_cache(fingerprint)["selections"].get(key)
+        if cached and time.time() - cached["saved"] < BENCHMARK_CACHE_HOURS * 3600:
+            selection = {**cached["selection"], "processor": None}
+            print("[benchmark] Using cached selection: "
+                  f"decoder={selection['decoder']}, inference={selection['inference']}, "
+                  f"encoder={selection['encoder']}")
+            return selection
+
+    selection = select_backends(url, caps, ai_enabled=ai_enabled, benchmark=benchmark)
+    # Only cache real measurements: not when the camera was unreachable or benchmarking is off
+    decoded = (selection["results"].get("decoder") or {}).get(selection["decoder"])
+    if PROBE_CACHE and benchmark and decoded is not None:
+        cache = _read_cache(fingerprint)
+        cache["selections"][key] = {
+            "saved": time.time(),
+            "selection": {k: v for k, v in selection.items() if k != "processor"},
+        }
+        _write_cache(cache)
+    return selection
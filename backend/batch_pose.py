@@ -0,0 +1,444 @@
+# backend/batch_pose.py
+"""
+Offline pose analysis for recorded workout videos.
+
+A job splits the video into chunks of about BATCH_CHUNK_SECONDS (at least one
+per worker) and runs them on a pool of BATCH_WORKERS processes. Each worker
+seeks to its chunk, decodes it with OpenCV and runs ExerciseDetector on every
+frame (no adaptive skipping). MediaPipe tracks the pose from frame to frame,
+so each chunk starts BATCH_WARMUP_FRAMES early and throws those results away:
+by the chunk's first real frame the tracker has locked on, as it would have
+in one sequential pass.
+
+Chunk boundaries are frame-accurate as far as OpenCV's frame position is: a
+seek is read back and corrected (see _open_at), and each chunk is padded or
+trimmed to its planned length. Variable frame rate files, where container
+frame numbers are themselves estimates, can still be off by a frame or two.
+
+Chunks come back as numpy arrays and are merged in frame order. The merged
+landmarks are written as a landmark recording (landmark_recorder.py format,
+readable with numpy.memmap), and the report holds the rep count and per-rep
+form scores computed from joint angles:
+
+  * a rep is a full cycle of the exercise's joint: extended (above `high`),
+    flexed (below `low`), extended again. Push-ups use the elbow, sit-ups the
+    hip (shoulder-hip-knee).
+  * push-up form is how straight the shoulder-hip-ankle line stays during the
+    rep; sit-up form is how far the hip closes past `low`.
+
+Jobs run one at a time (each already uses every worker) from a queue; status
+and reports are kept in memory and the report is also saved next to the
+landmark file in BATCH_DIR. Only the last MAX_JOBS_KEPT finished jobs are
+kept: older ones are forgotten and their files deleted, and files left in
+BATCH_DIR by an earlier run (which no job can reach) are removed on the first
+submit.
+"""
+import concurrent.futures
+import concurrent.futures.process  # BrokenProcessPool; not loaded until a pool is created
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+import landmark_recorder
+from config import (
+    BATCH_DIR, BATCH_WORKERS, BATCH_CHUNK_SECONDS, BATCH_WARMUP_FRAMES,
+    POSE_MODEL_COMPLEXITY, CONFIDENCE_THRESHOLD, SCORE_THRESHOLD
+)
+
+LANDMARKS = landmark_recorder.LANDMARKS
+# MediaPipe Pose landmark indexes (left, right)
+SHOULDER, ELBOW, WRIST = (11, 12), (13, 14), (15, 16)
+HIP, KNEE, ANKLE = (23, 24), (25, 26), (27, 28)
+MIN_VISIBILITY = 0.5
+MAX_JOBS_KEPT = 50
+UPLOAD_DIR = "uploads"  # Under BATCH_DIR
+MAX_SOURCE_BYTES = 120  # The video name in the landmark file header, JSON-escaped (the report keeps it whole)
+WIDEST_FPS = 999.999  # Header size check at submit, before the real FPS is known
+
+# Joint that drives the rep and its angle thresholds in degrees
+EXERCISES = {
+    "pushup": {"joint": (SHOULDER, ELBOW, WRIST), "low": 90.0, "high": 160.0},
+    "situp": {"joint": (SHOULDER, HIP, KNEE), "low": 70.0, "high": 120.0},
+}
+# Sit-up depth earning a full form score
+SITUP_FULL_DEPTH = 45.0
+
+
+# --- Worker Processes ---
+_detector = None
+
+
+def _init_worker(model_complexity, detection_confidence, tracking_confidence):
+    global _detector
+    from detection import ExerciseDetector
+    _detector = ExerciseDetector(model_complexity=model_complexity,
+                                 min_detection_confidence=detection_confidence,
+                                 min_tracking_confidence=tracking_confidence,
+                                 adaptive_skip=False)
+
+
+def analyze_chunk(path, start, end, warmup):
+    """Runs pose detection on frames [start, end) (end=None: to the end of the file).
+
+    Returns (start, landmarks) with landmarks a float32 (frames, LANDMARKS, 3)
+    array of x, y in 0..1 and confidence, NaN where no person was found.
+    """
+    cap, index = _open_at(path, max(0, start - warmup), start)
+    try:
+        frames = []
+        while end is None or index < end:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            _, detection = _detector.process_frame(frame)
+            if index >= start:
+                points = np.full((LANDMARKS, 3), np.nan, dtype=np.float32)
+                landmarks = detection.get("landmarks") or ()
+                if landmarks:
+                    h, w = frame.shape[:2]
+                    count = min(len(landmarks), LANDMARKS)
+                    points[:count] = [(lm["x"] / w, lm["y"] / h, lm.get("confidence", 1.0))
+                                      for lm in landmarks[:count]]
+                frames.append(points)
+            index += 1
+    finally:
+        cap.release()
+    return start, np.array(frames, dtype=np.float32).reshape(-1, LANDMARKS, 3)
+
+
+def _open_at(path, first, start):
+    """Opens the video positioned at frame `first` (warm-up start) and returns (capture, next frame index).
+
+    CAP_PROP_POS_FRAMES seeks land on a nearby frame for many codecs, so the position is read back: from
+    an early landing the capture grabs (without decoding) forward to `first`; one past `start` (frames
+    would be missing) or an unusable position falls back to grabbing forward from the first frame.
+    """
+    import cv2
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {path}")
+    if not first:
+        return cap, 0
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    landed = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if 0 <= landed <= start:
+        index = landed
+    else:
+        cap.release()
+        cap = cv2.VideoCapture(path)
+        index = 0
+    while index < first and cap.grab():  # Skip without decoding up to the warm-up
+        index += 1
+    return cap, index
+
+
+def plan_chunks(frame_count, fps, workers, chunk_seconds=BATCH_CHUNK_SECONDS):
+    """[(start, end)] frame ranges; the last one is open-ended (frame counts from containers can be off)."""
+    per_worker = math.ceil(frame_count / max(1, workers))
+    size = max(1, min(int(chunk_seconds * fps), per_worker))
+    starts = list(range(0, max(1, frame_count), size))
+    return [(s, e) for s, e in zip(starts, starts[1:])] + [(starts[-1], None)]
+
+
+# --- Analysis ---
+def joint_angles(landmarks, joint, width, height):
+    """Per-frame angle (degrees) at the middle point, from the better visible side; NaN if neither is."""
+    scale = np.array([width, height], dtype=np.float32)
+    angles, visibility = [], []
+    for side in (0, 1):
+        a, b, c = (landmarks[:, point[side]] for point in joint)
+        v1 = (a[:, :2] - b[:, :2]) * scale
+        v2 = (c[:, :2] - b[:, :2]) * scale
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cos = (v1 * v2).sum(axis=1) / (np.linalg.norm(v1, axis=1) * np.linalg.norm(v2, axis=1))
+        angles.append(np.degrees(np.arccos(np.clip(cos, -1.0, 1.0))))
+        visibility.append(np.fmin(np.fmin(a[:, 2], b[:, 2]), c[:, 2]))
+    angles, visibility = np.array(angles), np.nan_to_num(np.array(visibility), nan=0.0)
+    best = visibility.argmax(axis=0)
+    angle = angles[best, np.arange(len(best))]
+    angle[visibility.max(axis=0) < MIN_VISIBILITY] = np.nan
+    return angle
+
+
+def count_reps(angles, low, high):
+    """[(start frame, bottom frame, end frame)] for each extended -> flexed -> extended cycle."""
+    reps = []
+    extended_at = None
+    bottom = None
+    for i, angle in enumerate(angles):
+        if math.isnan(angle):
+            continue
+        if bottom is None:
+            if angle > high:
+                extended_at = i
+            elif angle < low and extended_at is not None:
+                bottom = i
+        else:
+            if angle < angles[bottom]:
+                bottom = i
+            if angle > high:
+                reps.append((extended_at, bottom, i))
+                extended_at, bottom = i, None
+    return reps
+
+
+def form_score(exercise, landmarks, angles, rep, width, height):
+    start, bottom, end = rep
+    if exercise == "pushup":
+        line = joint_angles(landmarks[start:end + 1], (SHOULDER, HIP, ANKLE), width, height)
+        deviation = float(np.nanmean(180.0 - line)) if np.isfinite(line).any() else None
+        score = None if deviation is None else max(0.0, 100.0 - 2.0 * deviation)
+        return score, {"body_line_deviation_deg": None if deviation is None else round(deviation, 1)}
+    low = EXERCISES[exercise]["low"]
+    depth = float(angles[bottom])
+    score = max(0.0, min(100.0, 100.0 * (low - depth) / (low - SITUP_FULL_DEPTH)))
+    return score, {"min_hip_angle_deg": round(depth, 1)}
+
+
+def build_report(exercise, landmarks, fps, width, height):
+    settings = EXERCISES[exercise]
+    angles = joint_angles(landmarks, settings["joint"], width, height)
+    reps = []
+    for rep in count_reps(angles, settings["low"], settings["high"]):
+        score, details = form_score(exercise, landmarks, angles, rep, width, height)
+        start, bottom, end = rep
+        reps.append({"start_frame": start, "bottom_frame": bottom, "end_frame": end,
+                     "start_time": round(start / fps, 3), "end_time": round(end / fps, 3),
+                     "min_angle_deg": round(float(angles[bottom]), 1),
+                     "form_score": None if score is None else round(score, 1), **details})
+    scores = [rep["form_score"] for rep in reps if rep["form_score"] is not None]
+    return {
+        "exercise": exercise,
+        "rep_count": len(reps),
+        "form_score": round(float(np.mean(scores)), 1) if scores else None,
+        "frames_with_pose": int(np.isfinite(landmarks[:, 0, 0]).sum()),
+        "reps": reps,
+    }
+
+
+# --- Jobs ---
+class BatchJob:
+    def __init__(self, path, exercise, owned_file=False, name=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.exercise = exercise
+        self.owned_file = owned_file  # Uploaded copy, deleted when the job ends
+        self.status = "queued"
+        self.chunks_done = 0
+        self.chunks_total = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.report = None
+
+    def header_extra(self, fps):
+        """Metadata for the landmark file header: the video name, cut to MAX_SOURCE_BYTES once escaped, and FPS."""
+        source = self.name[:MAX_SOURCE_BYTES]
+        while len(json.dumps(source)) > MAX_SOURCE_BYTES:  # Non-ASCII characters escape to \uXXXX
+            source = source[:-1]
+        return {"source": source, "fps": round(fps, 3)}
+
+    def summary(self):
+        return {"id": self.id, "status": self.status, "exercise": self.exercise,
+                "progress": {"chunks_done": self.chunks_done, "chunks_total": self.chunks_total},
+                "created": self.created, "started": self.started, "finished": self.finished,
+                "error": self.error, "report": self.report}
+
+
+_process_started = time.time()  # Files in BATCH_DIR older than this belong to an earlier run
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_queue = queue.Queue()
+_runner = None
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: forking a threaded server (and MediaPipe's own threads) is unsafe
+        _pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(POSE_MODEL_COMPLEXITY, CONFIDENCE_THRESHOLD, SCORE_THRESHOLD))
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit(path, exercise="pushup", owned_file=False, name=None):
+    """Queues a video for analysis and returns its BatchJob. Raises ValueError for an unknown exercise or a bad name."""
+    global _runner
+    if exercise not in EXERCISES:
+        raise ValueError(f"exercise must be one of {list(EXERCISES)}")
+    job = BatchJob(path, exercise, owned_file, name)
+    landmark_recorder.header_bytes("batch", job.id, **job.header_extra(WIDEST_FPS))  # Fail now, not after the run
+    with _lock:
+        if _runner is None:
+            _remove_leftovers()
+            _runner = threading.Thread(target=_run_jobs, name="batch-pose", daemon=True)
+            _runner.start()
+        _jobs[job.id] = job
+    _queue.put(job)
+    return job
+
+
+def _forget_old_jobs():
+    """Drops the oldest finished jobs past MAX_JOBS_KEPT, with their landmark and report files."""
+    with _lock:
+        finished = [job_id for job_id, job in _jobs.items() if job.finished is not None]
+        evicted = [_jobs.pop(job_id) for job_id in finished[:max(0, len(_jobs) - MAX_JOBS_KEPT)]]
+    for job in evicted:
+        for path in (landmarks_path(job.id), report_path(job.id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _remove_leftovers():
+    """Deletes reports, landmark files and uploads an earlier server run left in BATCH_DIR."""
+    removed = 0
+    for directory in (BATCH_DIR, os.path.join(BATCH_DIR, UPLOAD_DIR)):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            is_output = directory == BATCH_DIR and name.endswith((landmark_recorder.FILE_SUFFIX, ".json"))
+            if ((is_output or directory != BATCH_DIR) and os.path.isfile(path)
+                    and os.path.getmtime(path) < _process_started):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+    if removed:
+        print(f"[batch] Removed {removed} file(s) left in {BATCH_DIR} by an earlier run.")
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _run_jobs():
+    while True:
+        job = _queue.get()
+        job.status, job.started = "running", time.time()
+        try:
+            job.report = _run(job)
+            job.status = "done"
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+            print(f"[batch] Job {job.id} failed: {e}")
+            if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                _reset_pool()  # A worker died (e.g. out of memory); the next job gets fresh ones
+        finally:
+            job.finished = time.time()
+            if job.owned_file:
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+            _forget_old_jobs()
+
+
+def _run(job):
+    import cv2
+    cap = cv2.VideoCapture(job.path)
+    if not cap.isOpened():
+        raise RuntimeError("Could not open the video.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+
+    chunks = plan_chunks(frame_count, fps, BATCH_WORKERS)
+    job.chunks_total = len(chunks)
+    print(f"[batch] Job {job.id}: {frame_count} frames at {fps:.1f} FPS in {len(chunks)} chunk(s) "
+          f"on {BATCH_WORKERS} worker(s)...")
+    start_time = time.time()
+    pool = _get_pool()
+    futures = [pool.submit(analyze_chunk, job.path, start, end, BATCH_WARMUP_FRAMES) for start, end in chunks]
+    results = []
+    for future in concurrent.futures.as_completed(futures):
+        results.append(future.result())
+        job.chunks_done += 1
+    results.sort(key=lambda result: result[0])
+    landmarks = np.concatenate(_aligned(results, chunks)) if results else np.zeros((0, LANDMARKS, 3))
+    elapsed = time.time() - start_time
+
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    output_path = landmarks_path(job.id)
+    _write_landmarks(output_path, job, landmarks, fps)
+    duration = len(landmarks) / fps
+    report = {
+        "job": job.id,
+        "video": {"name": job.name, "fps": round(fps, 3), "frames": len(landmarks),
+                  "width": width, "height": height, "duration_seconds": round(duration, 2)},
+        **build_report(job.exercise, landmarks, fps, width, height),
+        "chunks": len(chunks),
+        "workers": BATCH_WORKERS,
+        "elapsed_seconds": round(elapsed, 2),
+        "realtime_factor": round(duration / elapsed, 1) if elapsed else None,
+        "landmarks_file": os.path.basename(output_path),
+    }
+    with open(report_path(job.id), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[batch] Job {job.id} done: {report['rep_count']} rep(s), {duration:.0f}s of video in {elapsed:.1f}s "
+          f"({report['realtime_factor']}x real time)")
+    return report
+
+
+def _aligned(results, chunks):
+    """Chunk arrays padded with NaN frames (or trimmed) to their planned length, so frame indexes stay exact
+    where a chunk ended early (the container's frame count was too high) or read past its end."""
+    aligned = []
+    for (start, chunk), (_, end) in zip(results, chunks):
+        if end is not None and len(chunk) != end - start:
+            padded = np.full((end - start, LANDMARKS, 3), np.nan, dtype=np.float32)
+            padded[:min(len(chunk), end - start)] = chunk[:end - start]
+            chunk = padded
+        aligned.append(chunk)
+    return aligned
+
+
+def _write_landmarks(path, job, landmarks, fps):
+    """Stores the merged landmarks as a landmark recording (frame_id = frame index, timestamp = video time)."""
+    records = np.zeros(len(landmarks), dtype=landmark_recorder.RECORD_DTYPE)
+    records["frame_id"] = np.arange(len(landmarks))
+    records["timestamp"] = records["frame_id"] / fps
+    records["landmarks"] = landmarks
+    found = np.isfinite(landmarks[:, :, 0])
+    records["landmark_count"] = found.sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN frames (no person) give NaN, as intended
+        records["bbox"] = np.stack([np.nanmin(landmarks[:, :, 0], axis=1), np.nanmin(landmarks[:, :, 1], axis=1),
+                                    np.nanmax(landmarks[:, :, 0], axis=1), np.nanmax(landmarks[:, :, 1], axis=1)],
+                                   axis=1)
+    with open(path, "wb") as f:
+        landmark_recorder.write_header(f, "batch", job.id, **job.header_extra(fps))
+        f.write(records.tobytes())
+
+
+def landmarks_path(job_id):
+    return os.path.join(BATCH_DIR, f"{job_id}{landmark_recorder.FILE_SUFFIX}")
+
+
+def report_path(job_id):
+    return os.path.join(BATCH_DIR, f"{job_id}.json")
@@ -0,0 +1,382 @@
+# backend/benchmark.py
+"""
+End-to-end pipeline benchmark.
+
+Drives the pipeline from a camera-free source (sources.py) and reports per-stage
+throughput and p50/p95/p99 latency:
+
+  capture    reading + decoding a frame from the source (FrameReader)
+  inference  the detector's process_frame() (skipped if no inference backend works here)
+  encode     JPEG encoding, per available encoder and quality
+  emit       app.socketio.emit() of frame + detections to N local Socket.IO clients,
+             plus the send-to-receive latency the clients observe
+  pipeline   the real capture_loop + frame_emitter threads, capture time to client receipt
+
+Sweeps resolution x JPEG quality x client count and writes JSON that can be
+compared between commits:
+
+  python benchmark.py --source synthetic:1280x720@30 --resolutions 640x480,1280x720 \
+      --qualities 50,70,90 --clients 1,10,50 --output bench-$(git rev-parse --short HEAD).json
+  python benchmark.py --compare bench-old.json bench-new.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+import backends
+import sources
+from config import CAMERA_NAME, INFERENCE_BACKEND
+
+RESULTS_FORMAT = 1
+DEFAULT_SOURCE = "synthetic:1280x720@30"
+CLIENT_CONNECT_TIMEOUT_SECONDS = 10.0
+DRAIN_SECONDS = 1.0  # Time clients get to receive the tail of an emit run
+# Fields that identify a result row (everything else is a measurement)
+ROW_KEY = ("stage", "backend", "resolution", "quality", "clients")
+
+
+# --- Statistics ---
+def summarize(samples_ms):
+    """Count, mean, p50/p95/p99/max in ms, and the rate the mean allows."""
+    if not samples_ms:
+        return {"n": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    mean = float(values.mean())
+    return {"n": len(values), "mean_ms": round(mean, 3), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3), "max_ms": round(float(values.max()), 3),
+            "per_second": round(1000.0 / mean, 1) if mean > 0 else None}
+
+
+def parse_resolution(text):
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def source_url(source, resolution, pacing):
+    """Synthetic sources are generated at the target size; other sources are resized after decode."""
+    base = source.split("?")[0]
+    if base.startswith("synthetic:"):
+        fps = base.partition("@")[2] or "30"
+        base = f"synthetic:{resolution[0]}x{resolution[1]}@{fps}"
+    return f"{base}?pacing={pacing}"
+
+
+# --- Stages ---
+def bench_capture(source, resolution, count):
+    """Reads `count` frames as fast as the source allows. Returns (row, frames at `resolution`)."""
+    import cv2
+    from frame_reader import FrameReader
+    reader = FrameReader(sources.open_source(source_url(source, resolution, "fast")), "bench")
+    times, frames = [], []
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            ok, frame = reader.read(timeout=5.0)
+            if not ok:
+                break
+            if (frame.shape[1], frame.shape[0]) != resolution:
+                frame = cv2.resize(frame, resolution, interpolation=cv2.INTER_AREA)
+            times.append((time.perf_counter() - start) * 1000.0)
+            frames.append(frame)
+    finally:
+        reader.stop()
+    return {"stage": "capture", "backend": "source", **summarize(times)}, frames
+
+
+def bench_inference(frames, caps):
+    """Times process_frame() on every frame for each working inference backend."""
+    if INFERENCE_BACKEND == "none":
+        return []
+    rows = []
+    for name in backends._candidates(backends.INFERENCE, INFERENCE_BACKEND, caps, "inference"):
+        try:
+            processor = backends.INFERENCE[name]["create"]()
+            processor.process_frame(frames[0].copy())  # Warm-up (model load)
+        except Exception as e:
+            print(f"[bench] inference '{name}' unavailable: {e}")
+            rows.append({"stage": "inference", "backend": name, "n": 0, "error": str(e)})
+            continue
+        times = []
+        for frame in frames:
+            start = time.perf_counter()
+            processor.process_frame(frame)
+            times.append((time.perf_counter() - start) * 1000.0)
+        rows.append({"stage": "inference", "backend": name, **summarize(times)})
+    return rows
+
+
+def bench_encode(frames, quality, caps):
+    """Times every available encoder at `quality`; also records the mean JPEG size."""
+    rows = []
+    for name in backends._candidates(backends.ENCODERS, "auto", caps, "encoder"):
+        encode = backends.ENCODERS[name]["encode"]
+        times, sizes = [], []
+        try:
+            for frame in frames:
+                start = time.perf_counter()
+                data = encode(frame, quality)
+                times.append((time.perf_counter() - start) * 1000.0)
+                sizes.append(len(data))
+        except Exception as e:
+            rows.append({"stage": "encode", "backend": name, "quality": quality, "n": 0, "error": str(e)})
+            continue
+        rows.append({"stage": "encode", "backend": name, "quality": quality, **summarize(times),
+                     "mean_bytes": int(np.mean(sizes))})
+    return rows
+
+
+class Viewers:
+    """N python-socketio clients that timestamp every 'detections' they receive."""
+
+    def __init__(self, port, count):
+        import socketio
+        self.clients, self.latencies, self.received = [], [], []
+        lock = threading.Lock()
+        for _ in range(count):
+            client = socketio.Client(reconnection=False)
+            latencies, received = [], [0]
+
+            def on_detections(data, latencies=latencies):
+                latencies.append((time.time() - data["timestamp"]) * 1000.0)
+
+            def on_frame(data, received=received):
+                with lock:
+                    received[0] += 1
+
+            client.on("detections", on_detections)
+            client.on("frame", on_frame)
+            client.connect(f"http://127.0.0.1:{port}", transports=["websocket"],
+                           wait_timeout=CLIENT_CONNECT_TIMEOUT_SECONDS)
+            self.clients.append(client)
+            self.latencies.append(latencies)
+            self.received.append(received)
+        time.sleep(0.2)  # Let the connect handlers put everyone in the camera room
+
+    def reset(self):
+        for latencies, received in zip(self.latencies, self.received):
+            latencies.clear()
+            received[0] = 0
+
+    def all_latencies(self):
+        return [value for latencies in self.latencies for value in latencies]
+
+    def frames_received(self):
+        return sum(received[0] for received in self.received)
+
+    def close(self):
+        # Each disconnect waits for the server's close handshake; do them all at once
+        threads = [threading.Thread(target=_disconnect, args=(client,), daemon=True) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(CLIENT_CONNECT_TIMEOUT_SECONDS)
+
+
+def _disconnect(client):
+    try:
+        client.disconnect()
+    except Exception:
+        pass
+
+
+def bench_emit(pipeline, port, jpegs, quality, clients, fps):
+    """Emits the encoded frames to `clients` viewers at `fps`, like frame_emitter does."""
+    viewers = Viewers(port, clients)
+    interval = 1.0 / fps
+    emit_times = []
+    try:
+        next_due = time.perf_counter()
+        for seq, jpeg in enumerate(jpegs):
+            delay = next_due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_due += interval
+            start = time.perf_counter()
+            pipeline.socketio.emit("frame", jpeg, room=CAMERA_NAME)
+            pipeline.socketio.emit("detections", {"landmarks": [], "bbox": None, "type": "person",
+                                                  "seq": seq, "timestamp": time.time()}, room=CAMERA_NAME)
+            emit_times.append((time.perf_counter() - start) * 1000.0)
+        time.sleep(DRAIN_SECONDS)
+        expected = len(jpegs) * clients
+        delivery = summarize(viewers.all_latencies())
+        return {"stage": "emit", "backend": pipeline.socketio.async_mode, "quality": quality, "clients": clients,
+                **summarize(emit_times),
+                "delivered_ratio": round(viewers.frames_received() / expected, 4) if expected else None,
+                "delivery": delivery}
+    finally:
+        viewers.close()
+
+
+def bench_pipeline(pipeline, port, source, resolution, quality, seconds):
+    """Runs the real capture and emitter threads on a realtime source with one viewer."""
+    from supervisor import Supervisor
+    pipeline.RTSP_URL = source_url(source, resolution, "realtime")
+    pipeline.init_pipeline()
+    state = pipeline.camera_state[CAMERA_NAME]
+    state.jpeg_quality = quality
+    state.capture_active = True
+    viewers = Viewers(port, 1)
+    stages = Supervisor()
+    stages.add("bench-capture", pipeline.capture_loop, (CAMERA_NAME,))
+    stages.add("bench-emitter", pipeline.frame_emitter, (CAMERA_NAME,))
+    try:
+        stages.start()
+        time.sleep(min(2.0, seconds / 2))  # Connect + first frames; not measured
+        viewers.reset()
+        start_captured = state.capture_stats.frames_captured
+        start = time.perf_counter()
+        time.sleep(seconds)
+        elapsed = time.perf_counter() - start
+        captured = state.capture_stats.frames_captured - start_captured
+        return {"stage": "pipeline", "backend": (pipeline.SELECTED_BACKENDS or {}).get("encoder"),
+                "resolution": f"{resolution[0]}x{resolution[1]}", "quality": quality, "clients": 1,
+                "capture_fps": round(captured / elapsed, 1),
+                "received_fps": round(viewers.frames_received() / elapsed, 1),
+                "target_fps": pipeline.TARGET_FPS,
+                **{f"capture_to_client_{key}": value for key, value in summarize(viewers.all_latencies()).items()}}
+    finally:
+        stages.stop()
+        viewers.close()
+
+
+# --- Server ---
+def start_server(pipeline):
+    """Serves app.py's Flask-SocketIO app on a free local port (same handlers and async mode as production)."""
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.CRITICAL)  # Request and websocket-close lines would drown the results
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    thread = threading.Thread(target=pipeline.socketio.run, args=(pipeline.app,),
+                              kwargs={"host": "127.0.0.1", "port": port, "use_reloader": False, "debug": False,
+                                      "log_output": False, "allow_unsafe_werkzeug": True}, daemon=True)
+    thread.start()
+    deadline = time.time() + CLIENT_CONNECT_TIMEOUT_SECONDS
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Benchmark server did not start")
+
+
+# --- Results ---
+def run_metadata():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=repo, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return None
+    return {"format": RESULTS_FORMAT, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count(),
+            "environment": backends.environment_fingerprint()}
+
+
+def row_key(row):
+    return tuple(row.get(field) for field in ROW_KEY)
+
+
+def compare(old_path, new_path):
+    """Prints p50/p95/p99 changes between two result files, row by row."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"old: {old['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+    old_rows = {row_key(row): row for row in old["results"]}
+    for row in new["results"]:
+        before = old_rows.get(row_key(row))
+        label = " ".join(f"{field}={row[field]}" for field in ROW_KEY if row.get(field) is not None)
+        if before is None:
+            print(f"  {label}: new")
+            continue
+        changes = []
+        for field in ("p50_ms", "p95_ms", "p99_ms", "capture_to_client_p50_ms", "capture_to_client_p95_ms"):
+            if before.get(field) and row.get(field) is not None:
+                change = (row[field] - before[field]) / before[field] * 100
+                changes.append(f"{field} {before[field]:.2f}->{row[field]:.2f} ({change:+.0f}%)")
+        print(f"  {label}: {', '.join(changes) or 'no comparable latency fields'}")
+
+
+def print_row(row):
+    label = " ".join(f"{field}={row[field]}" for field in ROW_KEY if row.get(field) is not None)
+    if row.get("p50_ms") is not None:
+        print(f"[bench] {label}: p50 {row['p50_ms']:.2f}ms p95 {row['p95_ms']:.2f}ms p99 {row['p99_ms']:.2f}ms "
+              f"({row['per_second']}/s)")
+    elif row["stage"] == "pipeline":
+        print(f"[bench] {label}: capture {row['capture_fps']} fps, received {row['received_fps']} fps, "
+              f"capture->client p50 {row.get('capture_to_client_p50_ms')}ms p95 {row.get('capture_to_client_p95_ms')}ms")
+    else:
+        print(f"[bench] {label}: {row.get('error', 'no samples')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark capture, inference, encode and emit.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="file:/images:/synthetic: URL (see sources.py)")
+    parser.add_argument("--resolutions", default="640x480,1280x720")
+    parser.add_argument("--qualities", default="50,70,90")
+    parser.add_argument("--clients", default="1,10", help="Viewer counts for the emit stage (empty to skip)")
+    parser.add_argument("--frames", type=int, default=120, help="Frames per measurement")
+    parser.add_argument("--emit-fps", type=float, default=30.0)
+    parser.add_argument("--pipeline-seconds", type=float, default=5.0, help="0 skips the full-pipeline run")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not sources.is_source_url(args.source):
+        parser.error("--source must be a file:, images: or synthetic: URL")
+
+    import app as pipeline
+    caps = backends.load_capabilities()
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(",") if r]
+    qualities = [int(q) for q in args.qualities.split(",") if q]
+    client_counts = [int(c) for c in args.clients.split(",") if c]
+    port = start_server(pipeline) if client_counts or args.pipeline_seconds > 0 else None
+
+    results = []
+    def record(row, **fields):
+        row = {**row, **fields}
+        results.append(row)
+        print_row(row)
+
+    for resolution in resolutions:
+        res = f"{resolution[0]}x{resolution[1]}"
+        capture_row, frames = bench_capture(args.source, resolution, args.frames)
+        record(capture_row, resolution=res)
+        if not frames:
+            print(f"[bench] No frames from {args.source}; skipping {res}.")
+            continue
+        for row in bench_inference(frames, caps):
+            record(row, resolution=res)
+        for quality in qualities:
+            for row in bench_encode(frames, quality, caps):
+                record(row, resolution=res)
+            jpegs = [backends.encode_opencv(frame, quality) for frame in frames]
+            for clients in client_counts:
+                record(bench_emit(pipeline, port, jpegs, quality, clients, args.emit_fps), resolution=res)
+        if args.pipeline_seconds > 0:
+            record(bench_pipeline(pipeline, port, args.source, resolution, qualities[len(qualities) // 2],
+                                  args.pipeline_seconds))
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": run_metadata(), "args": vars(args), "results": results}, f, indent=2)
+    print(f"[bench] Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
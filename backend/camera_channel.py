@@ -0,0 +1,110 @@
+# backend/camera_channel.py
+"""
+Per-camera state published through atomic reference swaps.
+
+Each stage owns the fields it writes (capture thread -> frames, detections and
+capture stats; emitter -> encoded frames and emit stats). Writers build a new
+immutable packet and rebind one attribute, which is atomic in CPython, so
+readers always see a consistent packet and never block a writer. Consumers
+detect new data by comparing packet versions instead of draining a queue.
+"""
+import time
+from collections import namedtuple
+
+from tracing import FrameTracer
+
+# --- Immutable Packets ---
+# frame is a read-only numpy array; capture_time is time.time() at read, capture_mono
+# time.monotonic() at grab (for tracing); version doubles as the frame id
+FramePacket = namedtuple("FramePacket", "version frame capture_time capture_mono")
+DetectionPacket = namedtuple("DetectionPacket", "version detections capture_time")
+# Unpacks as (seq, jpeg_bytes, timestamp)
+EncodedPacket = namedtuple("EncodedPacket", "seq jpeg_bytes timestamp")
+
+
+class CaptureStats:
+    """Written only by the capture thread."""
+    __slots__ = ("last_frame_time", "frames_captured", "stream_failures", "last_failure_time",
+                 "frames_grabbed", "frames_decoded", "buffer_latency_ms", "frame_age_ms",
+                 "reconnects", "standby_takeovers", "last_outage_ms")
+
+    def __init__(self):
+        self.last_frame_time = time.time()
+        self.frames_captured = 0
+        self.stream_failures = 0
+        self.last_failure_time = 0
+        # From the grab()/retrieve() reader (frame_reader.py), for the current connection
+        self.frames_grabbed = 0
+        self.frames_decoded = 0
+        self.buffer_latency_ms = None
+        self.frame_age_ms = 0.0
+        # Reconnections after a stall, and how long the last outage lasted (last frame to first frame)
+        self.reconnects = 0
+        self.standby_takeovers = 0
+        self.last_outage_ms = None
+
+
+class EmitStats:
+    """Written only by the emitter thread."""
+    __slots__ = ("last_emit_time", "emitted_frame_counter", "last_fps_check_time", "current_fps")
+
+    def __init__(self):
+        self.last_emit_time = time.time()
+        self.emitted_frame_counter = 0
+        self.last_fps_check_time = time.time()
+        self.current_fps = 0
+
+    def record_emit(self, now, window=2.0):
+        """Counts one emitted frame and refreshes current_fps every `window` seconds."""
+        self.last_emit_time = now
+        self.emitted_frame_counter += 1
+        elapsed = now - self.last_fps_check_time
+        if elapsed >= window:
+            self.current_fps = round(self.emitted_frame_counter / elapsed)
+            self.emitted_frame_counter = 0
+            self.last_fps_check_time = now
+            return True
+        return False
+
+
+class CameraChannel:
+    """Lock-free, versioned state for one camera."""
+
+    def __init__(self, name, jpeg_quality, emit_scale=1.0):
+        self.name = name
+        self.capture_active = True
+        self.ai_processor = None
+        self.dvr = None
+        self.recorder = None # LandmarkRecorder while recording; swapped by start/stop_recording()
+
+        # Viewer-tunable settings: plain ints/floats, rebinding is atomic
+        self.jpeg_quality = jpeg_quality
+        self.emit_scale = emit_scale
+
+        # Latest packets (None until first publish)
+        self.frame_packet = None
+        self.detection_packet = DetectionPacket(0, {}, 0)
+        self.encoded_packet = None
+
+        self.capture_stats = CaptureStats()
+        self.emit_stats = EmitStats()
+        self.tracer = FrameTracer(name)
+
+    # --- Writers (one thread per method) ---
+    def publish_frame(self, frame, capture_time, capture_mono=None):
+        """Capture thread: swaps in a new frame and returns it. The array is frozen so readers can share it."""
+        frame.flags.writeable = False
+        previous = self.frame_packet
+        self.frame_packet = FramePacket((previous.version + 1) if previous else 1, frame, capture_time,
+                                        capture_mono if capture_mono is not None else time.monotonic())
+        return self.frame_packet
+
+    def publish_detections(self, detections, capture_time):
+        """Capture thread: swaps in the latest detections."""
+        self.detection_packet = DetectionPacket(self.detection_packet.version + 1, detections, capture_time)
+
+    def publish_encoded(self, jpeg_bytes, timestamp):
+        """Emitter thread: swaps in the latest encoded JPEG (served by /snapshot)."""
+        previous = self.encoded_packet
+        self.encoded_packet = EncodedPacket((previous.seq + 1) if previous else 1, jpeg_bytes, timestamp)
+        return self.encoded_packet
@@ -7,7 +7,8 @@ class ExerciseDetector:
     def __init__(self,
                  model_complexity=1,
                  min_detection_confidence=0.5,
-                 min_tracking_confidence=0.5):
+                 min_tracking_confidence=0.5,
+                 adaptive_skip=True):
         self.pose = mp_pose.Pose(
             model_complexity=model_complexity,
             enable_segmentation=False,
@@ -19,6 +20,7 @@ class ExerciseDetector:
         self.frame_skip_counter = 0 # [Change 1] Renamed for clarity
         self.skip_frames_threshold = 1 # [Change 2] Default to skip 1 frame after successful detection
         self.last_detection_quality = 0 # [Change 3] Track quality to adapt skipping
+        self.adaptive_skip = adaptive_skip # Offline analysis (batch_pose.py) needs every frame
 
     def process_frame(self, frame):
         """
@@ -31,7 +33,7 @@ class ExerciseDetector:
 
         # [Change 4] Adaptive frame skipping logic
         # Only skip if a previous detection was good and we've processed enough frames since
-        if self.previous_detection and self.last_detection_quality > 70 and self.frame_skip_counter % self.skip_frames_threshold != 0:
+        if self.adaptive_skip and self.previous_detection and self.last_detection_quality > 70 and self.frame_skip_counter % self.skip_frames_threshold != 0:
             return frame, self.previous_detection
         
         h, w = frame.shape[:2]
@@ -0,0 +1,140 @@
+# backend/dvr.py
+"""
+Rolling instant-replay buffer.
+
+Keeps the last DVR_SECONDS of already-encoded JPEG frames (plus their
+detections) per camera. Payloads live in a memory-mapped segment file used as a
+circular byte buffer, so the OS can page them out under memory pressure; only a
+small index of (seq, timestamp, offset, sizes) tuples stays on the Python heap.
+Replays stream the stored bytes as-is: nothing is decoded or re-encoded.
+"""
+import json
+import mmap
+import os
+import threading
+import time
+from collections import deque
+
+from config import DVR_DIR, DVR_SECONDS, DVR_SEGMENT_MB
+
+# Upper bound on indexed frames (60 FPS worth of DVR_SECONDS)
+MAX_INDEX_FPS = 60
+MIN_REPLAY_SPEED = 0.05
+MAX_REPLAY_SPEED = 4.0
+
+
+class FrameRing:
+    """Single-writer, multi-reader ring of encoded frames in an mmap'd file."""
+
+    def __init__(self, camera_name, seconds=DVR_SECONDS, segment_bytes=DVR_SEGMENT_MB * 1024 * 1024,
+                 directory=DVR_DIR):
+        self.camera_name = camera_name
+        self.seconds = seconds
+        self.size = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{camera_name}.dvr")
+
+        self._file = open(self.path, "w+b")
+        self._file.truncate(self.size)
+        self._mm = mmap.mmap(self._file.fileno(), self.size)
+
+        # Index entries: (seq, timestamp, logical_offset, jpeg_len, det_len)
+        self._index = deque(maxlen=int(seconds * MAX_INDEX_FPS))
+        # Logical write head; physical position is head % size. Monotonic, never wraps.
+        self._head = 0
+        self._seq = 0
+        self._write_lock = threading.Lock()
+        self._closed = False
+        print(f"[{camera_name}] DVR ring ready: {seconds}s, {self.size // (1024 * 1024)} MB at {self.path}")
+
+    # --- Writer ---
+    def append(self, jpeg_bytes, detections=None, timestamp=None):
+        """Stores one encoded frame. Returns its sequence number."""
+        det_bytes = json.dumps(detections or {}, separators=(",", ":")).encode("utf-8")
+        record_len = len(jpeg_bytes) + len(det_bytes)
+        if record_len > self.size:
+            return None
+
+        with self._write_lock:
+            if self._closed:
+                return None
+            start = self._head
+            pos = start % self.size
+            if pos + record_len > self.size:
+                # Records never straddle the end of the segment; skip to the next lap
+                start += self.size - pos
+                pos = 0
+            # Reserve before writing so concurrent readers can detect the overwrite
+            self._head = start + record_len
+            self._mm[pos:pos + len(jpeg_bytes)] = jpeg_bytes
+            self._mm[pos + len(jpeg_bytes):pos + record_len] = det_bytes
+
+            self._seq += 1
+            self._index.append((self._seq, timestamp or time.time(), start, len(jpeg_bytes), len(det_bytes)))
+            return self._seq
+
+    # --- Readers ---
+    def _read(self, entry):
+        """Copies an entry's payload out of the ring, or None if it was overwritten."""
+        seq, ts, start, jpeg_len, det_len = entry
+        if start < self._head - self.size:
+            return None
+        pos = start % self.size
+        try:
+            data = self._mm[pos:pos + jpeg_len + det_len]
+        except ValueError:  # Closed at shutdown mid-replay
+            return None
+        # Re-check after copying: the writer may have lapped us mid-read
+        if start < self._head - self.size:
+            return None
+        detections = json.loads(data[jpeg_len:]) if det_len else {}
+        return seq, ts, data[:jpeg_len], detections
+
+    def window(self, seconds):
+        """Returns index entries covering the last `seconds` of footage, oldest first."""
+        entries = list(self._index)
+        if not entries:
+            return []
+        cutoff = entries[-1][1] - min(seconds, self.seconds)
+        return [e for e in entries if e[1] >= cutoff and e[2] >= self._head - self.size]
+
+    def replay(self, seconds, speed=1.0):
+        """Generator yielding (seq, timestamp, jpeg_bytes, detections) paced at `speed`x."""
+        speed = max(MIN_REPLAY_SPEED, min(MAX_REPLAY_SPEED, speed))
+        entries = self.window(seconds)
+        if not entries:
+            return
+        first_ts = entries[0][1]
+        started = time.monotonic()
+        for entry in entries:
+            due = started + (entry[1] - first_ts) / speed
+            delay = due - time.monotonic()
+            if delay > 0.001:
+                time.sleep(delay)
+            record = self._read(entry)
+            if record is not None:
+                yield record
+
+    def close(self):
+        """Unmaps and closes the segment file; later appends are ignored and replays end."""
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                self._mm.close()
+                self._file.close()
+            except Exception:
+                pass
+
+
+def stream_replay_mjpeg(ring, seconds, speed):
+    """Wraps FrameRing.replay as multipart MJPEG, with detections in a per-part header."""
+    for seq, ts, jpeg, detections in ring.replay(seconds, speed):
+        yield (
+            b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            + f'X-Frame-Seq: {seq}\r\nX-Timestamp: {ts:.3f}\r\n'.encode('ascii')
+            + b'X-Detections: ' + json.dumps(detections, separators=(",", ":")).encode('utf-8') + b'\r\n\r\n'
+            + jpeg + b'\r\n'
+        )
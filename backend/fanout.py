@@ -0,0 +1,706 @@
+# backend/fanout.py
+"""
+Multi-process fan-out deployment.
+
+    python fanout.py
+
+starts:
+  * a local message bus (broker stand-in) on FANOUT_BUS_ADDRESS,
+  * one publisher process per camera that runs capture + inference, encodes each
+    frame once, writes the JPEG into a shared-memory slot ring and publishes a
+    small notification (slot, seq, detections, quality) on the bus,
+  * FANOUT_WORKERS stateless asyncio Socket.IO worker processes that all accept
+    on one pre-bound listening socket (SOCKET_PORT) and relay the frames they
+    are notified about to their own clients.
+
+Worker emits other than frames (e.g. a server-wide broadcast, or a message to a
+sid connected to a different worker) go through BusManager, a python-socketio
+pub/sub client manager over the same bus, so rooms behave like one server.
+Workers only accept the websocket transport: long-polling would need sticky
+sessions, which a shared accept socket can't give (StreamManager.js connects
+with websocket first). REST endpoints other than
+/snapshot and /debug/profile stay on the single-process servers (app.py /
+async_server.py). /debug/profile asks every publisher and worker to profile
+itself over the bus and returns the merged stacks. Frame tracing works as in
+the single-process servers: the publisher stamps sampled frames, workers add
+the trace fields and pings, and relay viewers' pong/frame_ack to the publisher.
+
+Every child process stamps a shared heartbeat value; the parent restarts a
+process that exits or misses WATCHDOG_DEADLINE_SECONDS, leaving the others
+(and their connected viewers) alone. Inside the publisher, the capture loop is
+supervised per stage like in app.py.
+"""
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import struct
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+from multiprocessing import shared_memory
+from urllib.parse import parse_qs
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from heart_rate import parse_samples as heart_rate_samples
+import pipeline_log
+import profiler
+
+from config import (
+    CAMERA_NAME, SOCKET_PORT, STREAM_MODE, PIPELINE_MODULE, ASYNC_MAX_CLIENT_BACKLOG,
+    FANOUT_WORKERS, FANOUT_BUS_HOST, FANOUT_BUS_PORT, FANOUT_BUS_AUTHKEY,
+    FANOUT_SHM_SLOTS, FANOUT_SHM_SLOT_BYTES, print_config,
+    WATCHDOG_ENABLED, WATCHDOG_DEADLINE_SECONDS, WATCHDOG_INTERVAL_SECONDS, WATCHDOG_GRACE_SECONDS,
+    SHUTDOWN_TIMEOUT_SECONDS, RECORD_LANDMARKS, TRACE_SAMPLE_EVERY, TRACE_PING_SECONDS
+)
+
+BUS_ADDRESS = (FANOUT_BUS_HOST, FANOUT_BUS_PORT)
+FRAMES_CHANNEL = "frames"
+CONTROL_CHANNEL = "control"
+SOCKETIO_CHANNEL = "socketio"
+PROFILE_CHANNEL = "profile"
+# How long /debug/profile waits past the profile duration for slow processes to answer
+PROFILE_REPLY_GRACE_SECONDS = 3.0
+# Per-subscriber backlog in the broker; frame notifications beyond it are dropped
+BUS_SUBSCRIBER_QUEUE_SIZE = 64
+
+# Shared-memory slot header: seq (u64), payload length (u32)
+SLOT_HEADER = struct.Struct("<QI")
+
+
+# --- Message Bus (broker stand-in) ---
+class MessageBus:
+    """Minimal pub/sub broker over multiprocessing.connection (works on Windows and Linux)."""
+
+    def __init__(self, address=BUS_ADDRESS, authkey=FANOUT_BUS_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.subscribers = {}  # channel -> set of outbound queues
+
+    def serve_forever(self):
+        listener = Listener(self.address, authkey=self.authkey)
+        print(f"[bus] Listening on {self.address[0]}:{self.address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"[bus] Accept failed: {e}")
+                continue
+            outbound = queue.Queue(maxsize=BUS_SUBSCRIBER_QUEUE_SIZE)
+            threading.Thread(target=self._writer, args=(conn, outbound), daemon=True).start()
+            threading.Thread(target=self._reader, args=(conn, outbound), daemon=True).start()
+
+    def _reader(self, conn, outbound):
+        channels = set()
+        try:
+            while True:
+                op, channel, *payload = conn.recv()
+                if op == "sub":
+                    channels.add(channel)
+                    with self.lock:
+                        self.subscribers.setdefault(channel, set()).add(outbound)
+                elif op == "pub":
+                    with self.lock:
+                        targets = list(self.subscribers.get(channel, ()))
+                    for target in targets:
+                        try:
+                            target.put_nowait((channel, payload[0]))
+                        except queue.Full:
+                            pass  # Slow subscriber: drop rather than stall every publisher
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                for channel in channels:
+                    self.subscribers.get(channel, set()).discard(outbound)
+            outbound.put(None)
+            conn.close()
+
+    @staticmethod
+    def _writer(conn, outbound):
+        while True:
+            message = outbound.get()
+            if message is None:
+                return
+            try:
+                conn.send(message)
+            except (EOFError, OSError):
+                return
+
+
+class BusClient:
+    """One connection to the bus; publish from any thread, receive from one."""
+
+    def __init__(self, address=BUS_ADDRESS, authkey=FANOUT_BUS_AUTHKEY, retries=50):
+        for attempt in range(retries):
+            try:
+                self.conn = Client(address, authkey=authkey)
+                break
+            except ConnectionRefusedError:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.1)
+        self.send_lock = threading.Lock()
+
+    def subscribe(self, channel):
+        with self.send_lock:
+            self.conn.send(("sub", channel))
+
+    def publish(self, channel, payload):
+        with self.send_lock:
+            self.conn.send(("pub", channel, payload))
+
+    def recv(self):
+        """Blocks for the next (channel, payload) message."""
+        return self.conn.recv()
+
+
+# --- Shared-Memory Frame Ring ---
+class SharedFrameRing:
+    """Fixed slots of encoded JPEGs in shared memory. One writer (the publisher), many readers."""
+
+    def __init__(self, name, create=False, slots=FANOUT_SHM_SLOTS, slot_bytes=FANOUT_SHM_SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        if create:
+            try:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            _untrack_shared_memory(self.shm)
+        self.name = name
+        self.owner = create
+
+    def write(self, seq, payload):
+        """Stores payload in slot seq % slots. Returns the slot, or None if it doesn't fit."""
+        if len(payload) > self.slot_bytes - SLOT_HEADER.size:
+            return None
+        slot = seq % self.slots
+        base = slot * self.slot_bytes
+        buf = self.shm.buf
+        # Invalidate, write payload, then publish the header so readers never see a torn frame
+        SLOT_HEADER.pack_into(buf, base, 0, 0)
+        buf[base + SLOT_HEADER.size:base + SLOT_HEADER.size + len(payload)] = payload
+        SLOT_HEADER.pack_into(buf, base, seq, len(payload))
+        return slot
+
+    def read(self, slot, seq):
+        """Copies the payload for seq out of its slot, or None if it was already overwritten."""
+        base = slot * self.slot_bytes
+        buf = self.shm.buf
+        stored_seq, length = SLOT_HEADER.unpack_from(buf, base)
+        if stored_seq != seq:
+            return None
+        payload = bytes(buf[base + SLOT_HEADER.size:base + SLOT_HEADER.size + length])
+        if SLOT_HEADER.unpack_from(buf, base)[0] != seq:
+            return None
+        return payload
+
+    def close(self):
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except Exception:
+            pass
+
+
+def _untrack_shared_memory(shm):
+    """Stops this (non-owner) process's resource tracker from unlinking the segment on exit."""
+    if os.name != "posix":
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def shm_name(camera_name):
+    return f"workout_{camera_name}_frames"
+
+
+def _interrupt_on_sigterm():
+    """Turns the supervisor's terminate() into KeyboardInterrupt so finally blocks run."""
+    def handler(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handler)
+
+
+# --- Publisher Process (one per camera) ---
+def run_publisher(camera_name, heartbeat):
+    """Capture + inference + encode for one camera; publishes frames to the bus."""
+    _interrupt_on_sigterm()
+    pipeline = importlib.import_module(PIPELINE_MODULE)
+    pipeline.init_pipeline()
+    state = pipeline.camera_state[camera_name]
+    bus = BusClient()
+    bus.subscribe(CONTROL_CHANNEL)
+    bus.subscribe(PROFILE_CHANNEL)
+    ring = SharedFrameRing(shm_name(camera_name), create=True)
+    log = pipeline_log.get_logger(camera_name)
+    log.info("Publisher starting (pid %d, shm %s)...", os.getpid(), ring.name)
+
+    if RECORD_LANDMARKS:
+        pipeline.start_recording(camera_name)
+    pipeline.supervise_camera(camera_name, emitters=False)
+    pipeline.supervisor.start()
+    threading.Thread(target=_publisher_control_loop, args=(bus, pipeline, camera_name), daemon=True).start()
+
+    stats = state.emit_stats
+    tracer = state.tracer
+    last_frame_version = 0
+    last_detection_version = 0
+    try:
+        while state.capture_active:
+            heartbeat.value = time.time()
+            wait = pipeline.EMIT_INTERVAL - (time.time() - stats.last_emit_time)
+            if wait > 0.001:
+                time.sleep(wait)
+                continue
+
+            detection_packet = state.detection_packet
+            notification = {
+                "camera": camera_name,
+                "detections": detection_packet.detections or {},
+                "timestamp": detection_packet.capture_time,
+                "quality": state.jpeg_quality,
+                "shm": ring.name,
+                "publisher": os.getpid(),  # A restarted publisher recreates the segment
+                "slot": None,
+                "seq": None,
+            }
+
+            if STREAM_MODE == "passthrough":
+                if detection_packet.version == last_detection_version:
+                    time.sleep(pipeline.EMIT_INTERVAL / 3)
+                    continue
+                last_detection_version = detection_packet.version
+                bus.publish(FRAMES_CHANNEL, notification)
+                stats.last_emit_time = time.time()
+                continue
+
+            frame_packet = state.frame_packet
+            if frame_packet is None or frame_packet.version == last_frame_version:
+                time.sleep(pipeline.EMIT_INTERVAL / 3)
+                continue
+            last_frame_version = frame_packet.version
+            traced = tracer.sampled(frame_packet.version)
+
+            encode_mono = time.monotonic()
+            frame_bytes = pipeline.encode_frame(state, frame_packet.frame)
+            if frame_bytes is None:
+                log.warning("Frame encoding failed.", key="encode_failed")
+                continue
+            if traced:
+                tracer.mark(frame_packet.version, encode_start=encode_mono, encoded=time.monotonic())
+            encoded = state.publish_encoded(frame_bytes, frame_packet.capture_time)
+            slot = ring.write(encoded.seq, frame_bytes)
+            if slot is None:
+                log.warning("Frame of %d bytes exceeds FANOUT_SHM_SLOT_BYTES, dropped.", len(frame_bytes),
+                            key="slot_overflow")
+                continue
+
+            notification.update(slot=slot, seq=encoded.seq, timestamp=frame_packet.capture_time,
+                                trace=pipeline.trace_fields(frame_packet, traced))
+            bus.publish(FRAMES_CHANNEL, notification)
+            if traced:
+                # "emitted" is the bus publish here; the worker hop is counted in the network stage
+                tracer.mark(frame_packet.version, emitted=time.monotonic())
+            stats.record_emit(time.time())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.supervisor.stop(SHUTDOWN_TIMEOUT_SECONDS)
+        state.capture_active = False
+        pipeline.stop_recording(camera_name)
+        ring.close()
+        log.info("Publisher stopped.")
+        pipeline_log.stop()
+
+
+def _publisher_control_loop(bus, pipeline, camera_name):
+    """Applies quality requests forwarded by workers and announces the result; answers profile requests."""
+    while True:
+        try:
+            channel, message = bus.recv()
+        except (EOFError, OSError):
+            return
+        if channel == PROFILE_CHANNEL and message.get("type") == "start":
+            _answer_profile(bus, message, f"publisher-{camera_name}")
+            continue
+        if channel != CONTROL_CHANNEL or message.get("camera") != camera_name:
+            continue
+        if message.get("type") == "quality_adjustment":
+            quality = pipeline.apply_quality_level(camera_name, message.get("level"))
+            bus.publish(FRAMES_CHANNEL, {"camera": camera_name, "type": "quality_updated",
+                                         "sid": message.get("sid"), "level": message.get("level"),
+                                         "quality": quality})
+        # Viewer trace replies relayed by the workers; the tracer (and its stage stamps) lives here
+        elif message.get("type") == "pong":
+            pipeline.record_pong(camera_name, message.get("sid"), message.get("data") or {})
+        elif message.get("type") == "frame_ack":
+            pipeline.record_frame_ack(camera_name, message.get("sid"), message.get("data") or {})
+        elif message.get("type") == "viewer_left":
+            pipeline.camera_state[camera_name].tracer.forget(message.get("sid"))
+        elif message.get("type") == "heart_rate":
+            pipeline.ingest_heart_rate(message.get("data"))
+
+
+def _answer_profile(bus, message, process_name):
+    """Profiles this process in a background thread and publishes the result on the bus."""
+    def run():
+        try:
+            result = profiler.profile(message["seconds"], message["interval"], message["memory"], process_name)
+        except profiler.ProfilerBusy as e:
+            result = {"process": process_name, "pid": os.getpid(), "error": str(e)}
+        bus.publish(PROFILE_CHANNEL, {"type": "result", "id": message["id"], "result": result})
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+
+
+# --- Socket.IO Worker Process ---
+class BusManager(AsyncPubSubManager):
+    """python-socketio client manager that shares emits across workers through the bus."""
+    name = "localbus"
+
+    def __init__(self, bus, loop, channel=SOCKETIO_CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self.loop = loop
+        self.messages = asyncio.Queue()
+
+    def deliver(self, message):
+        """Called from the bus reader thread."""
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, message)
+
+    async def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    async def _listen(self):
+        while True:
+            yield await self.messages.get()
+
+
+def run_worker(worker_id, listen_socket, heartbeat):
+    """One stateless Socket.IO relay process sharing the listening socket."""
+    try:
+        asyncio.run(_worker_main(worker_id, listen_socket, heartbeat))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_main(worker_id, listen_socket, heartbeat):
+    import uvicorn
+
+    name = f"worker-{worker_id}"
+    loop = asyncio.get_running_loop()
+    bus = BusClient()
+    bus.subscribe(FRAMES_CHANNEL)
+    bus.subscribe(SOCKETIO_CHANNEL)
+    bus.subscribe(PROFILE_CHANNEL)
+    manager = BusManager(bus, loop)
+
+    sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", client_manager=manager,
+                               transports=["websocket"], logger=False, engineio_logger=False)
+    latest = {}  # camera -> newest frame notification (older ones are simply replaced)
+    latest_event = asyncio.Event()
+    rings = {}  # camera -> ((shm name, publisher pid), SharedFrameRing)
+    snapshots = {}  # camera -> (seq, jpeg_bytes, timestamp)
+    qualities = {}
+    profile_replies = {}  # request id -> asyncio.Queue of per-process results
+
+    def bus_reader():
+        while True:
+            try:
+                channel, message = bus.recv()
+            except (EOFError, OSError):
+                print(f"[{name}] Lost connection to bus.")
+                return
+            if channel == SOCKETIO_CHANNEL:
+                manager.deliver(message)
+            elif channel == FRAMES_CHANNEL:
+                loop.call_soon_threadsafe(_on_frame_notification, message)
+            elif channel == PROFILE_CHANNEL:
+                if message.get("type") == "start":
+                    _answer_profile(bus, message, name)
+                else:
+                    loop.call_soon_threadsafe(_on_profile_result, message)
+
+    def _on_profile_result(message):
+        replies = profile_replies.get(message.get("id"))
+        if replies is not None:
+            replies.put_nowait(message["result"])
+
+    def _on_frame_notification(message):
+        if message.get("type") == "quality_updated":
+            qualities[message["camera"]] = message["quality"]
+            asyncio.ensure_future(_ack_quality(message))
+            return
+        latest[message["camera"]] = message
+        latest_event.set()
+
+    async def _ack_quality(message):
+        sid = message.get("sid")
+        if sid and manager.is_connected(sid, "/"):
+            await sio.emit("quality_updated", {"level": message["level"], "quality_value": message["quality"]},
+                           to=sid, ignore_queue=True)
+
+    def lagging_sids(room):
+        lagging = []
+        for sid, eio_sid in sio.manager.get_participants("/", room):
+            send_queue = getattr(sio.eio.sockets.get(eio_sid), "queue", None)
+            if send_queue is not None and send_queue.qsize() >= ASYNC_MAX_CLIENT_BACKLOG:
+                lagging.append(sid)
+        return lagging
+
+    async def relay():
+        """Reads notified frames from shared memory and emits them to local clients only."""
+        next_ping = 0.0
+        while True:
+            await latest_event.wait()
+            latest_event.clear()
+            pending = list(latest.values())
+            latest.clear()
+            if TRACE_SAMPLE_EVERY and time.monotonic() >= next_ping:
+                # time.monotonic() is one system-wide clock, so the publisher's stage stamps line up with it
+                next_ping = time.monotonic() + TRACE_PING_SECONDS
+                await sio.emit("ping", {"server_mono": time.monotonic()}, room=CAMERA_NAME, ignore_queue=True)
+            for message in pending:
+                camera = message["camera"]
+                qualities[camera] = message.get("quality")
+                detections = {**message["detections"], "timestamp": message["timestamp"],
+                              **(message.get("trace") or {})}
+                skip = lagging_sids(camera) or None
+                if message.get("slot") is not None:
+                    ring_key = (message["shm"], message.get("publisher"))
+                    key, ring = rings.get(camera, (None, None))
+                    if key != ring_key:
+                        if ring is not None:
+                            ring.close()  # Publisher was restarted; its old segment is gone
+                        ring = SharedFrameRing(message["shm"])
+                        rings[camera] = (ring_key, ring)
+                    frame_bytes = ring.read(message["slot"], message["seq"])
+                    if frame_bytes is None:
+                        continue  # Overwritten before we got to it; a newer one is on its way
+                    snapshots[camera] = (message["seq"], frame_bytes, message["timestamp"])
+                    # ignore_queue: every worker relays its own copy, so don't republish on the bus
+                    await sio.emit("frame", frame_bytes, room=camera, skip_sid=skip, ignore_queue=True)
+                await sio.emit("detections", detections, room=camera, skip_sid=skip, ignore_queue=True)
+
+    @sio.event
+    async def connect(sid, environ):
+        await sio.enter_room(sid, CAMERA_NAME)
+        await sio.emit("connection_ack", {"camera": CAMERA_NAME, "quality": qualities.get(CAMERA_NAME),
+                                          "worker": worker_id}, to=sid, ignore_queue=True)
+
+    @sio.event
+    async def quality_adjustment(sid, data):
+        bus.publish(CONTROL_CHANNEL, {"type": "quality_adjustment", "camera": CAMERA_NAME,
+                                      "level": (data or {}).get("level", "medium"), "sid": sid})
+
+    # Trace replies go to the camera's publisher, which holds the tracer
+    @sio.event
+    async def disconnect(sid, reason=None):
+        bus.publish(CONTROL_CHANNEL, {"type": "viewer_left", "camera": CAMERA_NAME, "sid": sid})
+
+    @sio.event
+    async def pong(sid, data):
+        bus.publish(CONTROL_CHANNEL, {"type": "pong", "camera": CAMERA_NAME, "sid": sid, "data": data})
+
+    @sio.event
+    async def frame_ack(sid, data):
+        bus.publish(CONTROL_CHANNEL, {"type": "frame_ack", "camera": CAMERA_NAME, "sid": sid, "data": data})
+
+    @sio.event
+    async def heart_rate(sid, data):
+        """Validated here and stored by the publisher, so every worker's samples land in one series per user."""
+        if not isinstance(data, (dict, list)):
+            return {"error": "Invalid request format. JSON object or array required."}
+        try:
+            samples, invalid = heart_rate_samples(data)
+        except ValueError as e:
+            return {"error": str(e)}
+        user_id = (isinstance(data, dict) and data.get("userId")) or None
+        if samples:
+            bus.publish(CONTROL_CHANNEL, {"type": "heart_rate", "camera": CAMERA_NAME, "data": {
+                "userId": user_id, "samples": [{"bpm": bpm, "timestamp": t} for t, bpm in samples]}})
+        return {"queued": len(samples), "rejected": invalid}
+
+    async def respond(send, status, body, content_type=b"application/json"):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def profile_all(scope, send):
+        """/debug/profile: same query params as app.py's /api/debug/profile, across every process."""
+        query = {key: values[-1] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        token = dict(scope.get("headers") or []).get(b"x-admin-token", b"").decode("latin-1")  # Never the query: logged
+        if not profiler.admin_allowed((scope.get("client") or ("",))[0], token):
+            await respond(send, 403, b'{"error": "Profiling needs ADMIN_TOKEN (or a loopback client)."}')
+            return
+        try:
+            seconds, interval, memory = profiler.parse_request(query)
+        except ValueError as e:
+            await respond(send, 400, json.dumps({"error": str(e)}).encode())
+            return
+
+        request_id = f"{name}-{time.monotonic_ns()}"
+        replies = profile_replies[request_id] = asyncio.Queue()
+        bus.publish(PROFILE_CHANNEL, {"type": "start", "id": request_id, "seconds": seconds,
+                                      "interval": interval, "memory": memory})
+        print(f"[{name}] Profiling all processes for {seconds}s (memory={memory})...")
+        results, expected = [], FANOUT_WORKERS + 1  # Every worker plus the publisher
+        deadline = loop.time() + seconds + PROFILE_REPLY_GRACE_SECONDS
+        try:
+            while len(results) < expected and loop.time() < deadline:
+                results.append(await asyncio.wait_for(replies.get(), deadline - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            profile_replies.pop(request_id, None)
+
+        merged = profiler.merge([result for result in results if "error" not in result])
+        merged["errors"] = [result for result in results if "error" in result]
+        merged["missing"] = max(0, expected - len(results))
+        if query.get("format", "json" if memory else "collapsed") == "json":
+            await respond(send, 200, json.dumps(merged).encode())
+        else:
+            await respond(send, 200, profiler.collapsed_text(merged["stacks"]).encode(), b"text/plain")
+
+    async def http_app(scope, receive, send):
+        """Serves /snapshot/<camera> from the last relayed frame and /debug/profile; everything else is 404."""
+        if scope["type"] != "http":
+            return
+        path = scope["path"].rstrip("/")
+        if path == "/debug/profile":
+            await profile_all(scope, send)
+            return
+        cached = snapshots.get(path[len("/snapshot/"):]) if path.startswith("/snapshot/") else None
+        if cached is None:
+            await respond(send, 404, b"")
+            return
+        seq, jpeg_bytes, timestamp = cached
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"image/jpeg"), (b"x-frame-seq", str(seq).encode()),
+                                (b"cache-control", b"no-cache")]})
+        await send({"type": "http.response.body", "body": jpeg_bytes})
+
+    async def pulse():
+        """Heartbeat from the event loop itself, so a blocked loop shows up as a stall."""
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(WATCHDOG_INTERVAL_SECONDS)
+
+    threading.Thread(target=bus_reader, daemon=True).start()
+    relay_task = asyncio.create_task(relay())
+    pulse_task = asyncio.create_task(pulse())
+    asgi_app = socketio.ASGIApp(sio, other_asgi_app=http_app)
+    print(f"[{name}] Socket.IO relay ready (pid {os.getpid()}).")
+    server = uvicorn.Server(uvicorn.Config(asgi_app, log_level="warning", lifespan="off"))
+    try:
+        await server.serve(sockets=[listen_socket])
+    finally:
+        relay_task.cancel()
+        pulse_task.cancel()
+        for _, ring in rings.values():
+            ring.close()
+
+
+# --- Supervisor ---
+def _start_child(child):
+    """(Re)starts a child process with a fresh heartbeat (0.0 until its first beat)."""
+    child["heartbeat"] = multiprocessing.Value("d", 0.0, lock=False)
+    child["process"] = multiprocessing.Process(target=child["target"], args=(*child["args"], child["heartbeat"]),
+                                               name=child["name"])
+    child["started_at"] = time.time()
+    child["process"].start()
+
+
+def _check_child(child):
+    """Restarts a child that exited or stopped beating; logs how long a restarted one took to come back."""
+    process, last_beat, now = child["process"], child["heartbeat"].value, time.time()
+    if last_beat and child.get("restarted_at"):
+        print(f"{child['name']} recovered: first heartbeat {(last_beat - child['restarted_at']) * 1000:.0f}ms "
+              f"after restart.")
+        child["restarted_at"] = None
+
+    if not process.is_alive():
+        reason = f"exited with code {process.exitcode}"
+    elif not WATCHDOG_ENABLED:
+        return
+    elif last_beat == 0.0 and now - child["started_at"] > WATCHDOG_GRACE_SECONDS:
+        reason = f"no heartbeat {WATCHDOG_GRACE_SECONDS}s after start"
+    elif last_beat and now - last_beat > WATCHDOG_DEADLINE_SECONDS:
+        reason = f"no heartbeat for {now - last_beat:.1f}s"
+    else:
+        return
+
+    print(f"Process {child['name']} {reason}; restarting it.")
+    if process.is_alive():
+        process.terminate()
+        process.join(timeout=1.0)
+        if process.is_alive():
+            process.kill()
+            process.join()
+    child["restarted_at"] = time.time()
+    _start_child(child)
+
+
+def main():
+    print_config()
+    cameras = [CAMERA_NAME]
+    bus = MessageBus()
+    threading.Thread(target=bus.serve_forever, daemon=True).start()
+
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind(("0.0.0.0", SOCKET_PORT))
+    listen_socket.listen(2048)
+    listen_socket.set_inheritable(True)
+
+    children = [{"name": f"publisher-{camera}", "target": run_publisher, "args": (camera,)}
+                for camera in cameras]
+    children += [{"name": f"worker-{i}", "target": run_worker, "args": (i, listen_socket)}
+                 for i in range(FANOUT_WORKERS)]
+    for child in children:
+        _start_child(child)
+    print(f"Fan-out running: {len(cameras)} publisher(s), {FANOUT_WORKERS} Socket.IO worker(s) "
+          f"on ws://0.0.0.0:{SOCKET_PORT}/socket.io/ (websocket transport only)")
+    print("Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            for child in children:
+                _check_child(child)
+    except KeyboardInterrupt:
+        print("\nCtrl+C received, shutting down...")
+    finally:
+        for child in children:
+            if child["process"].is_alive():
+                child["process"].terminate()
+        end = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+        for child in children:
+            child["process"].join(timeout=max(0.0, end - time.monotonic()))
+            if child["process"].is_alive():
+                print(f"Process {child['name']} did not exit in {SHUTDOWN_TIMEOUT_SECONDS}s, killing it.")
+                child["process"].kill()
+        listen_socket.close()
+        print("Shutdown complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+# backend/frame_reader.py
+"""
+Latest-frame reader for OpenCV captures.
+
+A dedicated thread calls cap.grab() back to back, so packets never pile up in
+the FFmpeg/GStreamer buffer while the capture thread is busy with inference.
+Only the frame a consumer actually asks for is retrieve()d (decoded and
+converted to BGR); everything grabbed in between is dropped, so decode work
+follows consumer demand instead of the camera's frame rate.
+
+Queue latency is measured from the stream's own clock: the offset between
+wall time and the frame's presentation timestamp grows by exactly the time a
+frame sat in a buffer, so (offset - smallest offset seen) is the
+buffer-induced delay.
+
+WarmStandby keeps a second FrameReader connected in the background, so a
+stalled primary can be replaced without waiting for a fresh open.
+"""
+import threading
+import time
+
+import pipeline_log
+
+# A grab that returns faster than this came out of the buffer, not off the network
+BACKLOG_GRAB_SECONDS = 0.002
+# Upper bound on backlog frames skipped for one read (fast sources always look backlogged)
+MAX_DRAIN_GRABS = 8
+FAILED_GRAB_BACKOFF_SECONDS = 0.05
+
+
+class FrameReader:
+    """Owns a capture: drains it with grab() and hands out only the newest frame.
+
+    The grab thread is the only thread touching `cap` (OpenCV captures aren't
+    thread-safe), and it releases the capture when stopped.
+    """
+
+    def __init__(self, cap, name):
+        import cv2
+        self.cap = cap
+        self.name = name
+        self.log = pipeline_log.get_logger(name)
+        self.pos_msec_prop = cv2.CAP_PROP_POS_MSEC
+        # Files report a frame count; they have no live buffer to drain, and grabbing
+        # ahead would just race through the file, so they're read on demand instead
+        try:
+            self.live = not cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        except Exception:
+            self.live = True
+        self.cond = threading.Condition()
+        self.active = True
+        self.want = False
+        self.result = None  # (frame or None, grab wall time, grab monotonic time, decode seconds)
+
+        # Stats, written by the grab thread (plain rebinding, read without locking)
+        self.frames_grabbed = 0
+        self.frames_decoded = 0
+        self.grab_failures = 0
+        self.last_grab_mono = time.monotonic()  # Last successful grab (or start)
+        self.buffer_latency_ms = None  # None until the stream reports timestamps
+        self._min_pts_offset = None
+
+        # Written by the consumer
+        self.frame_age_ms = 0.0
+        self.frame_time = 0.0
+        self.frame_mono = 0.0  # time.monotonic() at grab of the frame last read
+        self.decode_seconds = 0.0  # retrieve() time of the frame last read
+
+        self.thread = threading.Thread(target=self._grab_loop, name=f"{name}-grab", daemon=True)
+        self.thread.start()
+
+    # --- Grab Thread ---
+    def _grab_loop(self):
+        drained = 0
+        try:
+            while self.active:
+                if not self.live:
+                    with self.cond:
+                        self.cond.wait_for(lambda: self.want or not self.active)
+                    if not self.active:
+                        break
+                start = time.monotonic()
+                try:
+                    ok = self.cap.grab()
+                except Exception as e:
+                    self.log.warning("grab() raised: %s", e, key="grab_error")
+                    ok = False
+                grab_mono = time.monotonic()
+
+                if not ok:
+                    self.grab_failures += 1
+                    if self.want:
+                        self._hand_over(None, time.time(), grab_mono)
+                    time.sleep(FAILED_GRAB_BACKOFF_SECONDS)
+                    continue
+
+                self.frames_grabbed += 1
+                self.last_grab_mono = grab_mono
+                if self.live and grab_mono - start < BACKLOG_GRAB_SECONDS:
+                    drained += 1
+                else:
+                    drained = 0
+                if not self.want or 0 < drained < MAX_DRAIN_GRABS:
+                    continue  # Nobody waiting, or still emptying a backlog: drop without decoding
+                drained = 0
+
+                decode_start = time.perf_counter()
+                ok, frame = self.cap.retrieve()
+                decode_seconds = time.perf_counter() - decode_start
+                if ok and frame is not None and frame.size > 0:
+                    self.frames_decoded += 1
+                    if self.live:
+                        self._update_buffer_latency(grab_mono)
+                else:
+                    frame = None
+                self._hand_over(frame, time.time(), grab_mono, decode_seconds)
+        finally:
+            try:
+                self.cap.release()
+            except Exception:
+                pass
+
+    def _hand_over(self, frame, grab_wall, grab_mono, decode_seconds=0.0):
+        with self.cond:
+            self.want = False
+            self.result = (frame, grab_wall, grab_mono, decode_seconds)
+            self.cond.notify_all()
+
+    def _update_buffer_latency(self, grab_mono):
+        try:
+            pts_ms = self.cap.get(self.pos_msec_prop)
+        except Exception:
+            return
+        if not pts_ms or pts_ms <= 0:
+            return
+        offset = grab_mono * 1000.0 - pts_ms
+        if self._min_pts_offset is None or offset < self._min_pts_offset:
+            self._min_pts_offset = offset
+        self.buffer_latency_ms = offset - self._min_pts_offset
+
+    # --- Consumer API ---
+    def read(self, timeout=2.0):
+        """Returns (ok, frame) for the next frame grabbed after this call, decoding only that one."""
+        with self.cond:
+            if not self.active:
+                return False, None
+            self.result = None
+            self.want = True
+            self.cond.notify_all() # Wakes the grab thread of an on-demand (file) source
+            if not self.cond.wait_for(lambda: self.result is not None or not self.active, timeout) \
+                    or self.result is None:
+                self.want = False
+                return False, None
+            frame, grab_wall, grab_mono, decode_seconds = self.result
+            self.result = None
+        if frame is None:
+            return False, None
+        self.frame_time = grab_wall
+        self.frame_mono = grab_mono
+        self.frame_age_ms = (time.monotonic() - grab_mono) * 1000.0
+        self.decode_seconds = decode_seconds
+        return True, frame
+
+    def stalled(self, seconds):
+        """True if a live stream hasn't delivered a packet for `seconds` (files only move on demand)."""
+        return self.live and time.monotonic() - self.last_grab_mono > seconds
+
+    def stop(self, timeout=1.0):
+        """Stops grabbing; the grab thread releases the capture once its current grab() returns."""
+        self.active = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+
+class WarmStandby:
+    """Keeps a second, already-connected FrameReader ready to replace a stalled primary.
+
+    Opening happens in a background thread, so neither the first connection nor a
+    takeover waits on open_fn's blocking test read. The standby's reader drains its
+    stream like any other, so the frame it hands over is current.
+    """
+
+    def __init__(self, open_fn, name, stall_seconds):
+        self.open_fn = open_fn  # Returns an opened capture or None
+        self.name = name
+        self.stall_seconds = stall_seconds
+        self.lock = threading.Lock()
+        self.reader = None
+        self.opening = False
+        self.active = True
+
+    def ensure(self):
+        """Starts opening a standby connection unless one is ready or on its way."""
+        with self.lock:
+            if not self.active or self.reader is not None or self.opening:
+                return
+            self.opening = True
+        threading.Thread(target=self._open, name=f"{self.name}-standby-open", daemon=True).start()
+
+    def _open(self):
+        reader = None
+        try:
+            cap = self.open_fn()
+            if cap is not None:
+                reader = FrameReader(cap, f"{self.name}-standby")
+        except Exception as e:
+            print(f"[{self.name}] Standby open failed: {e}")
+        with self.lock:
+            self.opening = False
+            if self.active and reader is not None:
+                self.reader = reader
+                print(f"[{self.name}] Warm standby connection ready.")
+                return
+        if reader is not None:
+            reader.stop(timeout=0)
+
+    def take(self):
+        """Returns the standby reader if it is still receiving frames (else None), and starts a new one."""
+        with self.lock:
+            reader, self.reader = self.reader, None
+        if reader is not None and reader.stalled(self.stall_seconds):
+            print(f"[{self.name}] Warm standby had stalled too, discarding it.")
+            reader.stop(timeout=0)
+            reader = None
+        self.ensure()
+        return reader
+
+    def stop(self):
+        with self.lock:
+            self.active = False
+            reader, self.reader = self.reader, None
+        if reader is not None:
+            reader.stop(timeout=0)
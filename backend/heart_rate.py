@@ -0,0 +1,262 @@
+# backend/heart_rate.py
+"""
+Heart-rate time series with precomputed rollups.
+
+Samples (bpm, timestamp) arrive over Socket.IO ('heart_rate') or in batches over
+HTTP (/api/heart-rate/samples), one series per user. Each series keeps:
+
+  * the raw samples in two fixed-size numpy columns (float64 time, uint16 bpm)
+    used as a ring, HR_RAW_SAMPLES deep;
+  * for every resolution in HR_ROLLUP_RESOLUTIONS, a ring of HR_ROLLUP_BUCKETS
+    consecutive buckets holding count, sum, min, max and seconds per zone.
+
+Rollups are updated as each sample is added, so a dashboard reads a handful of
+buckets instead of scanning raw samples. Time in zone credits each sample with
+the gap since the previous one (at most HR_MAX_GAP_SECONDS, so a dropped
+strap doesn't count as an hour in one zone). Samples must move forward in
+time per user; older or duplicate timestamps are rejected, which keeps every
+update an in-place write to the newest bucket.
+
+The store lives in this process's memory, HR_MAX_USERS series at most (the
+least recently used is dropped); zones match HeartRateZoneOverlay.jsx.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from config import (
+    HR_ZONE_BOUNDS, HR_ROLLUP_RESOLUTIONS, HR_ROLLUP_BUCKETS, HR_RAW_SAMPLES, HR_MAX_GAP_SECONDS, HR_MAX_USERS
+)
+
+ZONE_NAMES = ("Rest", "Warm-up", "Fat Burn", "Cardio", "Peak")
+MIN_BPM = 20
+MAX_BPM = 250
+MAX_SAMPLES_PER_REQUEST = 10000
+# Timestamps above this are taken as milliseconds (Date.now()) rather than seconds
+MS_TIMESTAMP_THRESHOLD = 1e11
+# Accepted sample times around now: a day of backfill from a strap's memory, a little clock skew ahead
+MAX_SAMPLE_AGE_SECONDS = 86400
+MAX_SAMPLE_AHEAD_SECONDS = 300
+
+_zone_bounds = np.array(HR_ZONE_BOUNDS, dtype=np.float64)
+
+
+def zone_of(bpm):
+    """Index into ZONE_NAMES: zone i covers [bound i-1, bound i)."""
+    return int(np.searchsorted(_zone_bounds, bpm, side="right"))
+
+
+class RollupRing:
+    """Consecutive buckets of one resolution as parallel numpy columns; row = bucket number % size."""
+
+    def __init__(self, resolution, size=HR_ROLLUP_BUCKETS):
+        self.resolution = resolution
+        self.size = size
+        self.bucket = np.full(size, -1, dtype=np.int64)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.sum = np.zeros(size, dtype=np.float64)
+        self.min = np.zeros(size, dtype=np.uint16)
+        self.max = np.zeros(size, dtype=np.uint16)
+        self.zone_seconds = np.zeros((size, len(ZONE_NAMES)), dtype=np.float64)
+        self.head = -1  # Newest bucket number
+
+    def add(self, t, bpm, zone, seconds):
+        bucket = int(t // self.resolution)
+        row = bucket % self.size
+        if bucket != self.head:  # Samples only move forward, so this is a new bucket: reuse its row
+            self.head = bucket
+            self.bucket[row] = bucket
+            self.count[row] = 0
+            self.sum[row] = 0.0
+            self.min[row] = bpm
+            self.max[row] = bpm
+            self.zone_seconds[row] = 0.0
+        self.count[row] += 1
+        self.sum[row] += bpm
+        if bpm < self.min[row]:
+            self.min[row] = bpm
+        elif bpm > self.max[row]:
+            self.max[row] = bpm
+        self.zone_seconds[row, zone] += seconds
+
+    def oldest_time(self):
+        """Start of the oldest bucket still held."""
+        return (self.head - self.size + 1) * self.resolution
+
+    def rows(self, since=None, until=None):
+        """Row indexes of non-empty buckets overlapping [since, until), oldest first."""
+        low = max(self.head - self.size + 1, int(since // self.resolution) if since is not None else -1)
+        high = int(until // self.resolution) if until is not None else self.head
+        if until is not None and until % self.resolution == 0:
+            high -= 1  # until is exclusive
+        live = (self.bucket >= low) & (self.bucket <= high) & (self.count > 0)
+        rows = np.flatnonzero(live)
+        return rows[np.argsort(self.bucket[rows])]
+
+
+class HeartRateSeries:
+    """One user's raw samples and rollups."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.lock = threading.Lock()  # Ingest (Socket.IO/HTTP threads) vs. dashboard reads
+        self.times = np.zeros(HR_RAW_SAMPLES, dtype=np.float64)
+        self.bpm = np.zeros(HR_RAW_SAMPLES, dtype=np.uint16)
+        self.written = 0  # Samples ever written; the ring holds the last HR_RAW_SAMPLES
+        self.last_time = None
+        self.rollups = [RollupRing(resolution) for resolution in HR_ROLLUP_RESOLUTIONS]
+
+    def add(self, samples):
+        """Adds (timestamp, bpm) pairs sorted by time; returns how many were newer than the last sample."""
+        accepted = 0
+        with self.lock:
+            for t, bpm in samples:
+                if self.last_time is not None and t <= self.last_time:
+                    continue
+                seconds = 0.0 if self.last_time is None else min(t - self.last_time, HR_MAX_GAP_SECONDS)
+                zone = zone_of(bpm)
+                row = self.written % HR_RAW_SAMPLES
+                self.times[row] = t
+                self.bpm[row] = bpm
+                self.written += 1
+                self.last_time = t
+                for ring in self.rollups:
+                    ring.add(t, bpm, zone, seconds)
+                accepted += 1
+        return accepted
+
+    def raw(self, since=None, until=None, limit=None):
+        """Raw [(timestamp, bpm)] in the range, oldest first (the newest `limit` if given)."""
+        with self.lock:
+            held = min(self.written, HR_RAW_SAMPLES)
+            order = (np.arange(self.written - held, self.written) % HR_RAW_SAMPLES)
+            times, bpm = self.times[order], self.bpm[order]
+        keep = np.ones(len(times), dtype=bool)
+        if since is not None:
+            keep &= times >= since
+        if until is not None:
+            keep &= times < until
+        times, bpm = times[keep], bpm[keep]
+        if limit:
+            times, bpm = times[-limit:], bpm[-limit:]
+        return [(float(t), int(b)) for t, b in zip(times, bpm)]
+
+    def ring_for(self, resolution=None, since=None):
+        """The requested resolution, else the finest one that still reaches back to `since`."""
+        if resolution is not None:
+            for ring in self.rollups:
+                if ring.resolution == resolution:
+                    return ring
+            raise ValueError(f"resolution must be one of {list(HR_ROLLUP_RESOLUTIONS)}")
+        for ring in self.rollups:
+            if since is not None and ring.oldest_time() <= since:
+                return ring
+        return self.rollups[-1]
+
+    def buckets(self, resolution=None, since=None, until=None):
+        with self.lock:
+            ring = self.ring_for(resolution, since)
+            rows = ring.rows(since, until)
+            return ring.resolution, [
+                {"start": float(ring.bucket[row] * ring.resolution),
+                 "count": int(ring.count[row]),
+                 "min": int(ring.min[row]),
+                 "max": int(ring.max[row]),
+                 "avg": round(float(ring.sum[row] / ring.count[row]), 1),
+                 "zone_seconds": dict(zip(ZONE_NAMES, np.round(ring.zone_seconds[row], 1).tolist()))}
+                for row in rows
+            ]
+
+    def summary(self, since=None, until=None):
+        """Min/max/avg and time in zone over the range, from the buckets (bucket-aligned edges)."""
+        with self.lock:
+            ring = self.ring_for(None, since)
+            rows = ring.rows(since, until)
+            count = int(ring.count[rows].sum())
+            return {
+                "resolution": ring.resolution,
+                "count": count,
+                "min": int(ring.min[rows].min()) if count else None,
+                "max": int(ring.max[rows].max()) if count else None,
+                "avg": round(float(ring.sum[rows].sum() / count), 1) if count else None,
+                "zone_seconds": dict(zip(ZONE_NAMES, np.round(ring.zone_seconds[rows].sum(axis=0), 1).tolist())),
+                "last_sample": self.last_time,
+            }
+
+
+# --- Store ---
+_lock = threading.Lock()
+_series = OrderedDict()  # user id -> HeartRateSeries, least recently used first
+_samples_accepted = metrics.counter("heart_rate_samples_total", "Heart-rate samples received.", outcome="accepted")
+_samples_rejected = metrics.counter("heart_rate_samples_total", "Heart-rate samples received.", outcome="rejected")
+metrics.register_collector(lambda: [
+    ("heart_rate_series", "gauge", "Users with a heart-rate series in memory.", [({}, len(_series))]),
+])
+
+
+def get_series(user_id, create=False):
+    with _lock:
+        series = _series.get(user_id)
+        if series is None:
+            if not create:
+                return None
+            series = _series[user_id] = HeartRateSeries(user_id)
+            while len(_series) > HR_MAX_USERS:
+                evicted, _ = _series.popitem(last=False)
+                print(f"[heart-rate] Dropped the series of user {evicted!r} (HR_MAX_USERS={HR_MAX_USERS}).")
+        else:
+            _series.move_to_end(user_id)
+        return series
+
+
+def parse_samples(payload, now=None):
+    """Reads {bpm, timestamp}, {samples: [...]} or a list of samples.
+
+    Returns ([(timestamp seconds, bpm)] sorted by time, number of invalid samples).
+    Timestamps may be seconds or milliseconds; a missing one means now. Non-finite values and
+    times outside [now - MAX_SAMPLE_AGE_SECONDS, now + MAX_SAMPLE_AHEAD_SECONDS] are invalid.
+    Raises ValueError if the payload has no samples at all.
+    """
+    if isinstance(payload, dict):
+        samples = payload.get("samples", [payload] if "bpm" in payload else None)
+    else:
+        samples = payload
+    if not isinstance(samples, list) or not samples:
+        raise ValueError("Expected 'bpm' or a non-empty 'samples' array.")
+    if len(samples) > MAX_SAMPLES_PER_REQUEST:
+        raise ValueError(f"At most {MAX_SAMPLES_PER_REQUEST} samples per request.")
+    now = now or time.time()
+    parsed, invalid = [], 0
+    for sample in samples:
+        try:
+            bpm = float(sample["bpm"])
+            t = float(sample.get("timestamp") or now)
+        except (TypeError, KeyError, ValueError, AttributeError):
+            invalid += 1
+            continue
+        if not (math.isfinite(t) and math.isfinite(bpm)):
+            invalid += 1
+            continue
+        if t > MS_TIMESTAMP_THRESHOLD:
+            t /= 1000.0
+        if not (now - MAX_SAMPLE_AGE_SECONDS <= t <= now + MAX_SAMPLE_AHEAD_SECONDS and MIN_BPM <= bpm <= MAX_BPM):
+            invalid += 1
+            continue
+        parsed.append((t, int(round(bpm))))
+    parsed.sort()
+    return parsed, invalid
+
+
+def ingest(user_id, payload):
+    """Parses and stores samples for a user. Returns {"accepted", "rejected"}; raises ValueError on a bad payload."""
+    samples, invalid = parse_samples(payload)
+    accepted = get_series(user_id, create=True).add(samples) if samples else 0
+    rejected = invalid + len(samples) - accepted
+    with _lock:  # Ingest runs on many request threads
+        _samples_accepted.inc(accepted)
+        _samples_rejected.inc(rejected)
+    return {"accepted": accepted, "rejected": rejected}
@@ -0,0 +1,247 @@
+# backend/landmark_recorder.py
+"""
+Landmark recorder: per-frame pose data in fixed-size binary records.
+
+With RECORD_LANDMARKS=1 (or POST /api/recordings/start) the capture loop
+appends one RECORD_DTYPE record per processed frame: capture time, frame id,
+the latest rep counts reported by /api/workout/track, the bbox and all
+LANDMARKS (x, y, confidence) as float32. Records are filled into a
+preallocated numpy buffer in the capture thread; full buffers go to a writer
+thread that appends them to the file, so the frame path never touches the disk
+(a backed-up writer drops whole buffers and counts them).
+
+Each file starts with a HEADER_BYTES header (MAGIC + JSON: camera, start time,
+dtype) followed by packed records, so a recording maps straight to an array:
+
+    meta, frames = landmark_recorder.open_recording(path)
+    frames["landmarks"][:, 11:13, :2]   # shoulders across the whole session
+
+Files rotate at RECORDER_MAX_FILE_MB. A truncated last record (crash mid-write)
+is ignored by open_recording().
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+
+import metrics
+import pipeline_log
+from config import RECORDER_DIR, RECORDER_BUFFER_FRAMES, RECORDER_MAX_FILE_MB
+
+MAGIC = b"LMKREC01"
+HEADER_BYTES = 512
+LANDMARKS = 33  # MediaPipe Pose
+FILE_SUFFIX = ".lmk"
+# Full buffers waiting for the writer before new ones are dropped
+MAX_PENDING_BUFFERS = 16
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),                   # Capture time (time.time())
+    ("frame_id", "<u8"),                    # Detection packet version
+    ("counts", "<u4", (2,)),                # Push-ups, sit-ups as last reported by the client
+    ("landmark_count", "<u2"),
+    ("bbox", "<f4", (4,)),                  # x_min, y_min, x_max, y_max in 0..1; NaN without a person
+    ("landmarks", "<f4", (LANDMARKS, 3)),   # x, y in 0..1 and confidence; NaN past landmark_count
+])
+
+_STOP = object()
+MAX_COUNT = np.iinfo(np.uint32).max
+
+
+def _blank_records(n):
+    records = np.zeros(n, dtype=RECORD_DTYPE)
+    records["bbox"] = np.nan
+    records["landmarks"] = np.nan
+    return records
+
+
+_BLANK_RECORD = _blank_records(1)[0]
+
+
+def _clamp_count(value):
+    try:
+        return min(max(int(value or 0), 0), MAX_COUNT)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+class LandmarkRecorder:
+    """Appends RECORD_DTYPE records for one camera session; record() is called from the capture thread."""
+
+    def __init__(self, camera_name, directory=RECORDER_DIR, buffer_frames=RECORDER_BUFFER_FRAMES,
+                 max_file_bytes=RECORDER_MAX_FILE_MB * 1024 * 1024):
+        self.camera_name = camera_name
+        self.directory = os.path.join(directory, camera_name)
+        os.makedirs(self.directory, exist_ok=True)
+        # Time sorts the sessions; the suffix keeps a stop and restart within one second from sharing files
+        self.session = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()  # record() vs. close() from a request thread
+        self.buffer_frames = buffer_frames
+        self.buffer = self._new_buffer()
+        self.filled = 0
+        self.counts = (0, 0)
+        self.closed = False
+        self.pending = queue.Queue(maxsize=MAX_PENDING_BUFFERS)
+        self.frames_recorded = metrics.counter("landmark_frames_recorded_total", "Frames written by the recorder.",
+                                               camera=camera_name)
+        self.frames_dropped = metrics.counter("landmark_frames_dropped_total",
+                                              "Recorded frames dropped because the writer fell behind.",
+                                              camera=camera_name)
+        self.files = []
+        self.log = pipeline_log.get_logger(camera_name)
+        self.writer = threading.Thread(target=self._write_loop, name=f"{camera_name}-recorder", daemon=True)
+        self.writer.start()
+        print(f"[{camera_name}] Recording landmarks to {self.directory} (session {self.session})")
+
+    def _new_buffer(self):
+        return _blank_records(self.buffer_frames)
+
+    # --- Capture Thread ---
+    def set_counts(self, pushups, situps):
+        """Rep labels for the following frames, clamped to the <u4 counts field (bad values count as 0)."""
+        self.counts = (_clamp_count(pushups), _clamp_count(situps))
+
+    def record(self, frame_id, timestamp, detection):
+        """Stores one frame's normalized detection (as published to viewers). Never raises into the capture loop."""
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self._fill(self.buffer[self.filled], frame_id, timestamp, detection)
+            except Exception as e:
+                self.buffer[self.filled] = _BLANK_RECORD  # Undo a half-filled row
+                self.frames_dropped.inc()
+                self.log.warning("Could not record frame %s: %s", frame_id, e, key="record_failed")
+                return
+            self.filled += 1
+            if self.filled == self.buffer_frames:
+                self._hand_off()
+
+    def _fill(self, row, frame_id, timestamp, detection):
+        row["timestamp"] = timestamp
+        row["frame_id"] = frame_id
+        row["counts"] = self.counts
+        bbox = detection.get("bbox")
+        if bbox:
+            row["bbox"] = (bbox["x_min"], bbox["y_min"], bbox["x_max"], bbox["y_max"])
+        landmarks = detection.get("landmarks") or ()
+        count = min(len(landmarks), LANDMARKS)
+        row["landmark_count"] = count
+        if count:
+            row["landmarks"][:count] = [(lm["x"], lm["y"], lm.get("confidence", 1.0))
+                                        for lm in landmarks[:count]]
+
+    def _hand_off(self):
+        try:
+            self.pending.put_nowait(self.buffer[:self.filled])
+        except queue.Full:
+            self.frames_dropped.inc(self.filled)
+        self.buffer = self._new_buffer()
+        self.filled = 0
+
+    def close(self, timeout=None):
+        """Writes the partial buffer and everything pending, then stops the writer."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.filled:
+                self._hand_off()
+        self.pending.put(_STOP)
+        self.writer.join(timeout)
+
+    # --- Writer Thread ---
+    def _open_file(self):
+        path = os.path.join(self.directory, f"{self.session}-{len(self.files):03d}{FILE_SUFFIX}")
+        f = open(path, "xb")  # Never truncate an existing recording
+        write_header(f, self.camera_name, self.session)
+        self.files.append(path)
+        return f
+
+    def _write_loop(self):
+        f = None
+        try:
+            while True:
+                records = self.pending.get()
+                if records is _STOP:
+                    break
+                if f is None or f.tell() + records.nbytes > self.max_file_bytes:
+                    if f is not None:
+                        f.close()
+                    f = self._open_file()
+                try:
+                    f.write(records.tobytes())
+                    f.flush()
+                    self.frames_recorded.inc(len(records))
+                except OSError as e:
+                    self.frames_dropped.inc(len(records))
+                    print(f"[{self.camera_name}] ERROR: Could not write landmark records: {e}")
+        finally:
+            if f is not None:
+                f.close()
+
+
+# --- File Format ---
+def header_bytes(camera_name, session, **extra):
+    """The HEADER_BYTES header for a new recording file. Raises ValueError if the metadata doesn't fit."""
+    meta = {"camera": camera_name, "session": session, "started_at": time.time(), "landmarks": LANDMARKS,
+            "record_bytes": RECORD_DTYPE.itemsize, "dtype": RECORD_DTYPE.descr, **extra}
+    header = MAGIC + json.dumps(meta).encode("utf-8")
+    if len(header) > HEADER_BYTES:
+        raise ValueError("Recording metadata does not fit in the header.")
+    return header.ljust(HEADER_BYTES, b" ")
+
+
+def write_header(f, camera_name, session, **extra):
+    """Writes the HEADER_BYTES header at the start of a new recording file."""
+    f.write(header_bytes(camera_name, session, **extra))
+
+
+# --- Reading ---
+def read_header(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER_BYTES)
+    if len(header) < HEADER_BYTES or not header.startswith(MAGIC):
+        raise ValueError(f"{path} is not a landmark recording.")
+    meta = json.loads(header[len(MAGIC):].decode("utf-8").rstrip())
+    if meta["record_bytes"] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} was written with a different record layout.")
+    return meta
+
+
+def open_recording(path):
+    """Returns (header dict, read-only numpy.memmap of RECORD_DTYPE records); nothing is loaded up front."""
+    meta = read_header(path)
+    frames = (os.path.getsize(path) - HEADER_BYTES) // RECORD_DTYPE.itemsize
+    if frames == 0:
+        return meta, np.zeros(0, dtype=RECORD_DTYPE)
+    return meta, np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_BYTES, shape=(frames,))
+
+
+def list_recordings(directory=RECORDER_DIR):
+    """[{camera, session, file, frames, bytes, started_at}] for every recording on disk, oldest first."""
+    recordings = []
+    if not os.path.isdir(directory):
+        return recordings
+    for camera in sorted(os.listdir(directory)):
+        camera_dir = os.path.join(directory, camera)
+        if not os.path.isdir(camera_dir):
+            continue
+        for name in sorted(os.listdir(camera_dir)):
+            if not name.endswith(FILE_SUFFIX):
+                continue
+            path = os.path.join(camera_dir, name)
+            try:
+                meta = read_header(path)
+            except (OSError, ValueError):
+                continue
+            size = os.path.getsize(path)
+            recordings.append({"camera": camera, "session": meta["session"], "file": name,
+                               "frames": (size - HEADER_BYTES) // RECORD_DTYPE.itemsize,
+                               "bytes": size, "started_at": meta["started_at"]})
+    return recordings
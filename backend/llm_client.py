@@ -0,0 +1,180 @@
+# backend/llm_client.py
+"""
+Coach chat backends behind /api/chat and /api/chat/stream.
+
+One backend is created on first use and shared by every request. The OpenAI
+backend holds a single client over a pooled HTTP connection pool
+(LLM_MAX_CONNECTIONS kept alive), so requests after the first skip the
+client setup and the TCP/TLS handshake. stream() yields the reply's text as
+the API produces it, which lets the voice coach start speaking on the first
+sentence instead of waiting for the whole completion.
+
+LLM_BACKEND=mock swaps in a local backend that streams canned coaching
+replies token by token (LLM_MOCK_TOKEN_MS apart), for development and tests
+with no network access or API key.
+"""
+import random
+import re
+import threading
+import time
+
+import metrics
+from config import (
+    LLM_BACKEND, LLM_MODEL, LLM_TEMPERATURE, LLM_MAX_TOKENS, LLM_TIMEOUT_SECONDS, LLM_MAX_CONNECTIONS,
+    LLM_MOCK_TOKEN_MS
+)
+
+REPLY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+
+
+def valid_messages(messages):
+    """True for a non-empty list of {role, content} dicts, as sent by useVoiceController."""
+    return (isinstance(messages, list) and bool(messages)
+            and all(isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+                    for m in messages))
+
+
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self):
+        # Imported here: the openai package alone takes ~0.5s to load
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        self.http_client = DefaultHttpxClient(limits=limits, timeout=LLM_TIMEOUT_SECONDS)
+        self.client = OpenAI(http_client=self.http_client, timeout=LLM_TIMEOUT_SECONDS)
+        print(f"[chat] OpenAI client ready ({LLM_MODEL}, up to {LLM_MAX_CONNECTIONS} pooled connections)")
+
+    def _create(self, messages, **kwargs):
+        return self.client.chat.completions.create(model=LLM_MODEL, messages=messages, temperature=LLM_TEMPERATURE,
+                                                   max_tokens=LLM_MAX_TOKENS, **kwargs)
+
+    def complete(self, messages):
+        """Returns (reply text, usage dict)."""
+        completion = self._create(messages)
+        usage = completion.usage
+        return completion.choices[0].message.content or "", {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+        } if usage else None
+
+    def stream(self, messages):
+        """Yields pieces of the reply as they arrive."""
+        with self._create(messages, stream=True) as chunks:
+            for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    def close(self):
+        self.http_client.close()
+
+
+class MockBackend:
+    """Canned replies picked by keyword, streamed a word at a time."""
+    name = "mock"
+
+    REPLIES = (
+        (("form", "technique", "posture"),
+         "Keep your core tight and your back straight. Move slowly through the full range of motion."),
+        (("tired", "motivate", "give up"),
+         "You're doing amazing! Every rep brings you closer to your goals. Push through this set."),
+        (("heart", "pulse", "bpm"),
+         "Your heart rate looks good for this effort. Keep your breathing steady and controlled."),
+        (("rest", "break"),
+         "Take thirty to sixty seconds of rest. Shake out your arms and get ready for the next set."),
+    )
+    GENERIC = (
+        "You're doing great! Keep pushing yourself, but listen to your body.",
+        "Focus on quality reps rather than quantity. Maintain proper breathing throughout each exercise.",
+        "Remember to stay hydrated. Form is more important than speed.",
+    )
+
+    def __init__(self, token_seconds=LLM_MOCK_TOKEN_MS / 1000.0):
+        self.token_seconds = token_seconds
+        print("[chat] Using the mock chat backend (no network)")
+
+    def reply(self, messages):
+        question = next((m["content"].lower() for m in reversed(messages) if m["role"] == "user"), "")
+        for words, reply in self.REPLIES:
+            if any(word in question for word in words):
+                return reply
+        return random.choice(self.GENERIC)
+
+    def complete(self, messages):
+        reply = self.reply(messages)
+        tokens = len(reply.split())
+        return reply, {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens}
+
+    def stream(self, messages):
+        for token in re.findall(r"\S+\s*", self.reply(messages)):
+            time.sleep(self.token_seconds)
+            yield token
+
+    def close(self):
+        pass
+
+
+BACKENDS = {"openai": OpenAIBackend, "mock": MockBackend}
+
+
+# --- Shared Backend (created on first use) ---
+_lock = threading.Lock()
+_backend = None
+
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            if LLM_BACKEND not in BACKENDS:
+                raise ValueError(f"LLM_BACKEND must be one of {list(BACKENDS)}, not {LLM_BACKEND!r}")
+            _backend = BACKENDS[LLM_BACKEND]()
+        return _backend
+
+
+def close():
+    """Closes the shared client's connections if it was created."""
+    global _backend
+    with _lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        backend.close()
+
+
+def _requests(mode, outcome):
+    return metrics.counter("chat_requests_total", "Coach chat requests.", mode=mode, outcome=outcome)
+
+
+def complete(messages):
+    """Returns (reply text, usage dict or None); raises whatever the backend raises."""
+    start = time.perf_counter()
+    try:
+        reply, usage = get_backend().complete(messages)
+    except Exception:
+        _requests("complete", "error").inc()
+        raise
+    _requests("complete", "ok").inc()
+    metrics.histogram("chat_reply_seconds", "Time until the whole coach reply was received.", REPLY_BUCKETS,
+                      mode="complete").observe(time.perf_counter() - start)
+    return reply, usage
+
+
+def stream(messages):
+    """Yields the reply in pieces as they arrive, recording time to first token and to the last."""
+    start = time.perf_counter()
+    first = True
+    try:
+        for piece in get_backend().stream(messages):
+            if first:
+                first = False
+                metrics.histogram("chat_first_token_seconds", "Time until the first piece of a streamed reply.",
+                                  REPLY_BUCKETS).observe(time.perf_counter() - start)
+            yield piece
+    except Exception:
+        _requests("stream", "error").inc()
+        raise
+    _requests("stream", "ok").inc()
+    metrics.histogram("chat_reply_seconds", "Time until the whole coach reply was received.", REPLY_BUCKETS,
+                      mode="stream").observe(time.perf_counter() - start)
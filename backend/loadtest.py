@@ -0,0 +1,352 @@
+# backend/loadtest.py
+"""
+Socket.IO viewer load generator.
+
+Connects N simulated viewers to a running server (app.py, async_server.py or
+fanout.py), measures what each one receives, and sweeps client count x
+quality tier x camera count:
+
+  python loadtest.py --url http://127.0.0.1:5000 --clients 1,10,50,100 \
+      --qualities low,medium,high --duration 10 --plot scaling.png
+
+Per step it records frames received and rate, the drop rate against the
+server's TARGET_FPS (from /api/pipeline/backends, else the best viewer), and
+glass-to-glass latency: receive time minus the capture timestamp on the
+'detections' event that follows each frame. That is only meaningful when the
+load generator and server share a clock (same host, or NTP-synced).
+
+--kbps throttles every viewer's link by sleeping after each websocket
+message, which stalls its read loop the way a slow network would, so the
+server's backpressure handling is exercised. Several --url values simulate
+several cameras (one server per camera); viewers are spread round-robin and
+the sweep grows the camera count one URL at a time. Viewers run in
+--processes worker processes so the generator itself isn't the bottleneck.
+"""
+import argparse
+import json
+import multiprocessing
+import re
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+CONNECT_TIMEOUT_SECONDS = 10.0
+WARMUP_SECONDS = 2.0
+QUALITY_ACK_TIMEOUT_SECONDS = 5.0
+
+
+# --- Viewer ---
+class SocketIOConnection:
+    """A minimal Socket.IO client (protocol 5 over Engine.IO 4) on a plain websocket-client socket.
+
+    One thread reads the socket and handles every message in order, so a
+    frame's binary attachment always follows its event packet, and --kbps can
+    sleep right after each read to stall the socket itself. Only the public
+    wire protocol is used, so python-socketio/engineio upgrades can't break it.
+    An event whose attachment doesn't arrive next is dropped and reported to
+    on_error: the server sends an event and its attachment as two messages
+    without a lock, so a reply from a handler thread can land in between.
+    """
+
+    def __init__(self, url, handlers, bytes_per_second=None, on_error=None):
+        import websocket
+        self.handlers = handlers
+        self.bytes_per_second = bytes_per_second
+        self.on_error = on_error
+        self.pending = None  # (event packet, attachment count) of a binary event waiting for its attachments
+        self.attachments = []
+        self.joined = False
+        ws_url = re.sub(r"^http", "ws", url.rstrip("/")) + "/socket.io/?EIO=4&transport=websocket"
+        self.ws = websocket.create_connection(ws_url, timeout=CONNECT_TIMEOUT_SECONDS)
+        try:
+            if not self.ws.recv().startswith("0"):  # Engine.IO open packet
+                raise ConnectionError("no Engine.IO handshake")
+            self.ws.send("40")  # Join the default namespace
+            while not self.joined:  # The server's connect handler may emit before it accepts
+                if not self._handle(self.ws.recv()):
+                    raise ConnectionError("closed by the server while connecting")
+        except Exception:
+            self.ws.close()
+            raise
+        self.ws.settimeout(None)
+        self.reader = threading.Thread(target=self._read_loop, name="loadtest-viewer", daemon=True)
+        self.reader.start()
+
+    def emit(self, event, data):
+        self.ws.send("42" + json.dumps([event, data]))
+
+    def close(self):
+        try:
+            self.ws.send("41")
+        except Exception:
+            pass
+        self.ws.close()
+        self.reader.join(CONNECT_TIMEOUT_SECONDS)
+
+    def _read_loop(self):
+        while True:
+            try:
+                message = self.ws.recv()
+            except Exception:
+                return  # Closed
+            if self.bytes_per_second:
+                time.sleep(len(message) / self.bytes_per_second)
+            if not self._handle(message):
+                return
+
+    def _handle(self, message):
+        """Handles one websocket message; False once the server closed the connection or the namespace."""
+        if isinstance(message, bytes):
+            if self.pending is None:
+                self._error()
+                return True
+            self.attachments.append(message)
+            if len(self.attachments) == self.pending[1]:
+                packet, self.pending = self.pending[0], None
+                self._dispatch(packet, self.attachments)
+            return True
+        if self.pending is not None:
+            self.pending = None
+            self._error()
+        if message == "2":
+            self.ws.send("3")
+        elif message.startswith(("1", "41", "44")):
+            return False
+        elif message.startswith("40"):
+            self.joined = True
+        elif message.startswith("42"):
+            self._dispatch(json.loads(message[2:].lstrip("0123456789")), [])
+        elif message.startswith("45"):
+            count, _, body = message[2:].partition("-")
+            self.pending, self.attachments = (json.loads(body.lstrip("0123456789")), int(count)), []
+        return True
+
+    def _dispatch(self, packet, attachments):
+        handler = self.handlers.get(packet[0])
+        if handler is not None:
+            handler(*[_with_attachments(arg, attachments) for arg in packet[1:]])
+
+    def _error(self):
+        if self.on_error:
+            self.on_error()
+
+
+def _with_attachments(value, attachments):
+    """Replaces Socket.IO binary placeholders ({"_placeholder": true, "num": i}) with the attachments."""
+    if isinstance(value, dict):
+        if value.get("_placeholder") is True:
+            return attachments[value["num"]]
+        return {key: _with_attachments(item, attachments) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_with_attachments(item, attachments) for item in value]
+    return value
+
+
+class Viewer:
+    """One Socket.IO connection that counts frames and timestamps detections."""
+
+    def __init__(self, url, kbps=None):
+        self.url = url
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.frame_bytes = 0
+        self.latencies_ms = []
+        self.protocol_errors = 0
+        self.connected = False
+        self.connection = None
+        try:
+            self.connection = SocketIOConnection(url, {"frame": self._on_frame, "detections": self._on_detections},
+                                                 kbps * 1000 / 8 if kbps else None, self._on_protocol_error)
+            self.connected = True
+        except Exception as e:
+            print(f"[loadtest] Viewer could not connect to {url}: {e}")
+
+    def _on_protocol_error(self):
+        with self.lock:
+            self.protocol_errors += 1
+
+    def _on_frame(self, data):
+        with self.lock:
+            self.frames += 1
+            self.frame_bytes += len(data)
+
+    def _on_detections(self, data):
+        timestamp = (data or {}).get("timestamp")
+        if timestamp:
+            with self.lock:
+                self.latencies_ms.append((time.time() - timestamp) * 1000.0)
+
+    def reset(self):
+        with self.lock:
+            self.frames, self.frame_bytes, self.latencies_ms, self.protocol_errors = 0, 0, [], 0
+
+    def snapshot(self):
+        with self.lock:
+            return {"url": self.url, "connected": self.connected, "frames": self.frames,
+                    "frame_bytes": self.frame_bytes, "latencies_ms": list(self.latencies_ms),
+                    "protocol_errors": self.protocol_errors}
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_viewers(urls, count, offset, kbps, duration, results):
+    """Worker process: `count` viewers (the i-th on urls[(offset + i) % len(urls)]) for `duration` seconds."""
+    viewers = [Viewer(urls[(offset + i) % len(urls)], kbps) for i in range(count)]
+    time.sleep(WARMUP_SECONDS)
+    for viewer in viewers:
+        viewer.reset()
+    time.sleep(duration)
+    results.put([viewer.snapshot() for viewer in viewers])
+    closers = [threading.Thread(target=viewer.close, daemon=True) for viewer in viewers]
+    for closer in closers:
+        closer.start()
+    for closer in closers:
+        closer.join(CONNECT_TIMEOUT_SECONDS)
+
+
+# --- Server Control ---
+def server_target_fps(url):
+    try:
+        with urllib.request.urlopen(f"{url}/api/pipeline/backends", timeout=3) as response:
+            return json.load(response).get("target_fps")
+    except Exception:
+        return None  # fanout workers only serve /snapshot
+
+
+def set_quality(url, level):
+    """Asks the server for a quality tier (low/medium/high) the way the frontend does; returns the JPEG quality."""
+    done = threading.Event()
+    applied = {}
+
+    def on_quality_updated(data):
+        applied.update(data or {})
+        done.set()
+
+    connection = SocketIOConnection(url, {"quality_updated": on_quality_updated})  # Joins the room: frames too
+    try:
+        connection.emit("quality_adjustment", {"level": level})
+        done.wait(QUALITY_ACK_TIMEOUT_SECONDS)
+    finally:
+        connection.close()
+    return applied.get("quality_value")
+
+
+# --- Sweep ---
+def run_step(urls, clients, kbps, duration, processes):
+    """Runs one load step and returns its summary (per-viewer snapshots are pooled)."""
+    results = multiprocessing.Queue()
+    processes = max(1, min(processes, clients))
+    shares = [clients // processes + (1 if i < clients % processes else 0) for i in range(processes)]
+    workers, offset = [], 0
+    for share in shares:
+        worker = multiprocessing.Process(target=run_viewers, args=(urls, share, offset, kbps, duration, results),
+                                         daemon=True)
+        worker.start()
+        workers.append(worker)
+        offset += share
+    viewers = []
+    deadline = time.time() + WARMUP_SECONDS + duration + CONNECT_TIMEOUT_SECONDS * (clients // processes + 2)
+    for _ in workers:
+        viewers += results.get(timeout=max(1.0, deadline - time.time()))
+    for worker in workers:
+        worker.join(CONNECT_TIMEOUT_SECONDS)
+
+    connected = [v for v in viewers if v["connected"]]
+    target_fps = [server_target_fps(url) for url in urls]
+    expected_fps = min(fps for fps in target_fps if fps) if any(target_fps) else None
+    best_fps = max((v["frames"] / duration for v in connected), default=0)
+    expected_fps = expected_fps or best_fps
+    rates = np.array([v["frames"] / duration for v in connected]) if connected else np.zeros(0)
+    drops = np.clip(1 - rates / expected_fps, 0, 1) if expected_fps else np.zeros(0)
+    latencies = np.array([ms for v in connected for ms in v["latencies_ms"]])
+    summary = {
+        "clients": clients, "connected": len(connected), "cameras": len(urls), "kbps": kbps,
+        "expected_fps": expected_fps,
+        "received_fps_mean": round(float(rates.mean()), 2) if rates.size else 0.0,
+        "received_fps_min": round(float(rates.min()), 2) if rates.size else 0.0,
+        "drop_rate_mean": round(float(drops.mean()), 4) if drops.size else None,
+        "drop_rate_p95": round(float(np.percentile(drops, 95)), 4) if drops.size else None,
+        "throughput_mbps": round(sum(v["frame_bytes"] for v in connected) * 8 / duration / 1e6, 2),
+        "protocol_errors": sum(v["protocol_errors"] for v in connected),
+    }
+    if latencies.size:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary.update(latency_p50_ms=round(float(p50), 1), latency_p95_ms=round(float(p95), 1),
+                       latency_p99_ms=round(float(p99), 1), latency_max_ms=round(float(latencies.max()), 1))
+    return summary
+
+
+def plot(steps, path):
+    """Received fps, drop rate and p95 latency against client count, one line per quality x cameras."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("[loadtest] matplotlib is not installed; skipping the plot.")
+        return
+    series = {}
+    for step in steps:
+        series.setdefault((step["quality"], step["cameras"]), []).append(step)
+    figure, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    for (quality, cameras), points in sorted(series.items(), key=lambda item: str(item[0])):
+        points.sort(key=lambda step: step["clients"])
+        x = [step["clients"] for step in points]
+        label = f"{quality}, {cameras} cam"
+        axes[0].plot(x, [step["received_fps_mean"] for step in points], marker="o", label=label)
+        axes[1].plot(x, [step["drop_rate_mean"] or 0 for step in points], marker="o", label=label)
+        axes[2].plot(x, [step.get("latency_p95_ms") for step in points], marker="o", label=label)
+    for axis, title in zip(axes, ("Received FPS per viewer", "Drop rate", "Glass-to-glass p95 (ms)")):
+        axis.set_title(title)
+        axis.set_xlabel("Viewers")
+        axis.grid(True, alpha=0.3)
+    axes[0].legend()
+    figure.tight_layout()
+    figure.savefig(path)
+    print(f"[loadtest] Plot written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many Socket.IO viewers against a running server.")
+    parser.add_argument("--url", action="append", help="Server URL, once per camera (default http://127.0.0.1:5000)")
+    parser.add_argument("--clients", default="1,10,50")
+    parser.add_argument("--qualities", default="medium", help="Quality tiers to sweep (low,medium,high)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per step")
+    parser.add_argument("--kbps", type=float, default=None, help="Per-viewer bandwidth limit")
+    parser.add_argument("--processes", type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    parser.add_argument("--output", default="loadtest-results.json")
+    parser.add_argument("--plot", default=None, help="PNG path for the scaling plot (needs matplotlib)")
+    args = parser.parse_args()
+
+    urls = [url.rstrip("/") for url in (args.url or ["http://127.0.0.1:5000"])]
+    client_counts = [int(c) for c in args.clients.split(",") if c]
+    qualities = [q for q in args.qualities.split(",") if q]
+
+    steps = []
+    for cameras in range(1, len(urls) + 1):
+        for quality in qualities:
+            applied = [set_quality(url, quality) for url in urls[:cameras]]
+            for clients in client_counts:
+                print(f"[loadtest] {clients} viewer(s), quality {quality} ({applied}), {cameras} camera(s)...")
+                step = {"quality": quality, "jpeg_quality": applied,
+                        **run_step(urls[:cameras], clients, args.kbps, args.duration, args.processes)}
+                steps.append(step)
+                print(f"[loadtest]   {step['connected']}/{clients} connected, {step['received_fps_mean']} fps "
+                      f"(min {step['received_fps_min']}), drop {step['drop_rate_mean']}, "
+                      f"p50/p95/p99 {step.get('latency_p50_ms')}/{step.get('latency_p95_ms')}/"
+                      f"{step.get('latency_p99_ms')} ms, {step['throughput_mbps']} Mbit/s, "
+                      f"{step['protocol_errors']} unparseable message(s)")
+
+    with open(args.output, "w") as f:
+        json.dump({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "steps": steps}, f, indent=2)
+    print(f"[loadtest] Wrote {len(steps)} steps to {args.output}")
+    if args.plot:
+        plot(steps, args.plot)
+
+
+if __name__ == "__main__":
+    main()
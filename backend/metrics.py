@@ -0,0 +1,129 @@
+# backend/metrics.py
+"""
+Pipeline instrumentation in the Prometheus text format (served on /metrics).
+
+Stage code records into Counter/Histogram objects it looks up once, before its
+loop. Every series has a single writer (the thread that owns the stage, as in
+camera_channel.py), so recording is a bisect plus a couple of adds with no
+lock; a scrape reads the numbers as they are and can at worst see a count one
+observation ahead of its sum.
+
+Values that already live elsewhere (FPS, reconnect counts, queue depths) are
+not copied on every frame: collectors registered with register_collector()
+read them when /metrics is scraped.
+"""
+from bisect import bisect_left
+
+# Seconds; spans a fast JPEG encode to a stalled read
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are kept per bucket and made cumulative on scrape."""
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+# --- Registry ---
+# name -> {"type", "help", "series": {label tuple: metric}}, in registration order
+_families = {}
+_collectors = []
+
+
+def _series(name, kind, help_text, labels, factory):
+    family = _families.setdefault(name, {"type": kind, "help": help_text, "series": {}})
+    key = tuple(sorted(labels.items()))
+    metric = family["series"].get(key)
+    if metric is None:
+        metric = family["series"][key] = factory()
+    return metric
+
+
+def counter(name, help_text, **labels):
+    """Returns the counter for `name` with these labels, creating it on first use."""
+    return _series(name, "counter", help_text, labels, Counter)
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS, **labels):
+    """Returns the histogram for `name` with these labels, creating it on first use."""
+    return _series(name, "histogram", help_text, labels, lambda: Histogram(buckets))
+
+
+def stage_histogram(camera_name, stage):
+    """Per-stage latency (read, decode, inference, encode, emit) for one camera."""
+    return histogram("pipeline_stage_seconds", "Time spent in each pipeline stage per frame.",
+                     camera=camera_name, stage=stage)
+
+
+def register_collector(collect):
+    """Adds a scrape-time callback returning [(name, type, help, [(labels dict, value), ...]), ...]."""
+    _collectors.append(collect)
+
+
+# --- Exposition ---
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Returns every registered and collected series as Prometheus text exposition (format 0.0.4)."""
+    lines = []
+    for name, family in list(_families.items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, metric in list(family["series"].items()):
+            if family["type"] == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.bounds + (float("inf"),), list(metric.counts)):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(metric.sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(metric.value)}")
+
+    for collect in list(_collectors):
+        try:
+            collected = collect()
+        except Exception as e:
+            print(f"[metrics] Collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, kind, help_text, samples in collected:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,380 @@
+# backend/passthrough.py
+"""
+H.264 passthrough relay.
+
+Remuxes the camera's RTSP H.264 stream with `ffmpeg -c:v copy` (no decode, no
+re-encode) and fans the result out to any number of HTTP clients, either as
+fragmented MP4 (playable through Media Source Extensions) or as raw Annex-B.
+One ffmpeg process runs per camera/format, no matter how many clients watch.
+"""
+import queue
+import struct
+import subprocess
+import threading
+import time
+
+from config import FFMPEG_PATH, PASSTHROUGH_CLIENT_QUEUE_SIZE
+
+# --- Constants ---
+FORMAT_FMP4 = "mp4"
+FORMAT_ANNEXB = "h264"
+SUPPORTED_FORMATS = (FORMAT_FMP4, FORMAT_ANNEXB)
+
+MIMETYPES = {
+    FORMAT_FMP4: 'video/mp4; codecs="avc1.640028"',
+    FORMAT_ANNEXB: "video/h264",
+}
+
+READ_CHUNK_SIZE = 64 * 1024
+RESTART_DELAY_SECONDS = 2.0
+
+# H.264 NAL unit types we care about
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+# fMP4 sample flag: sample_is_non_sync_sample
+SAMPLE_FLAG_NON_SYNC = 0x00010000
+
+
+def build_ffmpeg_command(url, fmt):
+    """Returns the ffmpeg argv that remuxes `url` into `fmt` on stdout."""
+    cmd = [
+        FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+        "-rtsp_transport", "tcp",
+        "-fflags", "nobuffer", "-flags", "low_delay",
+        "-i", url,
+        "-an", "-c:v", "copy",
+    ]
+    if fmt == FORMAT_FMP4:
+        # One fragment per keyframe, plus short fragments in between so latency
+        # stays well below one GOP. empty_moov puts the init segment up front.
+        cmd += [
+            "-f", "mp4",
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-frag_duration", "200000",
+        ]
+    else:
+        cmd += ["-bsf:v", "h264_mp4toannexb", "-f", "h264"]
+    cmd += ["-flush_packets", "1", "pipe:1"]
+    return cmd
+
+
+# --- fMP4 Box Parsing ---
+def _iter_boxes(data, offset=0, end=None):
+    """Yields (type, start, size) for every ISO-BMFF box in data[offset:end]."""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield box_type, offset, size
+        offset += size
+
+
+def _fragment_starts_with_sync_sample(moof):
+    """True when the first sample of a moof fragment is a keyframe."""
+    for box_type, start, size in _iter_boxes(moof, 8):
+        if box_type != b"traf":
+            continue
+        default_flags = None
+        for sub_type, sub_start, sub_size in _iter_boxes(moof, start + 8, start + size):
+            body = sub_start + 8
+            version_flags = struct.unpack_from(">I", moof, body)[0]
+            flags = version_flags & 0xFFFFFF
+            if sub_type == b"tfhd":
+                pos = body + 8  # version/flags + track_ID
+                if flags & 0x01: pos += 8  # base_data_offset
+                if flags & 0x02: pos += 4  # sample_description_index
+                if flags & 0x08: pos += 4  # default_sample_duration
+                if flags & 0x10: pos += 4  # default_sample_size
+                if flags & 0x20:
+                    default_flags = struct.unpack_from(">I", moof, pos)[0]
+            elif sub_type == b"trun":
+                pos = body + 8  # version/flags + sample_count
+                if flags & 0x01: pos += 4  # data_offset
+                if flags & 0x04:
+                    first_flags = struct.unpack_from(">I", moof, pos)[0]
+                    return not first_flags & SAMPLE_FLAG_NON_SYNC
+                if flags & 0x400:
+                    if flags & 0x100: pos += 4  # sample_duration
+                    if flags & 0x200: pos += 4  # sample_size
+                    first_flags = struct.unpack_from(">I", moof, pos)[0]
+                    return not first_flags & SAMPLE_FLAG_NON_SYNC
+                if default_flags is not None:
+                    return not default_flags & SAMPLE_FLAG_NON_SYNC
+                return True  # No flags at all: every sample is a sync sample
+    return False
+
+
+class _FMP4Splitter:
+    """Splits an fMP4 byte stream into the init segment and moof+mdat fragments."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.init_segment = None
+        self._pending_moof = None
+
+    def feed(self, chunk):
+        """Consumes bytes and returns a list of (payload, is_keyframe) fragments."""
+        self.buffer += chunk
+        fragments = []
+        offset = 0
+        init_parts = []
+        for box_type, start, size in _iter_boxes(self.buffer):
+            box = bytes(self.buffer[start:start + size])
+            offset = start + size
+            if box_type in (b"ftyp", b"moov"):
+                init_parts.append(box)
+                if box_type == b"moov":
+                    self.init_segment = b"".join(init_parts)
+                    init_parts = []
+            elif box_type == b"moof":
+                self._pending_moof = box
+            elif box_type == b"mdat" and self._pending_moof is not None:
+                moof = self._pending_moof
+                self._pending_moof = None
+                fragments.append((moof + box, _fragment_starts_with_sync_sample(moof)))
+        if init_parts:
+            # ftyp seen without its moov yet; keep it in the buffer
+            offset -= sum(len(p) for p in init_parts)
+        del self.buffer[:offset]
+        return fragments
+
+
+class _AnnexBSplitter:
+    """Splits an Annex-B byte stream into NAL units, tracking SPS/PPS."""
+
+    START_CODE = b"\x00\x00\x01"
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.sps = None
+        self.pps = None
+
+    def feed(self, chunk):
+        """Consumes bytes and returns a list of (nal_with_start_code, is_idr) units."""
+        self.buffer += chunk
+        units = []
+        first = self.buffer.find(self.START_CODE)
+        if first < 0:
+            return units
+        while True:
+            nxt = self.buffer.find(self.START_CODE, first + 3)
+            if nxt < 0:
+                break
+            # A 4-byte start code leaves a trailing zero on the previous unit
+            end = nxt - 1 if self.buffer[nxt - 1] == 0 else nxt
+            nal = b"\x00\x00\x00\x01" + bytes(self.buffer[first + 3:end])
+            first = nxt
+            if len(nal) <= 4:
+                continue
+            nal_type = nal[4] & 0x1F
+            if nal_type == NAL_SPS:
+                self.sps = nal
+            elif nal_type == NAL_PPS:
+                self.pps = nal
+            units.append((nal, nal_type == NAL_IDR))
+        del self.buffer[:first]
+        return units
+
+
+# --- Relay ---
+class PassthroughRelay:
+    """One ffmpeg remux process per camera/format, fanned out to subscribers."""
+
+    def __init__(self, camera_name, url, fmt):
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported passthrough format: {fmt}")
+        self.camera_name = camera_name
+        self.url = url
+        self.fmt = fmt
+        self.name = f"{camera_name}_passthrough_{fmt}"
+        self.lock = threading.Lock()
+        self.subscribers = {}  # queue -> {"synced": bool}
+        self.splitter = None
+        self.process = None
+        self.thread = None
+        self.active = False
+        self.generation = 0  # Bumped on every (re)start so stale reader threads exit
+        self.init_sent = False
+
+    # --- Subscriber Management ---
+    def subscribe(self):
+        """Registers a client and returns its bounded chunk queue."""
+        q = queue.Queue(maxsize=PASSTHROUGH_CLIENT_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[q] = {"synced": False}
+            if self.fmt == FORMAT_FMP4 and self.init_sent:
+                q.put_nowait(self.splitter.init_segment)
+            if not self.active:
+                self._start()
+        print(f"[{self.name}] Client subscribed ({len(self.subscribers)} total).")
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.pop(q, None)
+            remaining = len(self.subscribers)
+            if remaining == 0:
+                self._stop()
+        print(f"[{self.name}] Client unsubscribed ({remaining} remaining).")
+
+    def _deliver(self, payload, is_sync, splitter, generation):
+        """Pushes a unit to every subscriber, resyncing clients that fall behind."""
+        with self.lock:
+            if not self._running(generation):
+                return  # A stale reader still draining its ffmpeg; the new generation owns the clients
+            for q, sub in self.subscribers.items():
+                if not sub["synced"]:
+                    if not is_sync:
+                        continue
+                    sub["synced"] = True
+                    if self.fmt == FORMAT_ANNEXB and splitter.sps and splitter.pps:
+                        payload_out = splitter.sps + splitter.pps + payload
+                    else:
+                        payload_out = payload
+                else:
+                    payload_out = payload
+                try:
+                    q.put_nowait(payload_out)
+                except queue.Full:
+                    # Can't drop single units from a GOP; flush and wait for the next keyframe
+                    with q.mutex:
+                        q.queue.clear()
+                    sub["synced"] = False
+
+    # --- ffmpeg Process ---
+    def _start(self):
+        self.active = True
+        self.generation += 1
+        self.process = None
+        self.splitter = None
+        self.init_sent = False
+        self.thread = threading.Thread(target=self._reader_loop, args=(self.generation,), daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        """Stops the current generation (called with the lock held); only its own ffmpeg is terminated."""
+        self.active = False
+        proc, self.process = self.process, None
+        if proc and proc.poll() is None:
+            try: proc.terminate()
+            except Exception: pass
+
+    def _running(self, generation):
+        return self.active and self.generation == generation
+
+    def _reader_loop(self, generation):
+        # The process and splitter belong to this generation; after a quick unsubscribe/resubscribe
+        # a newer reader has its own, and this one only ever touches (and kills) what it started
+        print(f"[{self.name}] Relay starting...")
+        while self._running(generation):
+            splitter = _FMP4Splitter() if self.fmt == FORMAT_FMP4 else _AnnexBSplitter()
+            try:
+                process = subprocess.Popen(
+                    build_ffmpeg_command(self.url, self.fmt),
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+                )
+            except OSError as e:
+                print(f"[{self.name}] Failed to start ffmpeg ({FFMPEG_PATH}): {e}")
+                time.sleep(RESTART_DELAY_SECONDS)
+                continue
+
+            with self.lock:
+                if not self._running(generation):
+                    process.kill()  # Stopped while ffmpeg was starting
+                    process.wait()
+                    break
+                self.process = process
+                self.splitter = splitter
+                self.init_sent = False
+                for sub in self.subscribers.values():
+                    sub["synced"] = False
+
+            stdout = process.stdout
+            while self._running(generation):
+                chunk = stdout.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for payload, is_sync in splitter.feed(chunk):
+                    self._deliver(payload, is_sync, splitter, generation)
+                if self.fmt == FORMAT_FMP4 and not self.init_sent and splitter.init_segment:
+                    # Clients that subscribed before ffmpeg produced the moov
+                    with self.lock:
+                        if self._running(generation):
+                            for q in self.subscribers:
+                                try: q.put_nowait(splitter.init_segment)
+                                except queue.Full: pass
+                            self.init_sent = True
+
+            try: process.kill()
+            except Exception: pass
+            process.wait()
+            with self.lock:
+                if self.process is process:
+                    self.process = None
+            if self._running(generation):
+                print(f"[{self.name}] ffmpeg exited, restarting in {RESTART_DELAY_SECONDS}s...")
+                time.sleep(RESTART_DELAY_SECONDS)
+        print(f"[{self.name}] Relay stopped.")
+
+
+# --- Registry ---
+_relays = {}
+_relays_lock = threading.Lock()
+
+
+def get_relay(camera_name, url, fmt):
+    """Returns the shared relay for a camera/format, creating it on first use."""
+    key = (camera_name, fmt)
+    with _relays_lock:
+        relay = _relays.get(key)
+        if relay is None:
+            relay = PassthroughRelay(camera_name, url, fmt)
+            _relays[key] = relay
+        return relay
+
+
+def stream_passthrough(camera_name, url, fmt):
+    """Generator yielding remuxed video bytes for one HTTP client."""
+    relay = get_relay(camera_name, url, fmt)
+    q = relay.subscribe()
+    try:
+        while True:
+            try:
+                yield q.get(timeout=5.0)
+            except queue.Empty:
+                continue
+    except GeneratorExit:
+        pass
+    finally:
+        relay.unsubscribe(q)
+
+
+def queue_depths():
+    """Returns {(camera_name, fmt): [queued units per subscriber]} for every relay (for /metrics)."""
+    with _relays_lock:
+        relays = list(_relays.values())
+    depths = {}
+    for relay in relays:
+        with relay.lock:
+            depths[(relay.camera_name, relay.fmt)] = [q.qsize() for q in relay.subscribers]
+    return depths
+
+
+def stop_all():
+    """Stops every running relay (used on shutdown)."""
+    with _relays_lock:
+        relays = list(_relays.values())
+    for relay in relays:
+        with relay.lock:
+            relay._stop()
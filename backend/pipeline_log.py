@@ -0,0 +1,175 @@
+# backend/pipeline_log.py
+"""
+Non-blocking, rate-limited logging for the frame path.
+
+The capture and emitter threads log through a QueueHandler: a call formats
+the record and puts it on an in-memory queue, and a QueueListener thread does
+the stdout/file writes. A full queue drops the record (counted) instead of
+waiting, so a slow terminal or disk can never stall a frame.
+
+Each message has a key (by default its format string, which already names the
+camera). A key may log LOG_RATE_LIMIT times per LOG_RATE_WINDOW_SECONDS; the
+rest are counted, and a summary thread reports how many were suppressed every
+window, so a camera flap prints a handful of lines per window
+instead of hundreds per second. Counts per key are exported on /metrics.
+
+    log = pipeline_log.get_logger(camera_name)
+    log.warning("Frame read failed (attempt %d/%d).", attempt, limit, key="read_failed")
+
+Messages come out as "[camera] text" like the rest of the server's output,
+or as JSON lines with LOG_FORMAT=json.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_WINDOW_SECONDS
+
+LOGGER_NAME = "pipeline"
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets LOG_RATE_LIMIT records per key through each window and counts the rest."""
+
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW_SECONDS):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()  # Held for a dict update only, never around I/O
+        self.windows = {}  # (camera, key) -> [window start, records let through, records suppressed]
+        self.totals = {}  # (camera, key) -> [logged, suppressed]
+
+    def filter(self, record):
+        record.key = getattr(record, "key", None) or record.msg
+        key = (getattr(record, "camera", None), record.key)
+        now = time.monotonic()
+        with self.lock:
+            totals = self.totals.setdefault(key, [0, 0])
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.window:
+                window = self.windows[key] = [now, 0, window[2] if window else 0]  # Unreported count carries over
+            if window[1] < self.limit:
+                window[1] += 1
+                totals[0] += 1
+                return True
+            window[2] += 1
+            totals[1] += 1
+            return False
+
+    def take_suppressed(self):
+        """Returns [(camera, key, suppressed count)] since the last call, and resets those counts."""
+        report = []
+        with self.lock:
+            for (camera, key), window in self.windows.items():
+                if window[2]:
+                    report.append((camera, key, window[2]))
+                    window[2] = 0
+        return report
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full instead of raising."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": round(record.created, 3), "level": record.levelname, "camera": getattr(record, "camera", None),
+                 "key": getattr(record, "key", None), "message": record.getMessage(), "thread": record.threadName}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class CameraLogger(logging.LoggerAdapter):
+    """Prefixes messages with [camera] and passes key= through as a record attribute."""
+
+    def process(self, msg, kwargs):
+        camera = self.extra["camera"]
+        kwargs["extra"] = {"camera": camera, "key": kwargs.pop("key", None) or msg}  # Key on the unprefixed text
+        return (f"[{camera}] {msg}" if camera else msg), kwargs
+
+
+# --- Setup (on first get_logger) ---
+_lock = threading.Lock()
+_handler = None
+_listener = None
+_rate_limit = None
+
+
+def _setup():
+    global _handler, _listener, _rate_limit
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("%(message)s")
+    outputs = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        outputs.append(logging.FileHandler(LOG_FILE))
+    for output in outputs:
+        output.setFormatter(formatter)
+
+    _rate_limit = RateLimitFilter()
+    _handler = DroppingQueueHandler(log_queue)
+    _handler.addFilter(_rate_limit)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(_handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *outputs, respect_handler_level=False)
+    _listener.start()
+    threading.Thread(target=_report_suppressed, name="log-summary", daemon=True).start()
+    atexit.register(stop)
+
+
+def _report_suppressed():
+    logger = logging.getLogger(LOGGER_NAME)
+    while True:
+        time.sleep(_rate_limit.window)
+        for camera, key, count in _rate_limit.take_suppressed():
+            # Goes straight to the handler, past the filter, so summaries are never suppressed themselves
+            prefix = f"[{camera}] " if camera else ""
+            record = logger.makeRecord(LOGGER_NAME, logging.INFO, __file__, 0,
+                                       f"{prefix}Suppressed %d '%s' message(s) in the last %.0fs.",
+                                       (count, key, _rate_limit.window), None,
+                                       extra={"camera": camera, "key": "log_suppressed"})
+            _handler.enqueue(_handler.prepare(record))
+
+
+def get_logger(camera=None):
+    """Returns a logger for one camera (or the server when camera is None)."""
+    with _lock:
+        if _handler is None:
+            _setup()
+    return CameraLogger(logging.getLogger(LOGGER_NAME), {"camera": camera})
+
+
+def stop():
+    """Flushes queued records (call before os._exit, which skips atexit)."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def counters():
+    """{(camera, key): (logged, suppressed)} since startup, and the number of records dropped on a full queue."""
+    if _rate_limit is None:
+        return {}, 0
+    with _rate_limit.lock:
+        totals = {key: tuple(value) for key, value in _rate_limit.totals.items()}
+    return totals, _handler.dropped
@@ -0,0 +1,144 @@
+# backend/profiler.py
+"""
+On-demand sampling profiler for a running server.
+
+profile() samples every thread's Python stack with sys._current_frames() at a
+fixed interval for a bounded number of seconds. Nothing is instrumented and
+nothing runs between requests, so the only cost is the sampling thread while a
+profile is in progress (about 1% of a core at the default 10ms interval).
+
+Stacks come back in the collapsed format ("process;thread;outer;...;inner N"),
+ready for flamegraph.pl, speedscope or inferno. With memory=True the run is
+wrapped in tracemalloc and the allocation sites that grew most are reported
+too; tracemalloc slows allocation-heavy code while it runs, so it is opt-in.
+
+Served by app.py (/api/debug/profile, this process only) and by the fan-out
+workers, which ask every publisher and worker process over the bus and merge
+the answers.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from config import ADMIN_TOKEN, PROFILE_MAX_SECONDS, PROFILE_INTERVAL_MS
+
+# Frames kept per tracemalloc allocation (more = slower, but groups by caller)
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 25
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1", "localhost")
+
+# One profile at a time per process (tracemalloc and the sample rate are process-wide)
+_busy = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def admin_allowed(remote_addr, token):
+    """ADMIN_TOKEN set: the token (X-Admin-Token header) must match. Unset: only loopback clients may profile."""
+    if ADMIN_TOKEN:
+        return hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode())  # Constant time
+    return remote_addr in LOOPBACK_ADDRESSES
+
+
+def parse_request(args):
+    """Reads seconds / interval_ms / memory from query args (a dict-like); raises ValueError if invalid."""
+    seconds = float(args.get("seconds", 5))
+    interval_ms = float(args.get("interval_ms", PROFILE_INTERVAL_MS))
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SECONDS}]")
+    if not 1 <= interval_ms <= 1000:
+        raise ValueError("interval_ms must be in [1, 1000]")
+    memory = str(args.get("memory", "0")).lower() in ("1", "true", "yes")
+    return seconds, interval_ms / 1000.0, memory
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def profile(seconds, interval=PROFILE_INTERVAL_MS / 1000.0, memory=False, process_name=None):
+    """Samples all threads of this process for `seconds`. Raises ProfilerBusy if one is already running.
+
+    Returns {"process", "pid", "seconds", "samples", "stacks": {collapsed stack: count}, "memory"}.
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running in this process.")
+    process_name = process_name or f"pid-{os.getpid()}"
+    started_tracemalloc = False
+    try:
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            started_tracemalloc = True
+        baseline = tracemalloc.take_snapshot() if memory else None
+
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                labels.append(process_name)
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        return {
+            "process": process_name,
+            "pid": os.getpid(),
+            "seconds": seconds,
+            "samples": samples,
+            "stacks": dict(stacks),
+            "memory": _memory_report(baseline) if memory else None,
+        }
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _busy.release()
+
+
+def _memory_report(baseline):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    top = snapshot.compare_to(baseline, "lineno")[:TOP_ALLOCATIONS]
+    return {
+        "traced_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "top_growth": [
+            {"site": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1),
+             "size_diff_kb": round(stat.size_diff / 1024, 1), "count_diff": stat.count_diff}
+            for stat in top
+        ],
+    }
+
+
+# --- Output ---
+def merge(results):
+    """Combines per-process results into one (stacks already start with the process name)."""
+    stacks = Counter()
+    for result in results:
+        stacks.update(result["stacks"])
+    return {
+        "processes": [{key: result[key] for key in ("process", "pid", "samples")} for result in results],
+        "stacks": dict(stacks),
+        "memory": {result["process"]: result["memory"] for result in results if result.get("memory")},
+    }
+
+
+def collapsed_text(stacks):
+    """Brendan Gregg's collapsed stack format, heaviest stacks first."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
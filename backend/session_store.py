@@ -0,0 +1,358 @@
+# backend/session_store.py
+"""
+Workout session store: SQLite behind a write-behind queue.
+
+/api/workout/track appends the row to an in-memory queue and returns; one
+writer thread drains the queue and inserts whatever has piled up (up to
+SESSION_BATCH_SIZE rows, waiting at most SESSION_FLUSH_MS for more) in a single
+transaction. The database runs in WAL mode, so history reads on other
+connections never wait for the writer and a commit is one sequential append to
+the log. With synchronous=NORMAL a power cut can lose the last commits but
+never corrupts the file.
+
+Rows are indexed by (user_id, recorded_at), (session_id, recorded_at) and
+recorded_at, which covers every history query the API makes. History pages
+use keyset pagination: the cursor is the (recorded_at, id) of the last row
+returned and the next page starts strictly after it, so page N costs the same
+as page 1 (no OFFSET scan). Exports walk the same keys in short batches, each
+its own read transaction, so a long export holds neither the whole result in
+memory nor a snapshot that stops WAL checkpoints.
+
+A full queue (the disk can't keep up) raises StoreBusy rather than blocking the
+request or dropping the row; stop() writes out whatever is still queued.
+"""
+import csv
+import io
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+from config import SESSION_DB_PATH, SESSION_BATCH_SIZE, SESSION_FLUSH_MS, SESSION_QUEUE_SIZE
+
+DEFAULT_USER = "local"
+MAX_HISTORY_ROWS = 1000
+MAX_REP_COUNT = 1000000
+MAX_TEXT_LENGTH = 128
+EXPORT_BATCH_ROWS = 1000
+CSV_FIELDS = ("id", "userId", "sessionId", "timestamp", "exerciseType", "pushUps", "sitUps", "heartRate")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workout_sessions (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    exercise_type TEXT,
+    push_ups INTEGER,
+    sit_ups INTEGER,
+    heart_rate REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_time ON workout_sessions (user_id, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_session_time ON workout_sessions (session_id, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_time ON workout_sessions (recorded_at);
+"""
+
+INSERT = """
+INSERT INTO workout_sessions (user_id, session_id, recorded_at, exercise_type, push_ups, sit_ups, heart_rate, data)
+VALUES (:user_id, :session_id, :recorded_at, :exercise_type, :push_ups, :sit_ups, :heart_rate, :data)
+"""
+
+COLUMNS = ("id", "user_id", "session_id", "recorded_at", "exercise_type", "push_ups", "sit_ups", "heart_rate", "data")
+
+_STOP = object()
+
+
+class StoreBusy(RuntimeError):
+    pass
+
+
+def connect(path):
+    """Opens a connection with the store's pragmas (WAL is persistent; the others are per connection)."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class SessionStore:
+    """Single writer thread, one read connection per reading thread."""
+
+    def __init__(self, path=SESSION_DB_PATH, batch_size=SESSION_BATCH_SIZE, flush_ms=SESSION_FLUSH_MS,
+                 queue_size=SESSION_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(path) as conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.local = threading.local()
+        self.rows_written = metrics.counter("session_store_rows_written_total", "Workout rows committed to SQLite.")
+        self.rows_rejected = metrics.counter("session_store_rows_rejected_total",
+                                             "Workout rows refused because the write queue was full.")
+        self.rows_failed = metrics.counter("session_store_rows_failed_total",
+                                           "Workout rows SQLite refused, even when written on their own.")
+        self.batch_seconds = metrics.histogram("session_store_batch_seconds", "Time to insert and commit one batch.")
+        self.writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self.writer.start()
+        print(f"[sessions] Store ready at {path} (WAL, batches of up to {batch_size})")
+
+    # --- Writes ---
+    def append(self, row):
+        """Queues one row (see track_row()) for the writer. Raises StoreBusy if the queue is full."""
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.rows_rejected.inc()
+            raise StoreBusy("Session store write queue is full.")
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        start = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(INSERT, batch)
+            self.rows_written.inc(len(batch))
+        except sqlite3.Error as e:
+            # Retry row by row so one bad row can't take the rest of the batch down with it
+            print(f"[sessions] WARNING: Batch of {len(batch)} row(s) failed ({e}); retrying rows one at a time.")
+            for row in batch:
+                try:
+                    with conn:
+                        conn.execute(INSERT, row)
+                    self.rows_written.inc()
+                except sqlite3.Error as e:
+                    self.rows_failed.inc()
+                    print(f"[sessions] ERROR: Could not write row for session {row.get('session_id')!r}: {e}")
+        self.batch_seconds.observe(time.perf_counter() - start)
+
+    def stop(self, timeout=None):
+        """Writes out everything queued so far and stops the writer."""
+        self.queue.put(_STOP)
+        self.writer.join(timeout)
+
+    # --- Reads ---
+    def _reader(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def _page(self, filters, after, newest_first, limit):
+        """One keyset page: rows strictly after the `after` (recorded_at, id) key in the given order."""
+        user_id, session_id, since, until = filters
+        clauses, params = [], []
+        for clause, value in (("user_id = ?", user_id), ("session_id = ?", session_id),
+                              ("recorded_at >= ?", since), ("recorded_at < ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if after is not None:
+            clauses.append("(recorded_at, id) < (?, ?)" if newest_first else "(recorded_at, id) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        direction = "DESC" if newest_first else "ASC"
+        params.append(limit)
+        return self._reader().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM workout_sessions {where} "
+            f"ORDER BY recorded_at {direction}, id {direction} LIMIT ?", params).fetchall()
+
+    def history(self, user_id=None, session_id=None, since=None, until=None, limit=100, cursor=None):
+        """Newest rows first, filtered by user and/or session and a recorded_at range.
+
+        Returns (sessions, next cursor or None). Raises ValueError for a malformed cursor.
+        """
+        limit = max(1, min(MAX_HISTORY_ROWS, int(limit)))
+        after = decode_cursor(cursor) if cursor else None
+        rows = self._page((user_id, session_id, since, until), after, True, limit + 1)
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return [row_to_session(row) for row in rows[:limit]], next_cursor
+
+    def export(self, user_id=None, session_id=None, since=None, until=None, batch_size=EXPORT_BATCH_ROWS):
+        """Yields every matching session, oldest first, reading batch_size rows at a time."""
+        filters = (user_id, session_id, since, until)
+        after = None
+        while True:
+            rows = self._page(filters, after, False, batch_size)
+            for row in rows:
+                yield row_to_session(row)
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1]["recorded_at"], rows[-1]["id"])
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+
+# --- Row Mapping ---
+def _count(value, name):
+    """A rep count as a non-negative int (numeric strings and whole floats are accepted)."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a whole number.")
+    try:
+        number = float(value) if isinstance(value, str) else value
+        if not isinstance(number, (int, float)) or not math.isfinite(number) or number != int(number):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number.")
+    if not 0 <= number <= MAX_REP_COUNT:
+        raise ValueError(f"{name} must be between 0 and {MAX_REP_COUNT}.")
+    return int(number)
+
+
+def _text(value, name, default=None):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise ValueError(f"{name} must be a string.")
+    value = str(value)
+    if len(value) > MAX_TEXT_LENGTH:
+        raise ValueError(f"{name} is longer than {MAX_TEXT_LENGTH} characters.")
+    return value
+
+
+def track_row(data, recorded_at=None):
+    """Turns a /api/workout/track body into a row; the session id is generated when the client sends none.
+
+    Raises ValueError for a body the table can't hold (wrong types, out-of-range counts), so a bad
+    request is refused up front instead of failing in the writer's batch.
+    """
+    count = data.get('count') or {}
+    if not isinstance(count, dict):
+        raise ValueError("count must be an object with pushups and situps.")
+    heart_rate = data.get('heartRate')
+    if isinstance(heart_rate, bool) or not isinstance(heart_rate, (int, float)) or not math.isfinite(heart_rate):
+        heart_rate = None
+    return {
+        "user_id": _text(data.get('userId'), "userId", DEFAULT_USER),
+        "session_id": _text(data.get('sessionId'), "sessionId") or uuid.uuid4().hex,
+        "recorded_at": recorded_at or time.time(),
+        "exercise_type": _text(data.get('exerciseType'), "exerciseType"),
+        "push_ups": _count(count.get('pushups'), "count.pushups"),
+        "sit_ups": _count(count.get('situps'), "count.situps"),
+        "heart_rate": heart_rate,
+        "data": json.dumps({key: value for key, value in data.items() if key != 'landmarks'}),
+    }
+
+
+def encode_cursor(row):
+    return f"{row['recorded_at']!r}_{row['id']}"
+
+
+def decode_cursor(cursor):
+    recorded_at, _, row_id = cursor.partition("_")
+    try:
+        return float(recorded_at), int(row_id)
+    except ValueError:
+        raise ValueError("Malformed cursor.")
+
+
+def row_to_session(row):
+    """The API's session shape (as returned by /api/workout/track) for a stored row."""
+    return {
+        'id': row["id"],
+        'userId': row["user_id"],
+        'sessionId': row["session_id"],
+        'timestamp': row["recorded_at"],
+        'exerciseType': row["exercise_type"],
+        'pushUps': row["push_ups"],
+        'sitUps': row["sit_ups"],
+        'heartRates': [{'bpm': row["heart_rate"], 'timestamp': row["recorded_at"]}] if row["heart_rate"] else [],
+    }
+
+
+# --- Export Formats ---
+def ndjson_lines(sessions, chunk_rows=EXPORT_BATCH_ROWS):
+    """One JSON object per line. Yields a chunk per chunk_rows rows (fewer, larger writes to the socket)."""
+    lines = []
+    for session in sessions:
+        lines.append(json.dumps(session, separators=(",", ":")))
+        if len(lines) == chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_lines(sessions, chunk_rows=EXPORT_BATCH_ROWS):
+    """CSV with a header row; one heart-rate column (the row's sample). Yields a chunk per chunk_rows rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for i, session in enumerate(sessions, 1):
+        heart_rates = session["heartRates"]
+        writer.writerow([session["id"], session["userId"], session["sessionId"], session["timestamp"],
+                         session["exerciseType"], session["pushUps"], session["sitUps"],
+                         heart_rates[0]["bpm"] if heart_rates else None])
+        if i % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", ndjson_lines),
+    "csv": ("text/csv", csv_lines),
+}
+
+
+# --- Shared Store (created on first use) ---
+_lock = threading.Lock()
+_store = None
+
+
+def get_store():
+    global _store
+    with _lock:
+        if _store is None:
+            _store = SessionStore()
+            metrics.register_collector(lambda: [
+                ("session_store_queue_depth", "gauge", "Workout rows waiting for the writer.",
+                 [({}, _store.queue_depth())]),
+            ])
+        return _store
+
+
+def stop(timeout=None):
+    """Flushes and stops the shared store if it was started."""
+    with _lock:
+        store = _store
+    if store is not None:
+        store.stop(timeout)
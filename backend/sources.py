@@ -0,0 +1,200 @@
+# backend/sources.py
+"""
+Camera-free frame sources for benchmarking and regression tests.
+
+RTSP_URL may name one of these instead of a camera:
+
+    file:/path/to/video.mp4          looping video file
+    images:/path/to/dir?fps=30       image sequence (sorted by file name), looping
+    synthetic:1280x720@30            generated frames (noisy gradient, moving box, frame number)
+
+Each accepts ?pacing=realtime|fast (default SOURCE_PACING). realtime delivers
+frames at the source FPS and behaves like a camera (FrameReader drains it);
+fast delivers the next frame as soon as it is asked for, so the rest of the
+pipeline runs flat out.
+
+Sources expose the subset of the cv2.VideoCapture interface the pipeline uses
+(grab/retrieve/read/get/set/isOpened/release), so they plug in as the "source"
+decoder backend and everything downstream is unchanged.
+"""
+import abc
+import os
+import time
+from urllib.parse import urlsplit, parse_qs
+
+from config import SOURCE_PACING
+
+SOURCE_SCHEMES = ("file", "images", "synthetic")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+DEFAULT_SOURCE_FPS = 30.0
+# A realtime source that falls further behind than this (consumer paused) restarts its clock
+MAX_PACING_LAG_SECONDS = 1.0
+
+
+def is_source_url(url):
+    return urlsplit(str(url)).scheme in SOURCE_SCHEMES
+
+
+class PacedSource(abc.ABC):
+    """Shared VideoCapture-style plumbing: frame index, pacing and property reporting.
+
+    Subclasses implement retrieve() (and _advance() when grabbing does real work).
+    """
+
+    def __init__(self, fps, realtime, width, height, frame_count=0):
+        import cv2
+        self.cv2 = cv2
+        self.fps = fps or DEFAULT_SOURCE_FPS
+        self.realtime = realtime
+        self.width, self.height = width, height
+        self.frame_count = frame_count
+        self.index = -1
+        self.clock_start = None
+        self.opened = True
+
+    def _pace(self):
+        """Sleeps until frame `index` is due (realtime pacing only)."""
+        if not self.realtime:
+            return
+        now = time.monotonic()
+        if self.clock_start is None:
+            self.clock_start = now
+        due = self.clock_start + self.index / self.fps
+        if now - due > MAX_PACING_LAG_SECONDS:
+            self.clock_start = now - self.index / self.fps
+        elif due > now:
+            time.sleep(due - now)
+
+    def grab(self):
+        if not self.opened:
+            return False
+        self.index += 1
+        self._pace()
+        return self._advance()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        cv2 = self.cv2
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return max(self.index, 0) * 1000.0 / self.fps
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            # Realtime sources look live (FrameReader grabs ahead); fast ones are read on demand
+            return 0 if self.realtime else self.frame_count
+        return 0
+
+    def set(self, prop, value):
+        return False
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.opened = False
+
+    # Subclasses
+    def _advance(self):
+        return True
+
+    @abc.abstractmethod
+    def retrieve(self):
+        """Returns (ok, frame) for the frame last grabbed, like VideoCapture.retrieve()."""
+
+
+class LoopingFileSource(PacedSource):
+    """A video file that starts over at the end instead of reporting EOF."""
+
+    def __init__(self, path, realtime):
+        import cv2
+        self.cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file {path}")
+        super().__init__(self.cap.get(cv2.CAP_PROP_FPS), realtime,
+                         int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                         frame_count=int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 1)
+
+    def _advance(self):
+        if self.cap.grab():
+            return True
+        self.cap.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.cap.grab()
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageSequenceSource(PacedSource):
+    """Image files from a directory, in name order; each image is decoded only when retrieved."""
+
+    def __init__(self, directory, fps, realtime):
+        import cv2
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.paths:
+            raise IOError(f"No images ({', '.join(IMAGE_EXTENSIONS)}) in {directory}")
+        first = cv2.imread(self.paths[0])
+        if first is None:
+            raise IOError(f"Cannot decode {self.paths[0]}")
+        super().__init__(fps, realtime, first.shape[1], first.shape[0], frame_count=len(self.paths))
+
+    def retrieve(self):
+        frame = self.cv2.imread(self.paths[self.index % len(self.paths)])
+        return frame is not None, frame
+
+
+class SyntheticSource(PacedSource):
+    """Generated frames: a noisy gradient with a moving box and the frame number, so every frame differs."""
+
+    def __init__(self, width, height, fps, realtime):
+        super().__init__(fps, realtime, width, height, frame_count=1)  # Endless; any count marks it non-live
+        import numpy as np
+        gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+        noise = np.random.default_rng(0).integers(0, 32, (height, width, 3), dtype=np.uint8)
+        self.background = self.cv2.add(np.dstack([gradient] * 3), noise)
+        self.box = max(8, min(width, height) // 6)
+
+    def retrieve(self):
+        cv2 = self.cv2
+        frame = self.background.copy()
+        travel = max(1, self.width - self.box)
+        x = (self.index * 8) % (2 * travel)
+        x = x if x < travel else 2 * travel - x  # Bounce back and forth
+        y = (self.height - self.box) // 2
+        cv2.rectangle(frame, (x, y), (x + self.box, y + self.box), (40, 200, 255), -1)
+        cv2.putText(frame, f"#{self.index}", (10, max(20, self.height // 12)), cv2.FONT_HERSHEY_SIMPLEX,
+                    max(0.5, self.height / 720), (255, 255, 255), 2)
+        return True, frame
+
+
+def open_source(url):
+    """Returns a capture-like source for a file:/images:/synthetic: URL (raises ValueError/IOError if invalid)."""
+    parts = urlsplit(url)
+    query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+    pacing = query.get("pacing", SOURCE_PACING)
+    if pacing not in ("realtime", "fast"):
+        raise ValueError(f"Unknown pacing '{pacing}' (use realtime or fast)")
+    realtime = pacing == "realtime"
+    path = parts.netloc + parts.path if parts.netloc else parts.path
+
+    if parts.scheme == "file":
+        return LoopingFileSource(path, realtime)
+    if parts.scheme == "images":
+        return ImageSequenceSource(path, float(query.get("fps", DEFAULT_SOURCE_FPS)), realtime)
+    if parts.scheme == "synthetic":
+        size, _, fps = path.partition("@")
+        width, _, height = size.lower().partition("x")
+        return SyntheticSource(int(width), int(height), float(fps or DEFAULT_SOURCE_FPS), realtime)
+    raise ValueError(f"Not a frame source URL: {url}")
@@ -0,0 +1,158 @@
+# backend/supervisor.py
+"""
+Watchdog for the pipeline's worker threads.
+
+Each stage (capture loop, emitter, ...) runs in a thread started by the
+Supervisor and calls heartbeat.beat() once per loop iteration. A monitor thread
+checks every WATCHDOG_INTERVAL_SECONDS; a stage that misses its deadline (or
+exits on its own) is restarted on its own, leaving the other stages running.
+
+Python threads can't be killed, so a restart retires the stalled thread's
+heartbeat and starts a fresh one: loops run `while ... and heartbeat.current`,
+so if the old thread ever returns from whatever blocked it (an FFmpeg read,
+a hung MediaPipe graph) it exits instead of competing with its replacement.
+Stalled threads are daemons and never block shutdown.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from config import WATCHDOG_ENABLED, WATCHDOG_DEADLINE_SECONDS, WATCHDOG_INTERVAL_SECONDS
+
+
+class Heartbeat:
+    """Liveness token handed to one generation of a stage's thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self.last = time.monotonic()
+        self.first_beat = None
+        self.busy_until = 0.0
+        self.current = True  # False once the supervisor replaced or stopped this generation
+
+    def beat(self):
+        self.last = time.monotonic()
+        if self.first_beat is None:
+            self.first_beat = self.last
+
+    @contextmanager
+    def busy(self, seconds):
+        """Extends the deadline around a call known to block for a while (stream open, model load)."""
+        self.busy_until = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self.busy_until = 0.0
+            self.beat()
+
+    def overdue(self, deadline, now):
+        return now - self.last > deadline and now > self.busy_until
+
+
+# For stage functions called directly, without a supervisor
+UNSUPERVISED = Heartbeat("unsupervised")
+
+
+class Supervisor:
+    """Starts stage threads, restarts the ones that stall, and joins them on shutdown."""
+
+    def __init__(self, deadline=WATCHDOG_DEADLINE_SECONDS, interval=WATCHDOG_INTERVAL_SECONDS):
+        self.deadline = deadline
+        self.interval = interval
+        self.stages = {}
+        self.stopping = threading.Event()
+        self.monitor = None
+
+    def add(self, name, target, args=(), deadline=None, on_restart=None):
+        """Registers target(*args, heartbeat=...) as a stage; started now if the supervisor is running."""
+        stage = {
+            "name": name, "target": target, "args": args,
+            "deadline": deadline or self.deadline, "on_restart": on_restart,
+            "thread": None, "heartbeat": None,
+            "restarts": 0, "restarted_at": None, "last_recovery_ms": None, "last_reason": None,
+        }
+        self.stages[name] = stage
+        if self.monitor is not None:
+            self._spawn(stage)
+
+    def start(self):
+        for stage in self.stages.values():
+            self._spawn(stage)
+        if WATCHDOG_ENABLED:
+            self.monitor = threading.Thread(target=self._monitor, name="watchdog", daemon=True)
+            self.monitor.start()
+            print(f"[watchdog] Supervising {len(self.stages)} stage(s), deadline {self.deadline}s.")
+        else:
+            self.monitor = False  # Started, but nobody restarts stalled stages
+
+    def _spawn(self, stage):
+        heartbeat = Heartbeat(stage["name"])
+        thread = threading.Thread(target=stage["target"], args=stage["args"], kwargs={"heartbeat": heartbeat},
+                                  name=stage["name"], daemon=True)
+        stage["heartbeat"], stage["thread"] = heartbeat, thread
+        thread.start()
+
+    # --- Monitor Thread ---
+    def _monitor(self):
+        while not self.stopping.wait(self.interval):
+            now = time.monotonic()
+            for stage in list(self.stages.values()):
+                heartbeat = stage["heartbeat"]
+                if stage["restarted_at"] is not None and heartbeat.first_beat is not None:
+                    stage["last_recovery_ms"] = (heartbeat.first_beat - stage["restarted_at"]) * 1000.0
+                    stage["restarted_at"] = None
+                    print(f"[watchdog] {stage['name']} recovered: first heartbeat "
+                          f"{stage['last_recovery_ms']:.0f}ms after restart.")
+                if not stage["thread"].is_alive():
+                    self._restart(stage, "thread exited")
+                elif heartbeat.overdue(stage["deadline"], now):
+                    self._restart(stage, f"no heartbeat for {now - heartbeat.last:.1f}s")
+
+    def _restart(self, stage, reason):
+        if self.stopping.is_set():
+            return
+        print(f"[watchdog] {stage['name']} stalled ({reason}), restarting it.")
+        stage["heartbeat"].current = False
+        if stage["on_restart"]:
+            try:
+                stage["on_restart"]()
+            except Exception as e:
+                print(f"[watchdog] on_restart for {stage['name']} failed: {e}")
+        stage["restarts"] += 1
+        stage["last_reason"] = reason
+        stage["restarted_at"] = time.monotonic()
+        self._spawn(stage)
+
+    # --- Status and Shutdown ---
+    def status(self):
+        now = time.monotonic()
+        return {
+            name: {
+                "alive": stage["thread"] is not None and stage["thread"].is_alive(),
+                "heartbeat_age_ms": round((now - stage["heartbeat"].last) * 1000.0, 1) if stage["heartbeat"] else None,
+                "deadline_s": stage["deadline"],
+                "restarts": stage["restarts"],
+                "last_reason": stage["last_reason"],
+                "last_recovery_ms": stage["last_recovery_ms"],
+            }
+            for name, stage in self.stages.items()
+        }
+
+    def stop(self, timeout=3.0):
+        """Retires every stage and joins the threads within `timeout`. Returns the names that didn't exit."""
+        self.stopping.set()
+        for stage in self.stages.values():
+            if stage["heartbeat"]:
+                stage["heartbeat"].current = False
+        end = time.monotonic() + timeout
+        stragglers = []
+        for stage in self.stages.values():
+            thread = stage["thread"]
+            if thread is None or thread is threading.current_thread():
+                continue
+            thread.join(max(0.0, end - time.monotonic()))
+            if thread.is_alive():
+                stragglers.append(stage["name"])
+        if stragglers:
+            print(f"[watchdog] Still running after {timeout}s (abandoned): {', '.join(stragglers)}")
+        return stragglers
@@ -0,0 +1,171 @@
+# backend/tracing.py
+"""
+End-to-end frame tracing: capture -> inference -> encode -> emit -> display.
+
+Frames are identified by their frame packet version. Every TRACE_SAMPLE_EVERY-th
+frame is traced: the capture loop and emitter stamp it with time.monotonic()
+as it passes each stage, and the 'detections' event that follows it carries
+{"frame_id", "capture_mono", "trace": true}. The viewer answers with
+'frame_ack' {frame_id, received, displayed} in its own clock
+(performance.now() milliseconds).
+
+To put those client times on the server clock, the emitter broadcasts 'ping'
+{"server_mono"} every TRACE_PING_SECONDS; viewers echo it in 'pong' with their
+clock reading. The sample with the lowest round trip gives the offset
+(client - server - rtt/2), as in NTP, so capture-to-display latency is
+measured without synchronized clocks. Its error is at most half the RTT.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from config import TRACE_SAMPLE_EVERY, TRACE_BUFFER_SIZE
+
+# Sampled frames waiting for (more) viewer acks; older ones are dropped
+MAX_PENDING_TRACES = 64
+# Clock samples kept per viewer; the lowest-RTT one sets the offset
+CLOCK_SAMPLES = 8
+# Per-viewer latencies kept for the summary percentiles
+CLIENT_HISTORY = 200
+
+# Stage name -> (start stamp, end stamp); consecutive, so they add up to capture-to-display
+STAGES = (
+    ("read", "captured", "read"),
+    ("inference", "read", "inferred"),
+    ("queue", "inferred", "encode_start"),
+    ("encode", "encode_start", "encoded"),
+    ("emit", "encoded", "emitted"),
+    ("network", "emitted", "received"),
+    ("render", "received", "displayed"),
+)
+
+
+class FrameTracer:
+    """Sampled per-frame stage timestamps for one camera, completed by viewer acks."""
+
+    def __init__(self, camera_name, sample_every=TRACE_SAMPLE_EVERY, buffer_size=TRACE_BUFFER_SIZE):
+        self.camera_name = camera_name
+        self.sample_every = sample_every
+        self.lock = threading.Lock()  # Stamps come from the capture, emitter and Socket.IO threads
+        self.pending = OrderedDict()  # frame_id -> {stage: monotonic seconds}
+        self.traces = deque(maxlen=buffer_size)
+        self.clocks = {}  # sid -> deque of (rtt, offset) seconds
+        self.client_latency = {}  # sid -> deque of capture-to-display seconds
+
+    def sampled(self, frame_id):
+        return self.sample_every > 0 and frame_id % self.sample_every == 0
+
+    # --- Pipeline Stamps ---
+    def begin(self, frame_id, **stamps):
+        """Capture thread: starts a trace (call only for sampled frame ids)."""
+        with self.lock:
+            self.pending[frame_id] = stamps
+            while len(self.pending) > MAX_PENDING_TRACES:
+                self.pending.popitem(last=False)
+
+    def mark(self, frame_id, **stamps):
+        """Adds stage stamps to a trace that is still pending (no-op otherwise)."""
+        with self.lock:
+            trace = self.pending.get(frame_id)
+            if trace is not None:
+                trace.update(stamps)
+
+    # --- Viewer Echoes ---
+    def clock_sample(self, sid, server_mono, client_ms):
+        """'pong' handler: records one round trip and the clock offset it implies."""
+        now = time.monotonic()
+        rtt = now - server_mono
+        if rtt < 0:
+            return
+        offset = client_ms / 1000.0 - (server_mono + rtt / 2)
+        with self.lock:
+            self.clocks.setdefault(sid, deque(maxlen=CLOCK_SAMPLES)).append((rtt, offset))
+
+    def _clock(self, sid):
+        samples = self.clocks.get(sid)
+        return min(samples) if samples else None  # (rtt, offset) of the fastest round trip
+
+    def ack(self, sid, frame_id, received_ms, displayed_ms=None):
+        """'frame_ack' handler: completes the viewer's copy of a trace. Returns it, or None."""
+        with self.lock:
+            stamps = self.pending.get(frame_id)
+            clock = self._clock(sid)
+            if stamps is None or clock is None:
+                return None  # Evicted, or no ping answered yet
+            rtt, offset = clock
+            stamps = dict(stamps, received=received_ms / 1000.0 - offset)
+            if displayed_ms is not None:
+                stamps["displayed"] = displayed_ms / 1000.0 - offset
+            trace = self._build(sid, frame_id, stamps, rtt, offset)
+            self.traces.append(trace)
+            if trace["capture_to_display_ms"] is not None:
+                self.client_latency.setdefault(sid, deque(maxlen=CLIENT_HISTORY)).append(
+                    trace["capture_to_display_ms"])
+        return trace
+
+    def forget(self, sid):
+        with self.lock:
+            self.clocks.pop(sid, None)
+            self.client_latency.pop(sid, None)
+
+    def _build(self, sid, frame_id, stamps, rtt, offset):
+        def span(start, end):
+            if start in stamps and end in stamps:
+                return round((stamps[end] - stamps[start]) * 1000.0, 2)
+            return None
+
+        captured = stamps["captured"]
+        return {
+            "camera": self.camera_name,
+            "frame_id": frame_id,
+            "sid": sid,
+            "stages_ms": {name: span(start, end) for name, start, end in STAGES},
+            "decode_ms": round(stamps["decode"] * 1000.0, 2) if "decode" in stamps else None,
+            "capture_to_receive_ms": span("captured", "received"),
+            "capture_to_display_ms": span("captured", "displayed"),
+            "rtt_ms": round(rtt * 1000.0, 2),
+            "clock_offset_ms": round(offset * 1000.0, 2),
+            # Stage times relative to capture, for timelines
+            "timeline_ms": {stage: round((t - captured) * 1000.0, 2)
+                            for stage, t in stamps.items() if stage != "decode"},
+        }
+
+    # --- Reports ---
+    def summary(self):
+        """Per-stage and per-viewer latency percentiles over the kept traces."""
+        with self.lock:
+            traces = list(self.traces)
+            clients = {sid: (list(latencies), self._clock(sid)) for sid, latencies in self.client_latency.items()}
+
+        def percentiles(values):
+            values = [v for v in values if v is not None]
+            if not values:
+                return None
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+                    "max": round(float(max(values)), 2), "samples": len(values)}
+
+        stages = {name: percentiles(trace["stages_ms"][name] for trace in traces) for name, _, _ in STAGES}
+        stages["decode"] = percentiles(trace["decode_ms"] for trace in traces)
+        return {
+            "camera": self.camera_name,
+            "sample_every": self.sample_every,
+            "traces": len(traces),
+            "capture_to_display_ms": percentiles(trace["capture_to_display_ms"] for trace in traces),
+            "capture_to_receive_ms": percentiles(trace["capture_to_receive_ms"] for trace in traces),
+            "stages_ms": stages,
+            "clients": {
+                sid: {"capture_to_display_ms": percentiles(latencies),
+                      "rtt_ms": round(clock[0] * 1000.0, 2) if clock else None,
+                      "clock_offset_ms": round(clock[1] * 1000.0, 2) if clock else None}
+                for sid, (latencies, clock) in clients.items()
+            },
+        }
+
+    def export(self, limit=None):
+        """The kept traces, oldest first (the newest `limit` if given)."""
+        with self.lock:
+            traces = list(self.traces)
+        return traces[-limit:] if limit else traces
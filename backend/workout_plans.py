@@ -0,0 +1,310 @@
+# backend/workout_plans.py
+"""
+Workout plans for /api/workout/generate-plan (ExercisePlanOverlay.jsx).
+
+Plans are built from templates: a warm-up, a main set drawn from EXERCISES
+for the requested focus areas, and a cool-down, with sets, reps, holds and
+rest sized from the fitness level, goal and target heart-rate zone to fill the
+requested duration; a focus with too few exercises for it repeats the main set
+in rounds. The exercise order comes from a random generator seeded with the
+request, so the same request always yields the same plan. With
+refine=true (or PLAN_LLM_REFINE) the coach LLM adds a few sentences of notes
+on top; the template stays the source of the plan itself.
+
+Requests are normalized first (case, aliases, focus area order, duration
+rounded to 5 minutes), and the normalized tuple is the cache key. The cache
+holds the finished JSON body: a hit is a dict lookup, with no rebuilding or
+re-serializing. Entries are evicted least recently used past PLAN_CACHE_SIZE
+and expire after PLAN_CACHE_TTL_SECONDS. Concurrent identical misses are
+collapsed: the first request builds the plan and the others wait for its
+result (single flight), so a burst never calls the LLM more than once per key.
+"""
+import collections
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+import llm_client
+from heart_rate import ZONE_NAMES
+from config import PLAN_CACHE_SIZE, PLAN_CACHE_TTL_SECONDS, PLAN_LLM_REFINE
+
+FOCUS_AREAS = ("Full Body", "Upper Body", "Lower Body", "Core", "Cardio")
+MIN_DURATION = 10
+MAX_DURATION = 120
+SECONDS_PER_REP = 3
+MAX_SETS = 6
+MAX_ROUNDS = 6  # Main set repeats for a narrow focus over a long session
+REFINE_VALUES = {"true": True, "1": True, "yes": True, "false": False, "0": False, "no": False}
+
+# name, area, timed (held or done for `hold` seconds instead of counted reps)
+EXERCISES = (
+    ("Push-ups", "Upper Body", False),
+    ("Pike Push-ups", "Upper Body", False),
+    ("Tricep Dips", "Upper Body", False),
+    ("Squats", "Lower Body", False),
+    ("Lunges", "Lower Body", False),
+    ("Glute Bridges", "Lower Body", False),
+    ("Wall Sit", "Lower Body", True),
+    ("Plank", "Core", True),
+    ("Sit-ups", "Core", False),
+    ("Bicycle Crunches", "Core", False),
+    ("Burpees", "Full Body", False),
+    ("Mountain Climbers", "Full Body", True),
+    ("Jump Rope", "Cardio", True),
+    ("High Knees", "Cardio", True),
+    ("Skater Jumps", "Cardio", False),
+)
+WARMUP = ("Jumping Jacks", "High Knees", "Arm Circles")
+COOLDOWN = ("Child's Pose", "Hamstring Stretch", "Shoulder Stretch")
+
+# sets, (min reps, max reps), hold seconds, rest seconds between sets
+LEVELS = {
+    "beginner": (2, (8, 12), 30, 60),
+    "intermediate": (3, (12, 15), 40, 45),
+    "advanced": (4, (15, 20), 50, 30),
+}
+# rep multiplier, rest multiplier, areas preferred when filling the main set
+GOALS = {
+    "general": (1.0, 1.0, ()),
+    "strength": (0.7, 1.5, ("Upper Body", "Lower Body")),
+    "endurance": (1.4, 0.75, ("Cardio", "Full Body")),
+    "fat_loss": (1.2, 0.6, ("Cardio", "Full Body")),
+}
+GOAL_ALIASES = {"weight_loss": "fat_loss", "fat_burn": "fat_loss", "muscle": "strength", "cardio": "endurance"}
+# Rest multiplier per target zone: shorter rests keep the heart rate up
+ZONE_REST = dict(zip(ZONE_NAMES, (1.5, 1.25, 1.0, 0.75, 0.5)))
+
+
+# --- Request Normalization ---
+def normalize(data):
+    """Returns the cache key (level, focus areas, duration, goal, zone, refine). Raises ValueError on bad input."""
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object.")
+    level = str(data.get("difficulty") or data.get("fitnessLevel") or "intermediate").strip().lower()
+    if level not in LEVELS:
+        raise ValueError(f"difficulty must be one of {[name.title() for name in LEVELS]}")
+
+    areas = data.get("focusAreas") or ["Full Body"]
+    if isinstance(areas, str):
+        areas = [areas]
+    if not isinstance(areas, (list, tuple)):
+        raise ValueError("focusAreas must be a list of focus areas.")
+    by_name = {area.lower(): area for area in FOCUS_AREAS}
+    try:
+        areas = {by_name[str(area).strip().lower()] for area in areas}
+    except KeyError as e:
+        raise ValueError(f"Unknown focus area {e.args[0]!r}; expected some of {list(FOCUS_AREAS)}")
+    focus = ("Full Body",) if "Full Body" in areas else tuple(sorted(areas))  # Full Body already covers the rest
+
+    try:
+        duration = float(data.get("duration") or 30)
+    except (TypeError, ValueError):
+        raise ValueError("duration must be a number of minutes.")
+    if not math.isfinite(duration):
+        raise ValueError("duration must be a finite number of minutes.")
+    duration = int(min(MAX_DURATION, max(MIN_DURATION, 5 * round(duration / 5))))
+
+    goal = str(data.get("goal") or "general").strip().lower().replace(" ", "_").replace("-", "_")
+    goal = GOAL_ALIASES.get(goal, goal)
+    if goal not in GOALS:
+        raise ValueError(f"goal must be one of {list(GOALS)}")
+
+    zone = data.get("heartRateZone") or data.get("targetZone")
+    if zone is not None:
+        zones = {name.lower(): name for name in ZONE_NAMES}
+        zone = zones.get(str(zone).strip().lower())
+        if zone is None:
+            raise ValueError(f"heartRateZone must be one of {list(ZONE_NAMES)}")
+
+    refine = data.get("refine")
+    if refine is None:
+        refine = PLAN_LLM_REFINE
+    elif not isinstance(refine, bool):
+        refine = REFINE_VALUES.get(str(refine).strip().lower())  # Query-string style "false" must not mean True
+        if refine is None:
+            raise ValueError("refine must be true or false.")
+    return level, focus, duration, goal, zone, refine
+
+
+# --- Templates ---
+def _timed(name, seconds):
+    return {"name": name, "sets": 1, "reps": None, "duration": seconds, "restSeconds": 0, "completed": False}
+
+
+def _stretch_segment(name, exercises, seconds):
+    each = max(20, 5 * round(seconds / len(exercises) / 5))
+    return {"segmentName": name, "exercises": [_timed(exercise, each) for exercise in exercises]}
+
+
+def _set_seconds(exercise):
+    work = exercise["duration"] if exercise["reps"] is None else exercise["reps"] * SECONDS_PER_REP
+    return work + exercise["restSeconds"]
+
+
+def build_plan(key):
+    """The template plan for a normalized key: {"plan": segments, "settings", "estimatedMinutes"}."""
+    level, focus, duration, goal, zone, _ = key
+    sets, (low, high), hold, rest = LEVELS[level]
+    rep_scale, rest_scale, preferred = GOALS[goal]
+    rest = int(5 * round(rest * rest_scale * ZONE_REST.get(zone, 1.0) / 5))
+    rng = random.Random(repr(key))
+
+    edge_seconds = max(180, duration * 6)  # Warm-up and cool-down: 10% of the session each, at least 3 minutes
+    warmup = _stretch_segment("Warm-up", WARMUP, edge_seconds)
+    cooldown = _stretch_segment("Cool-down", COOLDOWN, edge_seconds)
+
+    pool = [exercise for exercise in EXERCISES if "Full Body" in focus or exercise[1] in focus]
+    rng.shuffle(pool)
+    pool.sort(key=lambda exercise: exercise[1] not in preferred)  # Stable: preferred areas first, shuffled within
+
+    budget = duration * 60 - 2 * edge_seconds
+    main = []
+    for name, area, timed in pool:
+        exercise = {"name": name, "area": area, "sets": sets,
+                    "reps": None if timed else max(1, round(rng.randint(low, high) * rep_scale)),
+                    "duration": hold if timed else None, "restSeconds": rest, "completed": False}
+        exercise_seconds = _set_seconds(exercise) * sets
+        if main and exercise_seconds > budget:
+            break
+        main.append(exercise)
+        budget -= exercise_seconds
+    # Fewer exercises than the time allows (narrow focus): add sets, then whole rounds of the main set
+    budget = _add_sets(main, budget)
+    rounds = [main]
+    while len(rounds) < MAX_ROUNDS:
+        extra = [dict(exercise, sets=0) for exercise in main]
+        budget = _add_sets(extra, budget)
+        extra = [exercise for exercise in extra if exercise["sets"]]
+        if not extra:
+            break
+        rounds.append(extra)
+
+    segments = [warmup]
+    segments += [{"segmentName": "Main Set" if number == 1 else f"Main Set (Round {number})", "exercises": exercises}
+                 for number, exercises in enumerate(rounds, 1)]
+    segments.append(cooldown)
+    seconds = sum(_set_seconds(exercise) * exercise["sets"] for segment in segments for exercise in segment["exercises"])
+    return {
+        "plan": segments,
+        "settings": {"difficulty": level.title(), "focusAreas": list(focus), "duration": duration, "goal": goal,
+                     "heartRateZone": zone},
+        "rounds": len(rounds),
+        "estimatedMinutes": round(seconds / 60.0, 1),
+    }
+
+
+def _add_sets(exercises, budget):
+    """Adds sets round-robin, up to MAX_SETS each, while they fit in `budget` seconds. Returns what is left."""
+    added = True
+    while added:
+        added = False
+        for exercise in exercises:
+            if exercise["sets"] < MAX_SETS and _set_seconds(exercise) <= budget:
+                exercise["sets"] += 1
+                budget -= _set_seconds(exercise)
+                added = True
+    return budget
+
+
+def refine_notes(plan):
+    """A few sentences of coaching notes for the plan from the coach LLM."""
+    settings = plan["settings"]
+    lines = [f"{exercise['name']}: {exercise['sets']} x "
+             + (f"{exercise['reps']} reps" if exercise["reps"] is not None else f"{exercise['duration']}s")
+             for exercise in plan["plan"][1]["exercises"]]
+    notes, _ = llm_client.complete([
+        {"role": "system", "content": "You are an expert fitness coach. In at most three sentences, give coaching "
+                                      "notes for this workout: pacing, form cues and what to adjust if it feels "
+                                      "too easy or too hard. Do not restate the plan."},
+        {"role": "user", "content": f"{settings['difficulty']} level, goal {settings['goal']}, "
+                                    f"{settings['duration']} minutes, target heart-rate zone "
+                                    f"{settings['heartRateZone'] or 'any'}. Main set, {plan['rounds']} round(s): "
+                                    + "; ".join(lines)},
+    ])
+    return notes.strip()
+
+
+def generate(key):
+    """Returns (JSON body, cacheable). A failed refinement still returns the template plan, uncached."""
+    start = time.perf_counter()
+    plan = build_plan(key)
+    cacheable = True
+    if key[-1]:
+        try:
+            plan["notes"] = refine_notes(plan)
+        except Exception as e:
+            print(f"[plans] WARNING: LLM refinement failed, serving the template plan: {e}")
+            cacheable = False
+    plan["generatedAt"] = time.time()
+    _build_seconds.observe(time.perf_counter() - start)
+    return json.dumps(plan, separators=(",", ":")), cacheable
+
+
+# --- Cache ---
+_lock = threading.Lock()  # Guards both the cache and the in-flight builds
+_cache = collections.OrderedDict()  # key -> (expires at, JSON body), least recently used first
+_inflight = {}  # key -> Future for the build in progress
+_build_seconds = metrics.histogram("plan_build_seconds", "Time to build one workout plan (cache miss).")
+metrics.register_collector(lambda: [
+    ("plan_cache_entries", "gauge", "Workout plans held in the plan cache.", [({}, len(_cache))]),
+])
+
+
+def _outcome(outcome):
+    return metrics.counter("plan_requests_total", "Workout plan requests by cache outcome.", outcome=outcome)
+
+
+def _cached(key, now):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= now:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return entry[1]
+
+
+def get_plan(data):
+    """Returns (JSON body, "hit" | "shared" | "miss") for a request body. Raises ValueError on bad input."""
+    key = normalize(data)
+    with _lock:
+        body = _cached(key, time.monotonic())
+        if body is None:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = _inflight[key] = Future()
+    if body is not None:
+        _outcome("hit").inc()
+        return body, "hit"
+    if not leader:
+        _outcome("shared").inc()
+        return future.result(), "shared"
+
+    _outcome("miss").inc()
+    try:
+        body, cacheable = generate(key)
+    except BaseException as e:
+        with _lock:
+            del _inflight[key]
+        future.set_exception(e)
+        raise
+    with _lock:
+        del _inflight[key]
+        if cacheable:
+            _cache[key] = (time.monotonic() + PLAN_CACHE_TTL_SECONDS, body)
+            while len(_cache) > PLAN_CACHE_SIZE:
+                _cache.popitem(last=False)
+    future.set_result(body)
+    return body, "miss"
+
+
+def clear():
+    """Drops every cached plan (plans in progress still finish)."""
+    with _lock:
+        _cache.clear()
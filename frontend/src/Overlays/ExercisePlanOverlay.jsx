@@ -34,6 +34,22 @@ const exerciseDatabase = [
   { name: "Jump Rope", icon: faBell, area: "Cardio" }
 ];
 
+// Server plans carry names and areas only; icons are looked up here
+const iconsByName = Object.fromEntries(
+  [...warmupExercises, ...cooldownExercises, ...exerciseDatabase].map(ex => [ex.name, ex.icon])
+);
+const iconsByArea = { Core: faCircle, Cardio: faRunning, "Full Body": faRunning };
+
+function withIcons(plan) {
+  return plan.map(seg => ({
+    ...seg,
+    exercises: seg.exercises.map(ex => ({
+      ...ex,
+      icon: iconsByName[ex.name] || iconsByArea[ex.area] || faDumbbell
+    }))
+  }));
+}
+
 function randomInt(min, max) {
   return Math.floor(Math.random() * (max - min + 1)) + min;
 }
@@ -133,7 +149,7 @@ export default function ExercisePlanOverlay({ open = false, onClose = () => {} }
       });
       if (!res.ok) throw new Error("Network response was not ok");
       const json = await res.json();
-      return json.plan;
+      return withIcons(json.plan);
     } catch (err) {
       console.warn("AI plan generation failed, using fallback.", err);
       return generatePlanLocal();
@@ -5,7 +5,11 @@ import { io } from "socket.io-client";
 export default class StreamManager {
   constructor(onFrame, onCounts, onConnect, onError, onDetections) {
     // === Socket Initialization ===
+    // Websocket first: fan-out workers (backend/fanout.py) don't accept long-polling.
+    // Servers without websocket support still get a polling fallback.
     this.socket = io("http://localhost:5000", {
+      transports: ["websocket", "polling"],
+      tryAllTransports: true,
       reconnectionAttempts: 5,
       timeout: 5000,
       pingInterval: 25000,
@@ -21,6 +25,7 @@ export default class StreamManager {
     // === Frame Queue & Metrics ===
     this.maxQueueSize       = 1;
     this.frameQueue         = [];
+    this.lastFrame          = null; // Newest received frame entry, waiting for its frame id
     this.processingFrame    = false;
     this.animationFrameId   = null;
     this.skippedFrames      = 0;
@@ -28,6 +33,10 @@ export default class StreamManager {
     this.fpsTimer           = performance.now();
     this.currentRenderFps   = 0;
 
+    // === Heart Rate Upload ===
+    this.heartRateSamples   = []; // Buffered {bpm, timestamp} samples, sent as one 'heart_rate' batch
+    this.heartRateTimer     = null;
+
     // === Connection Events ===
     this.socket.on("connect", () => {
       console.log("StreamManager: Socket connected", this.socket.id);
@@ -49,7 +58,7 @@ export default class StreamManager {
 
     // 1) Video frames
     this.socket.on("frame", (buffer) => {
-      this._handleFrame(buffer, onFrame);
+      this._handleFrame({ buffer, received: performance.now(), displayed: null, frameId: null, trace: false }, onFrame);
     });
 
     // 2) Workout counts (pushups, situps, etc.)
@@ -59,6 +68,13 @@ export default class StreamManager {
 
     // 3) Object detections — normalize missing fields
     this.socket.on("detections", raw => {
+      // The server stamps each frame's id on the detections that follow it; sampled frames get acked
+      if (this.lastFrame && raw.frame_id != null && this.lastFrame.frameId == null) {
+        this.lastFrame.frameId = raw.frame_id;
+        this.lastFrame.trace   = raw.trace === true;
+        this._ackFrame(this.lastFrame);
+      }
+
       let bbox = null;
 
       if (raw.bbox && typeof raw.bbox === 'object') {
@@ -76,9 +92,9 @@ export default class StreamManager {
       onDetections?.(detectionData);
     });
 
-    // 4) Ping for debug/latency
+    // 4) Ping for latency: echo the server's clock with ours so it can map our timestamps onto its own
     this.socket.on("ping", (data) => {
-      console.log("StreamManager: ping", data);
+      this.socket.emit("pong", { server_mono: data?.server_mono, client_time: performance.now() });
     });
 
     // === Periodic Metrics Logging ===
@@ -108,14 +124,15 @@ export default class StreamManager {
   }
 
   // === Internal frame buffering & loop start ===
-  _handleFrame(buffer, onFrame) {
+  _handleFrame(entry, onFrame) {
     try {
       // Drop oldest if queue is full
       while (this.frameQueue.length >= this.maxQueueSize) {
         this.frameQueue.shift();
         this.skippedFrames++;
       }
-      this.frameQueue.push(buffer);
+      this.frameQueue.push(entry);
+      this.lastFrame = entry;
 
       if (!this.processingFrame) {
         this.startProcessingFrames(onFrame);
@@ -134,11 +151,13 @@ export default class StreamManager {
         this.processingFrame = false;
         return;
       }
-      const buffer = this.frameQueue.shift();
+      const entry = this.frameQueue.shift();
       this.fpsRenderCounter++;
 
       try {
-        onFrame?.(buffer);
+        onFrame?.(entry.buffer);
+        entry.displayed = performance.now();
+        this._ackFrame(entry);
       } catch (err) {
         console.error("StreamManager: Error processing frame", err);
       }
@@ -149,6 +168,13 @@ export default class StreamManager {
     this.animationFrameId = requestAnimationFrame(loop);
   }
 
+  // Reports receive/display times of a traced frame once both its id and display time are known
+  _ackFrame(entry) {
+    if (!entry.trace || entry.frameId == null || entry.displayed == null) return;
+    entry.trace = false;
+    this.socket.emit("frame_ack", { frame_id: entry.frameId, received: entry.received, displayed: entry.displayed });
+  }
+
   // === Stop & Cleanup ===
   stopProcessingFrames() {
     this.processingFrame = false;
@@ -158,9 +184,31 @@ export default class StreamManager {
     }
   }
 
+  // === Heart Rate ===
+  // Samples are batched for up to a second so a 1 Hz+ monitor costs one emit per second
+  sendHeartRate(bpm, userId) {
+    if (!bpm) return;
+    this.heartRateSamples.push({ bpm, timestamp: Date.now() });
+    this.heartRateUserId = userId;
+    if (!this.heartRateTimer) {
+      this.heartRateTimer = setTimeout(() => this._flushHeartRate(), 1000);
+    }
+  }
+
+  _flushHeartRate() {
+    this.heartRateTimer = null;
+    if (!this.heartRateSamples.length || !this.socket.connected) return; // Kept until the next flush
+    const samples = this.heartRateSamples.splice(0);
+    this.socket.emit("heart_rate", { userId: this.heartRateUserId, samples });
+  }
+
   disconnect() {
     this.stopProcessingFrames();
     this.frameQueue = [];
+    if (this.heartRateTimer) {
+      clearTimeout(this.heartRateTimer);
+      this._flushHeartRate();
+    }
     if (this.socket.connected) {
       console.log("StreamManager: Disconnecting socket...");
       this.socket.close();
@@ -36,6 +36,7 @@ const METRICS_INTERVAL = 1000;
 export default function WorkoutPlayer() {
   const canvasRef = useRef(null);
   const videoRef = useRef(null);
+  const streamManagerRef = useRef(null);
 
   // Overlay visibility
   const [showDetection, setShowDetection] = useState(false);
@@ -290,7 +291,9 @@ export default function WorkoutPlayer() {
         }
       }
     );
+    streamManagerRef.current = manager;
     return () => {
+      streamManagerRef.current = null;
       manager.disconnect(); 
         if (canvasRef.current && canvasRef.current.getContext("2d")) {
         // Optional: Clear canvas or draw a disconnected message
@@ -299,6 +302,16 @@ export default function WorkoutPlayer() {
     };
   }, [showPose]); 
 
+  // Upload heart rate once a second (BLE only notifies on change, so a steady rate still gets samples)
+  const currentBpmRef = useRef(0);
+  currentBpmRef.current = heartRate || btHeartRateFromBike || 0;
+  useEffect(() => {
+    const timer = setInterval(() => {
+      streamManagerRef.current?.sendHeartRate(currentBpmRef.current);
+    }, 1000);
+    return () => clearInterval(timer);
+  }, []);
+
   // HR handlers (for dedicated HR monitor)
   const handleHrScanning = () => { setHrStatus('scanning'); setHrError(null); setHeartRate(null); };
   const handleHrConnecting = () => { setHrStatus('connecting'); setHrError(null); };
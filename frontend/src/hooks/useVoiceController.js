@@ -8,6 +8,51 @@ const ACTIVATION_TIMEOUT = 5000;
 const WAKE_WORDS = ['hey coach', 'coach', 'hey trainer', 'trainer'];
 const API_BASE = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
+// Reads /api/chat/stream (Server-Sent Events): calls onDelta with each piece of text, resolves to the full reply
+async function readChatStream(res, onDelta) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let reply = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) return reply;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf('\n\n')) !== -1) {
+      const message = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      const event = (message.match(/^event: (.*)$/m) || [])[1] || 'message';
+      const data = JSON.parse((message.match(/^data: (.*)$/m) || [])[1] || '{}');
+      if (event === 'error') throw new Error(data.details || data.error);
+      if (event === 'done') return data.content;
+      if (data.delta) {
+        reply += data.delta;
+        onDelta(data.delta);
+      }
+    }
+  }
+}
+
+// Collects streamed text and hands complete sentences to onSentence
+function sentenceSplitter(onSentence) {
+  let pending = '';
+  return {
+    push(text) {
+      pending += text;
+      let match;
+      while ((match = pending.match(/^[\s\S]*?[.!?]+["')\]]*\s+/))) {
+        onSentence(match[0].trim());
+        pending = pending.slice(match[0].length);
+      }
+    },
+    flush() {
+      if (pending.trim()) onSentence(pending.trim());
+      pending = '';
+    }
+  };
+}
+
 export function useVoiceController({ counts, detection, heartRate, onCommandProcessed }) {
   const [isSupported]    = useState(!!SpeechRecognition && !!speechSynthesis);
   const [isListening, setIsListening]  = useState(false);
@@ -42,6 +87,27 @@ export function useVoiceController({ counts, detection, heartRate, onCommandProc
     }
   }, [isListening]);
 
+  // Builds an utterance with the selected voice and coaching tone
+  const makeUtterance = useCallback((text) => {
+    const utter = new SpeechSynthesisUtterance(text);
+    if (selectedVoice) {
+      utter.voice = selectedVoice;
+      utter.lang  = selectedVoice.lang;
+    }
+    // Adjust voice characteristics for coaching
+    utter.rate = 1.05; // Slightly faster than normal
+    utter.pitch = 1.1; // Slightly higher pitch for enthusiasm
+    utter.volume = 1.0; // Full volume
+
+    utter.onstart = () => setIsSpeaking(true);
+    utter.onend   = () => setIsSpeaking(speechSynthesis.pending || speechSynthesis.speaking);
+    utter.onerror = e => {
+      setVoiceError(`Synthesis error: ${e.error}`);
+      setIsSpeaking(false);
+    };
+    return utter;
+  }, [selectedVoice]);
+
   // Speech synthesis function - DEFINED FIRST to fix the circular dependency
   const speak = useCallback((text) => {
     if (!isSupported || !text || isSpeaking) return;
@@ -50,23 +116,7 @@ export function useVoiceController({ counts, detection, heartRate, onCommandProc
     try {
       if (speechSynthesis) {
         speechSynthesis.cancel();
-        const utter = new SpeechSynthesisUtterance(text);
-        if (selectedVoice) {
-          utter.voice = selectedVoice;
-          utter.lang  = selectedVoice.lang;
-        }
-        // Adjust voice characteristics for coaching
-        utter.rate = 1.05; // Slightly faster than normal
-        utter.pitch = 1.1; // Slightly higher pitch for enthusiasm
-        utter.volume = 1.0; // Full volume
-        
-        utter.onstart = () => setIsSpeaking(true);
-        utter.onend   = () => setIsSpeaking(false);
-        utter.onerror = e => {
-          setVoiceError(`Synthesis error: ${e.error}`);
-          setIsSpeaking(false);
-        };
-        speechSynthesis.speak(utter);
+        speechSynthesis.speak(makeUtterance(text));
       } else {
         console.error('[Voice] Speech synthesis not available');
         setVoiceError('Speech synthesis not supported');
@@ -75,7 +125,18 @@ export function useVoiceController({ counts, detection, heartRate, onCommandProc
       console.error('[Voice] Speech synthesis error:', e);
       setVoiceError(`Speech synthesis error: ${e.message}`);
     }
-  }, [isSupported, isListening, isSpeaking, selectedVoice, stopListening]);
+  }, [isSupported, isListening, isSpeaking, stopListening, makeUtterance]);
+
+  // Queues text after whatever is already being spoken (streamed replies, one sentence at a time)
+  const speakQueued = useCallback((text) => {
+    if (!isSupported || !text.trim()) return;
+    try {
+      speechSynthesis.speak(makeUtterance(text));
+    } catch (e) {
+      console.error('[Voice] Speech synthesis error:', e);
+      setVoiceError(`Speech synthesis error: ${e.message}`);
+    }
+  }, [isSupported, makeUtterance]);
 
   const startListening = useCallback(() => {
     console.log('[Voice] startListening');
@@ -196,16 +257,19 @@ export function useVoiceController({ counts, detection, heartRate, onCommandProc
       await trackExerciseData();
       await runPoseAnalysis();
       const systemMsg = { role: 'system', content: `You are an expert coach. Stats: Push-ups ${countsRef.current.pushups}, Sit-ups ${countsRef.current.situps}, HR ${hrRef.current}` };
-      const res = await fetch(`${API_BASE}/api/chat`, {
+      const res = await fetch(`${API_BASE}/api/chat/stream`, {
         method: 'POST', headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ messages: [systemMsg, ...dialogueHistory, { role: 'user', content: text }] }),
         signal: abortControllerRef.current.signal
       });
       if (!res.ok) throw new Error(`HTTP ${res.status}`);
-      const json = await res.json();
-      const reply = json.response.content;
+      // Speak each sentence as soon as it is complete rather than after the whole reply
+      if (isListening) stopListening();
+      speechSynthesis?.cancel();
+      const sentences = sentenceSplitter(speakQueued);
+      const reply = await readChatStream(res, sentences.push);
+      sentences.flush();
       setDialogueHistory(h => [...h, { role: 'assistant', content: reply }]);
-      speak(reply);
       onCommandProcessed?.(text, reply);
     } catch (err) {
       console.error('[Voice] LLM error:', err);
@@ -216,7 +280,7 @@ export function useVoiceController({ counts, detection, heartRate, onCommandProc
     } finally {
       setIsStreaming(false);
     }
-  }, [dialogueHistory, runPoseAnalysis, trackExerciseData, speak, onCommandProcessed]);
+  }, [dialogueHistory, runPoseAnalysis, trackExerciseData, speak, speakQueued, isListening, stopListening, onCommandProcessed]);
 
   // Set up processViaLLMRef
   useEffect(() => {